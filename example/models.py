@@ -1,6 +1,6 @@
 from django.db import models
 from trustedhtml.fields import TrustedTextField, TrustedCharField
-from trustedhtml.rules.html import pretty
+from trustedhtml.rules import pretty
 
 
 class MyModel(models.Model):
@@ -1,8 +1,23 @@
+import BaseHTTPServer
+import os
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from StringIO import StringIO
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import Client
 from django.test.testcases import TestCase
+from django.utils import simplejson
 from example.models import MyModel, ExternalModel
+from trustedhtml import settings
+from trustedhtml import verification
+from trustedhtml.classes import Html, Element, Uri
+from trustedhtml.models import Link
+from trustedhtml.precompiled import get_presets
 
 
 class ViewsTest(unittest.TestCase):
@@ -63,3 +78,217 @@ class AdminTest(TestCase):
         self.assertEqual(ExternalModel.objects.get().name, self.TRUSTED_TEXT % 'name')
         self.assertEqual(ExternalModel.objects.get().description, self.TRUSTED_TEXT % 'description')
         self.assertEqual(ExternalModel.objects.get().not_trusted, self.XSS_TEXT % 'not_trusted')
+
+
+class ResanitizeTest(TestCase):
+
+    XSS_TEXT = AdminTest.XSS_TEXT
+    TRUSTED_TEXT = AdminTest.TRUSTED_TEXT
+
+    def setUp(self):
+        self.first = MyModel.objects.create(html=self.XSS_TEXT % 'first', short='')
+        self.second = MyModel.objects.create(
+            html=self.TRUSTED_TEXT % 'second', short=self.XSS_TEXT % 'second')
+        self.external = ExternalModel.objects.create(
+            name=self.XSS_TEXT % 'name', description=self.TRUSTED_TEXT % 'description',
+            not_trusted=self.XSS_TEXT % 'not_trusted')
+
+    def resanitize(self, *args, **kwargs):
+        stdout = StringIO()
+        kwargs.setdefault('processes', 1)
+        call_command('trusted_resanitize', *args, stdout=stdout, stderr=StringIO(), **kwargs)
+        return stdout.getvalue()
+
+    def test_dry_run(self):
+        output = self.resanitize(dry_run=True)
+        self.assertTrue('example.MyModel: 2 rows, 2 changed, 0 failed.' in output)
+        self.assertTrue('example.ExternalModel: 1 rows, 1 changed, 0 failed.' in output)
+        self.assertTrue('+%s' % self.TRUSTED_TEXT % 'first' in output)
+        self.assertEqual(MyModel.objects.get(pk=self.first.pk).html, self.XSS_TEXT % 'first')
+
+    def test_resanitize(self):
+        self.resanitize(chunk=1)
+        first = MyModel.objects.get(pk=self.first.pk)
+        self.assertEqual(first.html, self.TRUSTED_TEXT % 'first')
+        self.assertEqual(first.short, '')
+        second = MyModel.objects.get(pk=self.second.pk)
+        self.assertEqual(second.html, self.TRUSTED_TEXT % 'second')
+        self.assertEqual(second.short, self.TRUSTED_TEXT % 'second')
+        external = ExternalModel.objects.get()
+        self.assertEqual(external.name, self.TRUSTED_TEXT % 'name')
+        self.assertEqual(external.not_trusted, self.XSS_TEXT % 'not_trusted')
+        output = self.resanitize('example.MyModel')
+        self.assertTrue('example.MyModel: 2 rows, 0 changed, 0 failed.' in output)
+        self.assertFalse('ExternalModel' in output)
+
+    def test_checkpoint(self):
+        handle, checkpoint = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(checkpoint)
+        try:
+            self.resanitize('example.MyModel', checkpoint=checkpoint)
+            MyModel.objects.filter(pk=self.first.pk).update(html=self.XSS_TEXT % 'first')
+            output = self.resanitize('example.MyModel', checkpoint=checkpoint)
+            self.assertTrue('example.MyModel: 0 rows' in output)
+            self.assertEqual(MyModel.objects.get(pk=self.first.pk).html, self.XSS_TEXT % 'first')
+        finally:
+            os.remove(checkpoint)
+
+
+class VerifyLinksTest(TestCase):
+
+    def setUp(self):
+        requests = self.requests = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                requests.append(self.path)
+                if self.path.startswith('/ok'):
+                    self.send_response(200)
+                else:
+                    self.send_response(404)
+                self.end_headers()
+
+            do_GET = do_HEAD
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.deferred = settings.TRUSTEDHTML_VERIFY_DEFERRED
+        settings.TRUSTEDHTML_VERIFY_DEFERRED = True
+        self.verifier = verification._verifier[:]
+        verification._verifier[:] = [verification.Verifier(cache=False)]
+        self.field = MyModel._meta.get_field('html')
+        self.validator = self.field.validator
+        self.field.validator = Html(rules={
+            'p': Element(rules={}),
+            'a': Element(rules={'href': Uri(verify_sites=True, allow_sites=True)}),
+        })
+
+    def test_verify_links(self):
+        source = '<p><a href="%sok">a</a><a href="%sdead">b</a></p>' % (self.url, self.url)
+        result = '<p><a href="%sok">a</a><a>b</a></p>' % self.url
+        self.assertEqual(self.field.validator.validate(source), source)
+        self.assertEqual(self.field.validator.validate(source), source)
+        self.assertEqual(self.requests, [])
+        self.assertEqual(Link.objects.count(), 2)
+        instance = MyModel.objects.create(html=source, short='')
+        stdout = StringIO()
+        call_command('trusted_verify_links', stdout=stdout)
+        self.assertTrue('2 links checked, 1 not available.' in stdout.getvalue())
+        self.assertEqual(MyModel.objects.get(pk=instance.pk).html, result)
+        self.assertEqual(Link.objects.get(url=self.url + 'dead').available, False)
+        self.assertEqual(Link.objects.get(url=self.url + 'ok').available, True)
+        count = len(self.requests)
+        self.assertEqual(self.field.validator.validate(source), result)
+        call_command('trusted_verify_links', stdout=StringIO())
+        self.assertEqual(len(self.requests), count)
+
+    def test_link_text(self):
+        # Links without scheme and local links are checked by other urls.
+        self.field.validator = Html(rules={
+            'p': Element(rules={}),
+            'a': Element(rules={'href': Uri(verify_sites=True, allow_sites=True,
+                verify_local=self.url[len('http://'):-1])}),
+        })
+        source = ('<p><a href="%sdead-remote">a</a><a href="/dead-local?a=1&amp;b=2">b</a>'
+            '<a href="/ok">c</a></p>' % self.url[len('http:'):])
+        self.assertEqual(self.field.validator.validate(source), source)
+        instance = MyModel.objects.create(html=source, short='')
+        self.assertEqual(sorted(Link.objects.values_list('url', 'text')), [
+            (self.url + 'dead-local?a=1&b=2', '/dead-local?a=1&b=2'),
+            (self.url + 'dead-remote', '%sdead-remote' % self.url[len('http:'):]),
+            (self.url + 'ok', '/ok'),
+        ])
+        call_command('trusted_verify_links', stdout=StringIO())
+        self.assertEqual(MyModel.objects.get(pk=instance.pk).html,
+            '<p><a>a</a><a>b</a><a href="/ok">c</a></p>')
+
+    def tearDown(self):
+        self.field.validator = self.validator
+        verification._verifier[:] = self.verifier
+        settings.TRUSTEDHTML_VERIFY_DEFERRED = self.deferred
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_bench(self):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            stdout = StringIO()
+            call_command('trusted_bench', presets=['pretty'], documents=['nested'],
+                number=1, output=output, stdout=stdout)
+            self.assertTrue('pretty  nested' in stdout.getvalue())
+            results = simplejson.load(open(output))
+            result = results['results']['pretty']['nested']
+            self.assertEqual(sorted(result['stages']),
+                ['correct', 'parse', 'serialize', 'transform'])
+            self.assertEqual(sorted(result['passes']), ['clear', 'collapse', 'wrap'])
+            self.assertTrue(result['validate'] > 0)
+            self.assertTrue(result['peak'] > 0)
+        finally:
+            os.remove(output)
+
+
+class RulesImportTest(unittest.TestCase):
+
+    def test_submodules(self):
+        # New process, so that rules are not imported by other tests.
+        code = ('import sys; from trustedhtml import rules; '
+            'print "trustedhtml.rules.html" in sys.modules, '
+            'rules.html.pretty.validate("<p>a</p>"), rules.css.common.__class__.__name__')
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, env=env)
+        self.assertEqual(process.communicate()[0].split(), ['False', '<p>a</p>', 'Style'])
+
+
+class CompileRulesTest(unittest.TestCase):
+
+    def test_compile_rules(self):
+        fd, output = tempfile.mkstemp(suffix='.rules')
+        os.close(fd)
+        try:
+            stdout = StringIO()
+            call_command('trusted_compile_rules', output=output, stdout=stdout)
+            self.assertTrue(output in stdout.getvalue())
+            compiled_rules = settings.TRUSTEDHTML_COMPILED_RULES
+            settings.TRUSTEDHTML_COMPILED_RULES = output
+            try:
+                presets = get_presets()
+            finally:
+                settings.TRUSTEDHTML_COMPILED_RULES = compiled_rules
+            self.assertEqual(presets['pretty'].validate('<p>a<script>b</script></p>'), '<p>a</p>')
+        finally:
+            os.remove(output)
+
+    def test_import_html(self):
+        fd, output = tempfile.mkstemp(suffix='.rules')
+        os.close(fd)
+        try:
+            call_command('trusted_compile_rules', output=output, stdout=StringIO())
+            # New process, so that rules are not imported by other tests.
+            code = ('from trustedhtml import rules, settings; '
+                'from trustedhtml.precompiled import get_presets; '
+                'settings.TRUSTEDHTML_COMPILED_RULES = %r; '
+                'print rules.pretty.rules is get_presets()["pretty"].rules; '
+                'from trustedhtml.rules import html; '
+                'html.pretty.rules["strong"].remove_element = True; '
+                'print rules.pretty.rules is html.pretty.rules, '
+                'rules.pretty.validate("<p><strong>a</strong></p>")') % output
+            env = os.environ.copy()
+            env['PYTHONPATH'] = os.pathsep.join(sys.path)
+            process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, env=env)
+            self.assertEqual(process.communicate()[0].split(), ['True', 'True', '<p>a</p>'])
+        finally:
+            os.remove(output)
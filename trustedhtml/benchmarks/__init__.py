@@ -0,0 +1,56 @@
+"""
+Benchmarks for trustedhtml.
+
+Each module has ``run`` function that prints results.
+Django settings must be configured, for example::
+
+    DJANGO_SETTINGS_MODULE=settings python -m trustedhtml.benchmarks.engine
+
+``trustedhtml.benchmarks.suite`` is also available
+as ``manage.py trusted_bench`` command.
+"""
+
+import os
+import cPickle
+import timeit
+
+
+def measure(function, number=10, repeat=3):
+    """
+    Returns the best time in seconds of one call of ``function``.
+
+    ``number`` is number of calls per measurement.
+
+    ``repeat`` is number of measurements.
+    """
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def isolated(function):
+    """
+    Calls ``function`` in child process to measure its peak memory.
+
+    Returns (result, peak) where ``result`` is returned by ``function``
+    (it must be picklable) and ``peak`` is peak memory in megabytes.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read)
+        try:
+            data = cPickle.dumps(function(), cPickle.HIGHEST_PROTOCOL)
+            output = os.fdopen(write, 'wb')
+            output.write(data)
+            output.close()
+        finally:
+            os._exit(0)
+    os.close(write)
+    input = os.fdopen(read, 'rb')
+    data = input.read()
+    input.close()
+    pid, status, usage = os.wait4(pid, 0)
+    if not data:
+        raise RuntimeError('Benchmark failed in child process')
+    # ru_maxrss is in kilobytes on Linux
+    return cPickle.loads(data), usage.ru_maxrss / 1024.0
@@ -0,0 +1,28 @@
+"""
+Measures ``Html.collapse`` on deep nesting.
+Time per element must not grow with depth.
+"""
+
+from time import time
+
+from trustedhtml.rules import html
+from trustedhtml.benchmarks.corpus import nested
+
+
+def run(depths=(25, 50, 100, 200), number=5):
+    rule = html.full
+    print '%8s %12s %14s' % ('depth', 'collapse', 'per element')
+    for depth in depths:
+        value = rule.correct(nested(depth))
+        soups = [
+            rule.clear(rule.parse(value), [rule])
+            for index in xrange(number)]
+        start = time()
+        for soup in soups:
+            rule.collapse(soup)
+        total = (time() - start) / number
+        print '%8d %10.2fms %12.2fus' % (
+            depth, total * 1000, total * 1000000 / (depth * 4))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,34 @@
+"""
+Compares start up of process that builds presets from sources
+with process that loads them from file saved by ``trusted_compile_rules``.
+Presets are completely prepared in both cases (all expressions compiled),
+like in worker that already validated all kinds of documents.
+"""
+
+import os
+import tempfile
+
+from trustedhtml.benchmarks.imports import measure_import
+from trustedhtml.precompiled import PRESETS, dump
+
+
+def run(repeat=5):
+    from trustedhtml.rules import html
+    descriptor, path = tempfile.mkstemp(suffix='.rules')
+    os.close(descriptor)
+    try:
+        dump(dict([(name, getattr(html, name)) for name in PRESETS]), path)
+        cases = [
+            ('build', 'from trustedhtml.rules import html; from trustedhtml.classes import precompile; '
+                '[precompile(getattr(html, name)) for name in %r]' % PRESETS),
+            ('load', 'from trustedhtml.precompiled import load; load(%r)' % path),
+        ]
+        print '%-8s %9s %8s' % ('presets', 'time', 'memory')
+        for name, statement in cases:
+            elapsed, memory = measure_import(statement, repeat)
+            print '%-8s %7.1fms %6.2fMb' % (name, elapsed * 1000, memory)
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,50 @@
+"""
+Compares memoized Complex matching with backtracking
+(previous implementation) for long shorthand values.
+Time of memoized matching must grow linearly with number of parts.
+"""
+
+from trustedhtml.classes import Complex, FAILURE
+from trustedhtml.rules.css import box, colors, fonts, generate
+from trustedhtml.benchmarks import measure
+
+
+class Backtracking(Complex):
+    """Complex rule that tries all combinations of parts and rules."""
+
+    def complex_result(self, values, path, value_index, rule_index):
+        if value_index >= len(values):
+            return values
+        if rule_index >= len(self.rules):
+            return FAILURE
+        value = self.rules[rule_index].attempt(values[value_index], path)
+        if value is not FAILURE:
+            result = self.complex_result(values, path, value_index + 1, rule_index + 1)
+            if result is not FAILURE:
+                result[value_index] = value
+                return result
+        return self.complex_result(values, path, value_index, rule_index + 1)
+
+
+def run(number=20, sizes=(3, 6, 12, 100, 1000)):
+    cases = [
+        # Parts are suitable for several rules, the last one is incorrect.
+        ('border', box.border, ['thin', 'medium', '1px', 'solid', 'red']),
+        ('background', colors.background, ['red', 'none', 'left', 'top', 'center']),
+        ('font', fonts.font, ['italic', 'normal', 'bold', '12px', 'serif']),
+        ('list-style', generate.list_style, ['none', 'inside', 'disc']),
+    ]
+    print '%-12s %6s %12s %12s' % ('rule', 'parts', 'backtracking', 'memoized')
+    for name, shorthand, parts in cases:
+        rule = [item for item in shorthand.rules if isinstance(item, Complex)][0]
+        memoized = Complex(rules=rule.rules)
+        backtracking = Backtracking(rules=rule.rules)
+        for size in sizes:
+            value = ' '.join([parts[index % len(parts)] for index in xrange(size - 1)] + ['wrong'])
+            times = [measure(lambda: variant.attempt(value, []), number)
+                for variant in [backtracking, memoized]]
+            print '%-12s %6d %10.2fms %10.2fms' % (
+                name, size, times[0] * 1000, times[1] * 1000)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,116 @@
+"""
+Inputs for benchmarks.
+"""
+
+TINYMCE_PARAGRAPH = u"""
+<p>Lorem <strong>ipsum</strong> dolor <em>sit</em> amet, <a href="http://example.com/%(index)d">consectetur</a> adipisicing elit,
+sed do <span style="text-decoration: underline;">eiusmod</span> tempor&nbsp;incididunt ut labore et dolore magna aliqua.</p>
+<p><img style="float: right;" src="/media/img/%(index)d.png" alt="" width="94" height="94" />Ut enim ad minim veniam &amp; more.</p>
+<ul>
+<li>quis nostrud</li>
+<li>exercitation <strong>ullamco</strong></li>
+</ul>
+<table border="0">
+<tbody>
+<tr>
+<td>laboris</td>
+<td style="text-align: center;">nisi</td>
+</tr>
+</tbody>
+</table>
+<p>&nbsp;</p>
+"""
+
+
+def tinymce(paragraphs=10):
+    """Returns typical post created by TinyMCE."""
+    return u''.join([
+        TINYMCE_PARAGRAPH % {'index': index}
+        for index in xrange(paragraphs)])
+
+
+def nested(depth=100, tag='span'):
+    """
+    Returns paragraphs with deep nesting of ``tag``
+    like in documents pasted from Word.
+    """
+    start = u'<%s style="font-size: 10pt;">' % tag
+    end = u'</%s>' % tag
+    return u''.join([
+        u'<p>%s%s%s</p>' % (start * depth, content, end * depth)
+        for content in [u'text', u' ', u'&nbsp;', u'']])
+
+
+WORD_PARAGRAPH = u"""
+<!--[if gte mso 9]><xml><w:WordDocument><w:View>Normal</w:View></w:WordDocument></xml><![endif]-->
+<p class="MsoNormal" style="margin: 0cm 0cm 10pt; line-height: 115%%;"><span style="font-size: 12pt; line-height: 115%%; font-family: 'Times New Roman','serif'; color: #1f497d;" lang="EN-US">Paragraph %(index)d
+<b style="mso-bidi-font-weight: normal;"><span style="font-family: Arial;">pasted</span></b>
+from <i><span style="font-family: Arial; color: red;">Word</span></i></span><span lang="EN-US"><o:p></o:p></span></p>
+<p class="MsoListParagraphCxSpFirst" style="text-indent: -18pt; mso-list: l0 level1 lfo1;"><span style="font-family: Symbol;">&middot;<span style="font: 7pt 'Times New Roman';">&nbsp;&nbsp;&nbsp;&nbsp; </span></span>item</p>
+<p class="MsoNormal"><span style="font-size: 10pt;"><o:p>&nbsp;</o:p></span></p>
+"""
+
+TABLE_ROW = u"""
+<tr valign="top" bgcolor="#eeeeee">
+<td width="120" height="20" align="left" nowrap="nowrap" class="c%(index)d" id="r%(index)dc1" title="cell" colspan="1" rowspan="1" abbr="a" scope="row">%(index)d</td>
+<td width="120" height="20" align="center" valign="middle" class="c%(index)d" id="r%(index)dc2" title="cell" style="border: 1px solid #000000; padding: 2px;">value</td>
+<td width="120" height="20" align="right" char="." charoff="2" class="c%(index)d" id="r%(index)dc3" dir="ltr" lang="en">1.5</td>
+</tr>
+"""
+
+STYLE_PARAGRAPH = u"""
+<p style="margin: 0px 0px 10px; padding: 2px 4px; text-align: justify; text-indent: 20px; line-height: 1.5em; color: rgb(51, 51, 51); background-color: #ffffff; font-family: Verdana, Arial, sans-serif; font-size: 12px; font-weight: normal; letter-spacing: 0.1em; border-top: 1px dotted silver;">Paragraph %(index)d
+<span style="color: #ff0000; background: transparent url(/media/bg.png) no-repeat scroll 0%% 0%%; text-decoration: underline overline; font-style: italic; vertical-align: baseline;">styled</span>
+<span style="border: 2px solid rgb(0, 0, 255); display: inline; float: none; width: auto; height: auto; white-space: nowrap;">text</span></p>
+"""
+
+LINK_ITEM = u"""
+<li><a href="http://example.com/page/%(index)d?a=1&amp;b=2" title="Page %(index)d">Page %(index)d</a>,
+<a href="/local/%(index)d/#anchor">local</a>, <a href="mailto:user%(index)d@example.com">mail</a>,
+<a href="https://www.example.org/%(index)d" target="_blank">secure</a>, <a href="javascript:alert(%(index)d)">script</a>
+<img src="http://example.com/media/%(index)d.png" alt="" width="16" height="16" /></li>
+"""
+
+
+def word(paragraphs=10):
+    """Returns document pasted from Microsoft Word."""
+    return u''.join([
+        WORD_PARAGRAPH % {'index': index}
+        for index in xrange(paragraphs)])
+
+
+def tables(rows=50):
+    """Returns table with a lot of attributes."""
+    return u'<table border="1" cellpadding="2" cellspacing="0" width="100%%" summary="s"><tbody>%s</tbody></table>' % u''.join([
+        TABLE_ROW % {'index': index}
+        for index in xrange(rows)])
+
+
+def styles(paragraphs=10):
+    """Returns document with a lot of css properties."""
+    return u''.join([
+        STYLE_PARAGRAPH % {'index': index}
+        for index in xrange(paragraphs)])
+
+
+def links(number=50):
+    """Returns list of links."""
+    return u'<ul>%s</ul>' % u''.join([
+        LINK_ITEM % {'index': index}
+        for index in xrange(number)])
+
+
+def documents(scale=1):
+    """
+    Returns dictionary with typical documents.
+
+    ``scale`` is multiplier for size of documents.
+    """
+    return {
+        'tinymce': tinymce(10 * scale),
+        'word': word(10 * scale),
+        'nested': nested(25) * scale,
+        'tables': tables(50 * scale),
+        'styles': styles(10 * scale),
+        'links': links(50 * scale),
+    }
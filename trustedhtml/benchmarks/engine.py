@@ -0,0 +1,28 @@
+"""
+Compares ITERATIVE and SINGLE_PASS engines of Html rule.
+"""
+
+from copy import copy
+
+from trustedhtml.classes import Html
+from trustedhtml.rules import html
+from trustedhtml.benchmarks import measure
+from trustedhtml.benchmarks.corpus import tinymce
+
+
+def run(paragraphs=10, number=10):
+    value = tinymce(paragraphs)
+    print '%-8s %12s %12s %8s' % ('preset', 'iterative', 'single', 'speedup')
+    for name in ['full', 'normal', 'pretty']:
+        iterative = copy(getattr(html, name))
+        iterative.engine = Html.ITERATIVE
+        single = copy(iterative)
+        single.engine = Html.SINGLE_PASS
+        iterative_time = measure(lambda: iterative.validate(value), number)
+        single_time = measure(lambda: single.validate(value), number)
+        print '%-8s %10.2fms %10.2fms %7.2fx' % (
+            name, iterative_time * 1000, single_time * 1000,
+            iterative_time / single_time)
+
+if __name__ == '__main__':
+    run()
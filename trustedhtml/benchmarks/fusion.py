@@ -0,0 +1,41 @@
+"""
+Compares Or rules with fused RegExp alternatives (one match per value)
+with Or rules that try each RegExp separately (previous implementation).
+"""
+
+from copy import copy
+
+from trustedhtml.classes import Fused
+from trustedhtml.rules.css import box, syndata
+from trustedhtml.benchmarks import measure
+
+
+def separate(rule):
+    """Returns copy of Or rule with source RegExp rules instead of Fused."""
+    result = copy(rule)
+    rules = []
+    for item in rule.get_rules():
+        if isinstance(item, Fused):
+            rules.extend(item.rules)
+        else:
+            rules.append(item)
+    result._merged = rules
+    return result
+
+
+def run(number=5000):
+    cases = [
+        ('color', syndata.color, ['#fff', 'rgb(1,2,3)', 'hsla(1,2%,3%,0.5)', 'red']),
+        ('margin-top', box.margin_top, ['10px', '1.5em', '50%', 'auto']),
+        ('padding-top', box.padding_top, ['0', '2pt', '3%', 'wrong']),
+    ]
+    print '%-12s %12s %12s %8s' % ('rule', 'separate', 'fused', 'speedup')
+    for name, rule, values in cases:
+        source = separate(rule)
+        source_time = measure(lambda: [source.attempt(value, []) for value in values], number)
+        fused_time = measure(lambda: [rule.attempt(value, []) for value in values], number)
+        print '%-12s %10.2fus %10.2fus %7.2fx' % (
+            name, source_time * 1000000, fused_time * 1000000, source_time / fused_time)
+
+if __name__ == '__main__':
+    run()
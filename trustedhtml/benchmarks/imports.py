@@ -0,0 +1,60 @@
+"""
+Measures time and memory of import of presets
+and of Django start up with ``trustedhtml`` installed.
+Each statement is executed in new process after Django settings are loaded,
+time is the best of several runs, memory is growth of peak RSS.
+``manage.py validate`` loads models of all installed applications
+(fields, widgets and models of ``trustedhtml``) like any management command.
+"""
+
+import os
+import subprocess
+import sys
+
+CODE = '''
+import resource
+import time
+from django.conf import settings
+settings.INSTALLED_APPS
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+%s
+print time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+'''
+
+STATEMENTS = [
+    'import trustedhtml.models',
+    'from django.core.management import call_command; call_command("validate")',
+    'import trustedhtml.classes',
+    'from trustedhtml.rules import pretty',
+    'from trustedhtml.rules.css import common',
+    'from trustedhtml.rules import pretty; pretty.validate(u"<p style=\'color: red\'>a</p>")',
+]
+
+
+def measure_import(statement, repeat=5):
+    """
+    Returns (time in seconds, memory in megabytes) of ``statement``.
+    """
+    times = []
+    memory = []
+    for index in xrange(repeat):
+        process = subprocess.Popen(
+            [sys.executable, '-c', CODE % statement],
+            stdout=subprocess.PIPE, env=os.environ.copy())
+        output = process.communicate()[0]
+        # Output of command is followed by results.
+        elapsed, rss = output.split()[-2:]
+        times.append(float(elapsed))
+        memory.append(int(rss) / 1024.0)
+    return min(times), max(memory)
+
+
+def run(repeat=5):
+    print '%-88s %9s %8s' % ('statement', 'time', 'memory')
+    for statement in STATEMENTS:
+        elapsed, memory = measure_import(statement, repeat)
+        print '%-88s %7.1fms %6.2fMb' % (statement, elapsed * 1000, memory)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,37 @@
+"""
+Compares validation of edited document as a whole
+with ``validate_incremental`` that validates only changed block
+and its neighbours (one paragraph in the middle is changed).
+"""
+
+from copy import copy
+from time import time
+
+from trustedhtml.rules import html
+from trustedhtml.benchmarks.corpus import tinymce
+
+
+def measure(function, number):
+    start = time()
+    for index in xrange(number):
+        function()
+    return (time() - start) / number
+
+
+def run(sizes=(10, 100, 1000), number=3):
+    rule = copy(html.pretty)
+    rule._cache = False
+    print '%-10s %12s %12s %8s' % ('paragraphs', 'whole', 'incremental', 'speedup')
+    for size in sizes:
+        source = tinymce(size)
+        result = rule.validate(source)
+        marker = u'/media/img/%d.png' % (size / 2)
+        value = source.replace(marker, marker + u'" title="changed')
+        whole = measure(lambda: rule.validate(value), number)
+        incremental = measure(
+            lambda: rule.validate_incremental(value, source, result), number)
+        print '%-10d %10.2fms %10.2fms %7.2fx' % (
+            size, whole * 1000, incremental * 1000, whole / incremental)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,81 @@
+"""
+Compares List rules with lookup table and merged Or of List rules
+with scanning of list of values (previous implementation).
+"""
+
+import re
+from copy import copy
+
+from trustedhtml.classes import List, Or, Style, FAILURE
+from trustedhtml.rules.css import box, syndata
+from trustedhtml.rules import css
+from trustedhtml.benchmarks import measure
+from trustedhtml.benchmarks.corpus import documents
+
+STYLE_RE = re.compile(r'style="([^"]*)"')
+
+
+class ScanList(List):
+    """List rule that scans list of values and can`t be merged."""
+
+    def result(self, value, path):
+        source = value
+        value = self.lower_string(value)
+        if value not in self.values:
+            return FAILURE
+        if not self.case_sensitive:
+            if self.return_defined:
+                value = self.source_values[self.values.index(value)]
+            else:
+                value = source
+        return value
+
+
+def scanning(rule, memo=None):
+    """Returns copy of rule tree with ScanList instead of List rules."""
+    if memo is None:
+        memo = {}
+    if id(rule) in memo:
+        return memo[id(rule)]
+    if rule.__class__ is List:
+        result = copy(rule)
+        result.__class__ = ScanList
+    else:
+        result = copy(rule)
+        for name in ['rule', 'rules']:
+            value = getattr(rule, name, None)
+            if isinstance(value, list):
+                setattr(result, name, [scanning(item, memo) for item in value])
+            elif isinstance(value, dict):
+                setattr(result, name, dict([
+                    (key, scanning(item, memo)) for key, item in value.iteritems()]))
+            elif value is not None and hasattr(value, 'validate'):
+                setattr(result, name, scanning(value, memo))
+        if isinstance(result, Or):
+            result.compile()
+        if isinstance(result, Style):
+            result.compile()
+    memo[id(rule)] = result
+    return result
+
+
+def run(number=2000):
+    styles = []
+    for value in documents().values():
+        styles.extend(STYLE_RE.findall(value))
+    cases = [
+        ('color_list', syndata.color_list, ['yellowgreen', 'Red', 'nocolor']),
+        ('color', syndata.color, ['YellowGreen', '#fff', 'rgb(1,2,3)']),
+        ('border-top-style', box.border_top_style, ['solid', 'inherit', 'wavy']),
+        ('style', css.full, styles[:20]),
+    ]
+    print '%-18s %12s %12s %8s' % ('rule', 'scan', 'lookup', 'speedup')
+    for name, rule, values in cases:
+        scan = scanning(rule)
+        scan_time = measure(lambda: [scan.attempt(value, []) for value in values], number)
+        lookup_time = measure(lambda: [rule.attempt(value, []) for value in values], number)
+        print '%-18s %10.2fus %10.2fus %7.2fx' % (
+            name, scan_time * 1000000, lookup_time * 1000000, scan_time / lookup_time)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,37 @@
+"""
+Compares validation of typical documents by presets
+with and without memo of rules (see ``trustedhtml.classes.String``).
+Hit rate of memo for the first validation of document is printed too.
+"""
+
+from copy import copy
+
+from trustedhtml.classes import memoize, memo_info
+from trustedhtml.rules import html
+from trustedhtml.benchmarks import measure
+from trustedhtml.benchmarks.corpus import documents
+
+
+def run(number=5, size=1000):
+    corpus = documents()
+    print '%-7s %-8s %10s %10s %8s %8s' % (
+        'preset', 'document', 'plain', 'memo', 'speedup', 'hits')
+    for name in ['full', 'normal', 'pretty']:
+        rule = copy(getattr(html, name))
+        rule._cache = False
+        for document, value in sorted(corpus.items()):
+            memoize(rule, 0)
+            plain_time = measure(lambda: rule.validate(value), number)
+            memoize(rule, size)
+            # Hits within one document.
+            rule.validate(value)
+            info = memo_info(rule)
+            memo_time = measure(lambda: rule.validate(value), number)
+            print '%-7s %-8s %8.2fms %8.2fms %7.2fx %7.1f%%' % (
+                name, document, plain_time * 1000, memo_time * 1000,
+                plain_time / memo_time,
+                100.0 * info['hits'] / max(info['hits'] + info['misses'], 1))
+        memoize(rule, 0)
+
+if __name__ == '__main__':
+    run()
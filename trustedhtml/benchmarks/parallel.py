@@ -0,0 +1,48 @@
+"""
+Measures validation of long imported documents (posts from TinyMCE,
+Word and styled paragraphs, several megabytes) in one process
+and by blocks in worker processes (see ``Html.validate_parallel``).
+Speedup is limited by number of CPUs.
+"""
+
+from copy import copy
+from time import time
+
+from trustedhtml.parallel import get_processes
+from trustedhtml.rules import html
+from trustedhtml.benchmarks.corpus import tinymce, word, styles
+
+
+def document(size):
+    """Returns imported document with at least ``size`` chars."""
+    part = tinymce(50) + word(50) + styles(50)
+    return part * (size / len(part) + 1)
+
+
+def measure(rule, value, number):
+    start = time()
+    for index in xrange(number):
+        rule.validate(value)
+    return (time() - start) / number
+
+
+def run(sizes=(1000000, 4000000), processes=(1, 2, 4, 8), number=1):
+    rule = copy(html.pretty)
+    rule._cache = False
+    print 'CPUs: %d' % get_processes(None)
+    print '%-10s %9s %12s %8s' % ('size', 'processes', 'time', 'speedup')
+    for size in sizes:
+        value = document(size)
+        rule.parallel_size = 0
+        serial = measure(rule, value, number)
+        for count in processes:
+            if count > 1:
+                rule.parallel_size = 1
+                rule.processes = count
+                elapsed = measure(rule, value, number)
+            else:
+                elapsed = serial
+            print '%-10d %9d %10.2fs %7.2fx' % (len(value), count, elapsed, serial / elapsed)
+
+if __name__ == '__main__':
+    run()
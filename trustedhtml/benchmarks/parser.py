@@ -0,0 +1,35 @@
+"""
+Compares SOUP_PARSER and FAST_PARSER backends of Html rule.
+"""
+
+from copy import copy
+
+from trustedhtml.classes import Html
+from trustedhtml.rules import html
+from trustedhtml.benchmarks import measure
+from trustedhtml.benchmarks.corpus import tinymce
+
+
+def run(paragraphs=10, number=10):
+    value = tinymce(paragraphs)
+    rule = html.full
+    print '%-8s %12s %12s %8s' % ('stage', 'soup', 'fast', 'speedup')
+    soup_time = measure(lambda: unicode(
+        Html.SOUP_PARSER.parse(value, rule.MARKUP_MASSAGE)), number)
+    fast_time = measure(lambda: unicode(
+        Html.FAST_PARSER.parse(value, rule.MARKUP_MASSAGE)), number)
+    print '%-8s %10.2fms %10.2fms %7.2fx' % (
+        'parse', soup_time * 1000, fast_time * 1000, soup_time / fast_time)
+    for name in ['full', 'normal', 'pretty']:
+        soup = copy(getattr(html, name))
+        soup.parser = Html.SOUP_PARSER
+        soup._cache = False
+        fast = copy(soup)
+        fast.parser = Html.FAST_PARSER
+        soup_time = measure(lambda: soup.validate(value), number)
+        fast_time = measure(lambda: fast.validate(value), number)
+        print '%-8s %10.2fms %10.2fms %7.2fx' % (
+            name, soup_time * 1000, fast_time * 1000, soup_time / fast_time)
+
+if __name__ == '__main__':
+    run()
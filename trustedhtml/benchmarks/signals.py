@@ -0,0 +1,40 @@
+"""
+Measures throughput of leaf rules with and without receivers of signals.
+"""
+
+from trustedhtml.classes import Html, List, RegExp, Uri
+from trustedhtml.signals import rule_done, rule_exception
+from trustedhtml.benchmarks import measure
+
+
+def receiver(sender, rule, value, source, **kwargs):
+    return value
+
+
+def run(number=20000):
+    rules = [
+        ('List', List(values=['left', 'right', 'center', 'justify']), 'center'),
+        ('RegExp', RegExp(regexp=r'^(\d+)px$'), '12px'),
+        ('Uri', Uri(), 'http://example.com/path?a=1'),
+    ]
+    variants = [
+        ('none', []),
+        ('Html', [Html]),
+        ('leaf', [List, RegExp, Uri]),
+    ]
+    print '%-8s %s' % ('rule', ' '.join(['%14s' % name for name, senders in variants]))
+    for name, rule, value in rules:
+        results = []
+        for variant, senders in variants:
+            for sender in senders:
+                rule_done.connect(receiver, sender=sender)
+                rule_exception.connect(receiver, sender=sender)
+            results.append(measure(lambda: rule.validate(value), number))
+            for sender in senders:
+                rule_done.disconnect(receiver, sender=sender)
+                rule_exception.disconnect(receiver, sender=sender)
+        print '%-8s %s' % (name, ' '.join([
+            '%10d op/s' % (1 / result) for result in results]))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,47 @@
+"""
+Compares time and peak memory of Html.validate and Html.stream
+for large document.
+Each variant is run in separate process to measure its peak memory.
+"""
+
+import resource
+import time
+from copy import copy
+from StringIO import StringIO
+
+from trustedhtml.rules import html
+from trustedhtml.benchmarks import isolated
+from trustedhtml.benchmarks.corpus import tinymce
+
+
+class Null(object):
+    """Output that forgets written data."""
+
+    def write(self, data):
+        pass
+
+
+def timed(function):
+    """Returns time of ``function`` call in seconds."""
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def run(paragraphs=2000, chunk_size=65536):
+    rule = copy(html.pretty)
+    rule._cache = False
+    value = tinymce(paragraphs).encode('utf-8')
+    print 'document: %.1fMb' % (len(value) / 1024.0 / 1024)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print 'baseline: %.1fMb' % before
+    print '%-8s %10s %10s' % ('mode', 'time', 'peak')
+    for name, function in [
+            ('validate', lambda: Null().write(rule.validate(value.decode('utf-8')))),
+            ('stream', lambda: rule.stream(StringIO(value), Null(), chunk_size)),
+    ]:
+        elapsed, peak = isolated(lambda: timed(function))
+        print '%-8s %9.2fs %8.1fMb' % (name, elapsed, peak)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,154 @@
+"""
+Measures presets on typical documents.
+
+Time of each stage of ``Html.validate`` (``correct``, parse, ``transform``
+and serialization) is measured separately for one iteration of ``Html.fix``.
+Time of separate passes of ``transform_passes`` (``clear``, ``collapse``
+and ``wrap``) is saved too, it is for reference only:
+``validate`` uses fused ``transform``.
+Total time of ``validate``, throughput and peak memory are measured too.
+Results can be saved to JSON to compare versions.
+"""
+
+import platform
+import sys
+import time
+from copy import copy
+
+import trustedhtml
+from trustedhtml.rules import html
+from trustedhtml.benchmarks import measure, isolated
+from trustedhtml.benchmarks.corpus import documents
+
+PRESETS = ['full', 'normal', 'pretty']
+STAGES = ['correct', 'parse', 'transform', 'serialize']
+PASSES = ['clear', 'collapse', 'wrap']
+
+
+def best_times(names, steps, number):
+    """
+    Returns dictionary with the best time in seconds of each step.
+    ``steps`` is called ``number`` times and returns list with times
+    of start and ends of steps with ``names``.
+    """
+    best = dict([(name, None) for name in names])
+    for index in xrange(number):
+        times = steps()
+        for name, start, end in zip(names, times, times[1:]):
+            if best[name] is None or end - start < best[name]:
+                best[name] = end - start
+    return best
+
+
+def stages(rule, value, number=10):
+    """
+    Returns dictionary with the best time in seconds of each stage
+    of ``validate``.
+    """
+    def steps():
+        times = [time.time()]
+        prepared = rule.prepare(value)
+        times.append(time.time())
+        soup = rule.parse(prepared)
+        times.append(time.time())
+        soup = rule.transform(soup, [rule])
+        times.append(time.time())
+        unicode(soup)
+        times.append(time.time())
+        return times
+    return best_times(STAGES, steps, number)
+
+
+def passes(rule, value, number=10):
+    """
+    Returns dictionary with the best time in seconds of each pass
+    of ``transform_passes``. It is reference implementation,
+    ``validate`` doesn`t use it.
+    """
+    prepared = rule.prepare(value)
+    def steps():
+        soup = rule.parse(prepared)
+        times = [time.time()]
+        soup = rule.clear(soup, [rule])
+        times.append(time.time())
+        soup = rule.collapse_root(rule.collapse(soup))
+        times.append(time.time())
+        rule.wrap(soup)
+        times.append(time.time())
+        return times
+    return best_times(PASSES, steps, number)
+
+
+def bench(name, value, number=10):
+    """
+    Returns dictionary with results of preset ``name`` for ``value``.
+    """
+    rule = copy(getattr(html, name))
+    rule._cache = False
+    total = measure(lambda: rule.validate(value), number)
+    result, peak = isolated(lambda: len(rule.validate(value)))
+    size = len(value.encode('utf-8'))
+    return {
+        'size': size,
+        'result_size': result,
+        'validate': total,
+        'throughput': size / 1024.0 / total,
+        'peak': peak,
+        'stages': stages(rule, value, number),
+        'passes': passes(rule, value, number),
+    }
+
+
+def run_suite(presets=None, names=None, scale=1, number=10, report=None):
+    """
+    Returns dictionary with results of all ``presets`` for documents
+    with ``names`` (see ``trustedhtml.benchmarks.corpus.documents``).
+
+    ``report`` is called with (preset, document name, result)
+    when each result is ready.
+    """
+    if presets is None:
+        presets = PRESETS
+    corpus = documents(scale)
+    if names is None:
+        names = sorted(corpus)
+    results = {}
+    for preset in presets:
+        results[preset] = {}
+        for name in names:
+            result = bench(preset, corpus[name], number)
+            results[preset][name] = result
+            if report is not None:
+                report(preset, name, result)
+    return {
+        'version': trustedhtml.__version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'number': number,
+        'results': results,
+    }
+
+
+def header():
+    return '%-7s %-8s %8s %9s %9s %8s ' % (
+        'preset', 'document', 'size', 'validate', 'speed', 'peak') + ' '.join(
+        ['%9s' % stage for stage in STAGES])
+
+
+def line(preset, name, result):
+    return '%-7s %-8s %7dK %7.2fms %6dK/s %6.1fMb ' % (
+        preset, name, result['size'] / 1024, result['validate'] * 1000,
+        result['throughput'], result['peak']) + ' '.join(
+        ['%7.2fms' % (result['stages'][stage] * 1000) for stage in STAGES])
+
+
+def run(scale=1, number=10):
+    print header()
+    def report(preset, name, result):
+        print line(preset, name, result)
+    run_suite(scale=scale, number=number, report=report)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,57 @@
+"""
+Measures text normalization of large text-heavy posts:
+``correct`` (for whole document) against ``correct_passes``,
+``escape`` and ``unescape`` (for each string) against chained replaces,
+that were used before.
+"""
+
+from time import time
+
+from trustedhtml.rules import html
+
+TEXT_PARAGRAPH = (u'<p>Lorem ipsum dolor sit amet, consectetur adipisicing elit,\r\n'
+    u'sed do eiusmod tempor&#160;incididunt ut labore  et dolore magna aliqua.\n'
+    u'Ut enim ad minim veniam, quis "nostrud" exercitation &amp; ullamco.</p>\n')
+
+
+def escape_passes(rule, value):
+    value = rule.remove_spaces(value)
+    for char, string in rule.SPECIAL_CHARS:
+        value = value.replace(char, string)
+    return value
+
+
+def unescape_passes(rule, value):
+    for char, string in rule.PLAIN_CHARS:
+        value = value.replace(string, char)
+    return value
+
+
+def measure(function, values, number):
+    start = time()
+    for index in xrange(number):
+        for value in values:
+            function(value)
+    return (time() - start) / number
+
+
+def run(sizes=(100, 1000, 10000), number=5):
+    rule = html.pretty
+    print '%-10s %6s %12s %12s %8s' % ('function', 'size', 'passes', 'single', 'speedup')
+    for size in sizes:
+        document = TEXT_PARAGRAPH * size
+        strings = rule.correct(document).split(u'\n')
+        escaped = [escape_passes(rule, value) for value in strings]
+        cases = [
+            ('correct', [document], rule.correct_passes, rule.correct),
+            ('escape', strings, lambda value: escape_passes(rule, value), rule.escape),
+            ('unescape', escaped, lambda value: unescape_passes(rule, value), rule.unescape),
+        ]
+        for name, values, passes, single in cases:
+            passes = measure(passes, values, number)
+            single = measure(single, values, number)
+            print '%-10s %6d %10.2fms %10.2fms %7.2fx' % (
+                name, size, passes * 1000, single * 1000, passes / single)
+
+if __name__ == '__main__':
+    run()
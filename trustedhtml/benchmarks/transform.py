@@ -0,0 +1,36 @@
+"""
+Compares fused transform (one visit per node) with four passes
+(``clear``, ``collapse``, ``collapse_root``, ``wrap``) that were used before.
+``wrapper`` documents are big disallowed elements with text and inline tags,
+their strings are joined after unwrapping.
+"""
+
+from time import time
+
+from trustedhtml.rules import html
+from trustedhtml.benchmarks.corpus import documents
+
+
+def measure(rule, value, transform, number):
+    value = rule.prepare(value)
+    soups = [rule.parse(value) for index in xrange(number)]
+    start = time()
+    for soup in soups:
+        transform(soup, [rule])
+    return (time() - start) / number
+
+
+def run(number=5):
+    rule = html.pretty
+    cases = sorted(documents().items())
+    for size in [1000, 2000, 4000]:
+        cases.append(('wrapper-%d' % size, u'<center>%s</center>' % (u'<b>x</b> y ' * size)))
+    print '%-16s %12s %12s %8s' % ('document', 'passes', 'fused', 'speedup')
+    for name, value in cases:
+        passes = measure(rule, value, rule.transform_passes, number)
+        fused = measure(rule, value, rule.transform, number)
+        print '%-16s %10.2fms %10.2fms %7.2fx' % (
+            name, passes * 1000, fused * 1000, passes / fused)
+
+if __name__ == '__main__':
+    run()
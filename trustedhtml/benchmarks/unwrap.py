@@ -0,0 +1,52 @@
+"""
+Measures ``Html.clear`` that unwraps big disallowed wrapper
+and ``Html.wrap`` that encloses long inline runs in the root.
+``generic`` is FastParser with operations of ``Parser``
+(search of child in contents, children are moved one by one),
+that were used before.
+"""
+
+from copy import copy
+from time import time
+
+from trustedhtml.classes import Html
+from trustedhtml.parser import FastParser, Parser
+from trustedhtml.rules import html
+
+
+class Generic(FastParser):
+    remove = Parser.remove.im_func
+    replace = Parser.replace.im_func
+    unwrap = Parser.unwrap.im_func
+    enclose = Parser.enclose.im_func
+
+
+def measure(rule, value, method, number):
+    value = rule.correct(value)
+    soups = [rule.parse(value) for index in xrange(number)]
+    start = time()
+    for soup in soups:
+        method(rule, soup)
+    return (time() - start) / number
+
+
+def run(sizes=(1000, 4000, 16000), number=3):
+    parsers = [('soup', Html.SOUP_PARSER), ('generic', Generic()), ('fast', Html.FAST_PARSER)]
+    cases = [
+        ('clear', html.pretty, u'<center>%s</center>', u'<p>x</p>',
+            lambda rule, soup: rule.clear(soup, [rule])),
+        ('wrap', html.full, u'%s', u'x<br />',
+            lambda rule, soup: rule.wrap(soup)),
+    ]
+    print '%-6s %6s %s' % ('method', 'size', ' '.join(['%10s' % name for name, parser in parsers]))
+    for name, preset, template, piece, method in cases:
+        for size in sizes:
+            times = []
+            for parser_name, parser in parsers:
+                rule = copy(preset)
+                rule.parser = parser
+                times.append(measure(rule, template % (piece * size), method, number))
+            print '%-6s %6d %s' % (name, size, ' '.join(['%8.1fms' % (item * 1000) for item in times]))
+
+if __name__ == '__main__':
+    run()
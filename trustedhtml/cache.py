@@ -0,0 +1,278 @@
+"""
+Cache for results of ``Html`` validation
+and memo for results of other rules (see ``Memo``).
+
+Results are stored by key built from digest of the source value and
+fingerprint of the rule tree (rules with all their properties,
+``TRUSTEDHTML_*`` settings and version of this application).
+So any change of rules or settings will use new keys
+and old results will never be returned.
+"""
+
+import re
+import threading
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from django.utils.datastructures import SortedDict
+
+import trustedhtml
+from trustedhtml import settings
+
+PATTERN_TYPE = type(re.compile(''))
+
+# Settings that don`t change results of validation.
+IGNORED_OPTIONS = [
+    'TRUSTEDHTML_COMPILED_RULES', 'TRUSTEDHTML_PARALLEL_SIZE', 'TRUSTEDHTML_PARALLEL_PROCESSES']
+
+
+class LruCache(object):
+    """
+    In-process cache with least recently used eviction.
+    """
+
+    def __init__(self, size=1000):
+        """
+        ``size`` is maximum number of stored results.
+        """
+        self.size = size
+        self.entries = SortedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns stored value or None."""
+        self.lock.acquire()
+        try:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """Stores value, removes least recently used one if necessary."""
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                del self.entries[self.entries.keyOrder[0]]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Removes all stored values."""
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+
+class Memo(object):
+    """
+    In-process memo of results of rules with least recently used eviction.
+    Unlike ``LruCache`` it is used for each validated value,
+    so it does not copy the order of keys on update.
+    ``hits`` and ``misses`` count results of ``get``.
+    """
+
+    def __init__(self, size=1000):
+        """
+        ``size`` is maximum number of stored results.
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        # Circular doubly linked list of [previous, next, key, value]
+        # from the least to the most recently used entry.
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns stored value or None."""
+        self.lock.acquire()
+        try:
+            link = self.entries.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            previous, next = link[0], link[1]
+            previous[1] = next
+            next[0] = previous
+            root = self.root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """Stores value, removes least recently used one if necessary."""
+        self.lock.acquire()
+        try:
+            root = self.root
+            link = self.entries.pop(key, None)
+            if link is None and len(self.entries) >= self.size:
+                link = root[1]
+                del self.entries[link[2]]
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = link
+            self.entries[key] = link
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Removes all stored values."""
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def __getstate__(self):
+        """Stored values and counters are not pickled."""
+        return {'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'])
+
+    def info(self):
+        """Returns dictionary with counters and number of stored values."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'count': len(self.entries),
+            'size': self.size,
+        }
+
+
+class DjangoCache(object):
+    """
+    Cache that uses Django`s cache framework.
+    """
+
+    def __init__(self, alias='default', timeout=None):
+        """
+        ``alias`` is name of cache in CACHES setting.
+
+        ``timeout`` is lifetime of results in seconds.
+        None is used to use default timeout of the cache.
+        """
+        from django.core.cache import get_cache
+        self.cache = get_cache(alias)
+        self.timeout = timeout
+
+    def get(self, key):
+        """Returns stored value or None."""
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        """Stores value."""
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        """Removes all stored values."""
+        self.cache.clear()
+
+
+_default = {}
+
+
+def get_default_cache():
+    """
+    Returns cache specified by TRUSTEDHTML_CACHE setting
+    or None if cache is disabled.
+    """
+    if settings.TRUSTEDHTML_CACHE not in _default:
+        if settings.TRUSTEDHTML_CACHE is None:
+            cache = None
+        elif settings.TRUSTEDHTML_CACHE == 'lru':
+            cache = LruCache(settings.TRUSTEDHTML_CACHE_SIZE)
+        else:
+            cache = DjangoCache(
+                settings.TRUSTEDHTML_CACHE, settings.TRUSTEDHTML_CACHE_TIMEOUT)
+        _default[settings.TRUSTEDHTML_CACHE] = cache
+    return _default[settings.TRUSTEDHTML_CACHE]
+
+
+def describe(value, memo):
+    """
+    Returns stable text representation of ``value``.
+    Objects that was already described will be referenced by number.
+    """
+    if value is None or isinstance(value, (bool, int, long, float, basestring)):
+        return repr(value)
+    if isinstance(value, PATTERN_TYPE):
+        return 're(%r, %d)' % (value.pattern, value.flags)
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join([describe(item, memo) for item in value])
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ', '.join(sorted([describe(item, memo) for item in value]))
+    if isinstance(value, dict):
+        # Items must be described in stable order to get stable references.
+        items = sorted([
+            (describe(key, memo), item) for key, item in value.iteritems()],
+            key=lambda pair: pair[0])
+        return '{%s}' % ', '.join([
+            '%s: %s' % (key, describe(item, memo)) for key, item in items])
+    if id(value) in memo:
+        return '#%d' % memo[id(value)][0]
+    # Keep reference to the object, so that its id will not be reused.
+    memo[id(value)] = (len(memo), value)
+    name = '%s.%s' % (value.__class__.__module__, value.__class__.__name__)
+    if callable(value) or not hasattr(value, '__dict__'):
+        return '%s(%s)' % (name, getattr(value, '__name__', ''))
+    # Private attributes (like cached values) do not change behaviour.
+    attrs = dict([
+        (key, item) for key, item in value.__dict__.iteritems()
+        if not key.startswith('_')])
+    return '%s(%s)' % (name, describe(attrs, memo))
+
+
+def options():
+    """
+    Returns dictionary with ``TRUSTEDHTML_*`` settings
+    that can change results of validation.
+    """
+    return dict([
+        (name, getattr(settings, name)) for name in dir(settings)
+        if name.startswith('TRUSTEDHTML_') and name not in IGNORED_OPTIONS])
+
+
+def fingerprint(rule):
+    """
+    Returns digest of the ``rule`` tree and settings.
+    """
+    memo = {}
+    text = '\n'.join([
+        trustedhtml.__version__,
+        describe(options(), memo),
+        describe(rule, memo),
+    ])
+    return sha1(text).hexdigest()
+
+
+def make_key(fingerprint, value):
+    """
+    Returns cache key for the ``value`` validated by rule with ``fingerprint``.
+    """
+    if isinstance(value, unicode):
+        digest = 'u' + sha1(value.encode('utf-8')).hexdigest()
+    else:
+        digest = 's' + sha1(value).hexdigest()
+    return 'trustedhtml:%s:%s' % (fingerprint, digest)
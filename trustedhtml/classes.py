@@ -1,19 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import cPickle
+import itertools
 import re
-from beautifulsoup import BeautifulSoup, NavigableString, Tag, buildTagMap
+import sre_parse
+from bisect import bisect_left
+from copy import copy
+from beautifulsoup import BeautifulSoup
 
 from trustedhtml import settings
+from trustedhtml.cache import Memo, get_default_cache, fingerprint, make_key
+from trustedhtml.parallel import get_processes, validate_regions
+from trustedhtml.parser import ASCII_SPACES, SoupParser, FastParser, Splitter
 from trustedhtml.signals import rule_done, rule_exception
-from trustedhtml.utils import get_cdata, get_style
-from urlmethods import urlsplit, urljoin, urlfix, remote_check, local_check
-
-BeautifulSoup.QUOTE_TAGS = {}
-BeautifulSoup.SELF_CLOSING_TAGS = buildTagMap(None, [
-    'area', 'base', 'basefont', 'br', 'col', 'frame', 'hr',
-    'img', 'input', 'isindex', 'link', 'meta', 'param',
-    # I don`t what is: 'spacer',
-])
+from trustedhtml.utils import common_prefix, common_suffix, get_cdata, get_style
+from trustedhtml.verification import collect, deferred, remote_check
+from urlmethods import urlsplit, urljoin, urlfix, local_check
 
 
 class TrustedException(ValueError):
@@ -60,12 +62,207 @@ class ElementException(TrustedException):
     pass
 
 
+# Returned by ``Rule.attempt`` if value is incorrect.
+FAILURE = object()
+
+# Value of lazily built attributes that were not built yet.
+NOT_COMPILED = object()
+
+# Pairs of (non-raising, raising) methods.
+# Non-raising method is used by ``Rule.attempt`` only if it was defined
+# in the same class as raising one (or in its subclass).
+RESULT_METHODS = [
+    ('result', 'core'),
+    ('sequence_result', 'sequence'),
+    ('complex_result', 'complex'),
+]
+
+_protocols = {}
+
+
+def subrules(rule):
+    """
+    Returns list of rules used by ``rule``
+    (its ``rule`` attribute and items of ``rules`` list or dictionary).
+    """
+    result = []
+    for name in ['rule', 'rules']:
+        value = getattr(rule, name, None)
+        if isinstance(value, dict):
+            value = value.values()
+        elif not isinstance(value, list):
+            value = [value]
+        result.extend([item for item in value if isinstance(item, Rule)])
+    return result
+
+
+def walk(rule):
+    """
+    Returns list of all rules in the ``rule`` tree, each rule once.
+    """
+    result = []
+    rules = [rule]
+    visited = set()
+    while rules:
+        rule = rules.pop()
+        if id(rule) in visited:
+            continue
+        visited.add(id(rule))
+        result.append(rule)
+        rules.extend(subrules(rule))
+    return result
+
+
+def memoize(rule, size):
+    """
+    Sets size of memo (see ``String``) for all rules in the ``rule`` tree.
+    """
+    for item in walk(rule):
+        if isinstance(item, String):
+            item.set_memo(size)
+
+
+def precompile(rule):
+    """
+    Compiles regular expressions and builds merged rules of ``Or``
+    for all rules in the ``rule`` tree (usually it is done on first use).
+    """
+    for item in walk(rule):
+        if isinstance(item, Or):
+            item.compile()
+            for merged in item._merged or []:
+                if isinstance(merged, Fused):
+                    merged.compiled
+        if isinstance(item, (RegExp, Sequence)):
+            item.compiled
+
+
+def memo_info(rule):
+    """
+    Returns dictionary with total counters of memos (see ``String``)
+    of all rules in the ``rule`` tree.
+    """
+    result = {'hits': 0, 'misses': 0, 'count': 0, 'rules': 0}
+    for item in walk(rule):
+        if item._memo is not None:
+            info = item._memo.info()
+            for name in ['hits', 'misses', 'count']:
+                result[name] += info[name]
+            result['rules'] += 1
+    return result
+
+
+class Path(object):
+    """
+    Immutable list of rules that called validation: rules of ``parent``
+    (list or Path) and ``rule``.
+    Combinators create it for nested rules instead of copying
+    the list of ancestors. It is converted to list only when it is
+    sent to receivers of signals.
+    """
+
+    __slots__ = ('parent', 'rule')
+
+    def __init__(self, parent, rule):
+        self.parent = parent
+        self.rule = rule
+
+    def to_list(self):
+        """Returns list of rules, the first rule is the first element."""
+        rules = []
+        path = self
+        while isinstance(path, Path):
+            rules.append(path.rule)
+            path = path.parent
+        rules.reverse()
+        return list(path) + rules
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return len(self.to_list())
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __add__(self, other):
+        return self.to_list() + list(other)
+
+    def __eq__(self, other):
+        if isinstance(other, (Path, list)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Path(%r)' % self.to_list()
+
+
+def _owner(cls, name):
+    """Returns class in which attribute ``name`` of ``cls`` is defined."""
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            return base
+    return None
+
+
+def get_protocol(cls):
+    """
+    Returns (plain, result) for rule class ``cls``:
+    ``plain`` is whether ``validate`` is not overwritten,
+    ``result`` is whether non-raising methods can be used.
+    """
+    try:
+        return _protocols[cls]
+    except KeyError:
+        plain = _owner(cls, 'validate') is Rule
+        result = True
+        for fast, slow in RESULT_METHODS:
+            slow_owner = _owner(cls, slow)
+            if slow_owner is None:
+                continue
+            fast_owner = _owner(cls, fast)
+            if fast_owner is None or not issubclass(fast_owner, slow_owner):
+                result = False
+        _protocols[cls] = (plain, result)
+        return plain, result
+
+
+# Numbers of changes of rules (see ``Rule.__setattr__``).
+_changes = itertools.count(1)
+
+
 class Rule(object):
     """
     Base rule class.
     All rules inherit it and overwrite ``core`` or ``__init__`` functions.
     """
 
+    # Memo for results of validation (see ``String``).
+    _memo = None
+    # Classes of rules in the tree of memoized rule.
+    _memo_classes = None
+    # Number of the last change of public attribute of any rule.
+    _changed = 0
+
+    def __setattr__(self, name, value):
+        """
+        Remembers number of the change of public attribute,
+        values calculated for trees of rules will be calculated again
+        (see ``Html.compile``). Private attributes are caches.
+        """
+        object.__setattr__(self, name, value)
+        if name[:1] != '_':
+            Rule._changed = _changes.next()
+
     def __init__(
             self, allow_empty=True, default=None, invalid=False,
             element_exception=False, data=None):
@@ -101,11 +298,28 @@ class Rule(object):
         
         ``path`` is the list of rules that called this validation.
         First element of this list will be first rule.
+        Combinators pass it as ``Path``, receivers of signals get list.
         
         This function will call ``preprocess``, ``core`` and 
         ``postprocess`` functions.
         They can be overwritten by subclasses.
         """
+        memo = self._memo
+        if memo is not None and self.memoizable(value):
+            result = memo.get(value)
+            if result is None or result is FAILURE:
+                try:
+                    result = self._validate(value, path)
+                except TrustedException, exception:
+                    result = exception
+                memo.set(value, result)
+            if isinstance(result, TrustedException):
+                raise result
+            return result
+        return self._validate(value, path)
+
+    def _validate(self, value, path):
+        """``validate`` without memo."""
         if path is None:
             path = []
         source = value
@@ -128,19 +342,133 @@ class Rule(object):
                 else:
                     raise exception
 
-            results = rule_done.send(
-                sender=self.__class__, rule=self,
-                path=path, value=value, source=source)
-            for receiver, response in results:
-                value = response
+            if rule_done.has_listeners(self.__class__):
+                results = rule_done.send(
+                    sender=self.__class__, rule=self,
+                    path=list(path), value=value, source=source)
+                for receiver, response in results:
+                    value = response
 
         except TrustedException, exception:
-            rule_exception.send(
-                sender=self.__class__, rule=self,
-                path=path, value=value, source=source, exception=exception)
+            if rule_exception.has_listeners(self.__class__):
+                rule_exception.send(
+                    sender=self.__class__, rule=self,
+                    path=list(path), value=value, source=source, exception=exception)
+            raise exception
+        return value
+
+    def attempt(self, value, path):
+        """
+        Non-raising variant of ``validate`` used by combinators.
+        Returns correct value or FAILURE.
+        ElementException is raised just like by ``validate``.
+
+        Exceptions are not created by rules that have ``result``
+        and signals are sent only if there are receivers.
+        """
+        memo = self._memo
+        if memo is not None and self.memoizable(value):
+            result = memo.get(value)
+            if result is None:
+                result = self._attempt(value, path)
+                memo.set(value, result)
+            elif isinstance(result, TrustedException):
+                if isinstance(result, ElementException):
+                    raise result
+                return FAILURE
+            return result
+        return self._attempt(value, path)
+
+    def _attempt(self, value, path):
+        """``attempt`` without memo."""
+        cls = self.__class__
+        plain, result = get_protocol(cls)
+        if (not plain or self.invalid or self.element_exception
+                or rule_exception.has_listeners(cls)):
+            try:
+                if plain:
+                    return self._validate(value, path)
+                return self.validate(value, path)
+            except ElementException, exception:
+                raise exception
+            except TrustedException:
+                return FAILURE
+        source = value
+        try:
+            value = self.preprocess(value, path)
+            if result:
+                value = self.result(value, path)
+            else:
+                value = Rule.result(self, value, path)
+            if value is not FAILURE:
+                value = self.postprocess(value, path)
+        except ElementException, exception:
             raise exception
+        except TrustedException:
+            value = FAILURE
+        if value is FAILURE:
+            if self.default is None:
+                return FAILURE
+            value = self.default
+        if rule_done.has_listeners(cls):
+            try:
+                results = rule_done.send(
+                    sender=cls, rule=self,
+                    path=list(path), value=value, source=source)
+            except ElementException, exception:
+                raise exception
+            except TrustedException:
+                return FAILURE
+            for receiver, response in results:
+                value = response
         return value
 
+    def pure(self):
+        """
+        Returns whether result of validation depends only on the value
+        and validation has no side effects, so the result can be remembered.
+        By default rule is pure if all its ``subrules`` are pure.
+        """
+        for rule in subrules(self):
+            if not rule.pure():
+                return False
+        return True
+
+    def memoizable(self, value):
+        """
+        Returns whether memo can be used to validate ``value``:
+        it is a string, ``validate`` is not overwritten, all rules
+        in the tree are pure and nobody listens their signals.
+        """
+        if value is not None and not isinstance(value, basestring):
+            return False
+        classes = self._memo_classes
+        if classes is None:
+            classes = []
+            if get_protocol(self.__class__)[0] and self.pure():
+                for rule in walk(self):
+                    if rule.__class__ not in classes:
+                        classes.append(rule.__class__)
+            self._memo_classes = classes
+        if not classes:
+            return False
+        for cls in classes:
+            if rule_done.has_listeners(cls) or rule_exception.has_listeners(cls):
+                return False
+        return True
+
+    def validates_absent(self):
+        """
+        Returns whether validation of absent value (None) can return
+        any value or raise ElementException.
+        Validator will not call rules for absent values if it returns False.
+
+        Subclasses that overwrite ``preprocess`` to accept empty values
+        must overwrite this function too.
+        """
+        return (self.allow_empty or self.default is not None
+            or self.invalid or self.element_exception)
+
     def core(self, value, path):
         """
         This function is called while validation.
@@ -155,6 +483,21 @@ class Rule(object):
         """
         return value
 
+    def result(self, value, path):
+        """
+        Non-raising variant of ``core`` called by ``attempt``.
+        Subclasses that overwrite ``core`` can overwrite this one too
+        to avoid creation of exceptions.
+
+        Returns correct value or FAILURE.
+        """
+        try:
+            return self.core(value, path)
+        except ElementException, exception:
+            raise exception
+        except TrustedException:
+            return FAILURE
+
     def preprocess(self, value, path):
         """
         This function is called while validation before ``core``.
@@ -196,7 +539,7 @@ class String(Rule):
     Validation will return striped string value if specified.
     """
 
-    def __init__(self, case_sensitive=False, strip=True, allow_empty=False, **kwargs):
+    def __init__(self, case_sensitive=False, strip=True, allow_empty=False, memo=None, **kwargs):
         """
         ``strip`` if True than remove leading and trailing whitespace.
 
@@ -204,12 +547,37 @@ class String(Rule):
         
         This class don`t prepare ``value`` according to ``case_sensitive``.
         Just specified functions to do it.
+
+        ``memo`` is number of results of validation to be remembered
+        by value (see ``trustedhtml.cache.Memo``).
+        0 to disable memo. None to use TRUSTEDHTML_MEMO_SIZE setting.
+        Memo is not used if the rule is not ``pure``
+        or somebody listens signals of rules in its tree.
+        Call ``clear_memo`` after you change the rule.
         """
         super(String, self).__init__(allow_empty=allow_empty, **kwargs)
         if self.default is not None:
             self.default = unicode(self.default)
         self.case_sensitive = case_sensitive
         self.strip = strip
+        if memo is None:
+            memo = settings.TRUSTEDHTML_MEMO_SIZE
+        self.set_memo(memo)
+
+    def set_memo(self, size):
+        """Sets number of results to be remembered (0 to disable memo)."""
+        self.memo = size
+        if size:
+            self._memo = Memo(size)
+        else:
+            self._memo = None
+        self._memo_classes = None
+
+    def clear_memo(self):
+        """Forgets remembered results."""
+        if self._memo is not None:
+            self._memo.clear()
+        self._memo_classes = None
 
     def lower_string(self, value):
         """
@@ -265,17 +633,58 @@ class List(String):
         self.source_values = values
         self.return_defined = return_defined
         self.values = self.lower_list(self.source_values)
+        self.compile()
+
+    def compile(self):
+        """
+        Builds dictionary with lowered values and corresponding defined values.
+        Call it if ``values`` was changed after initialization.
+        """
+        lookup = {}
+        for value, source in zip(self.values, self.source_values):
+            lookup.setdefault(value, source)
+        self._lookup = lookup
+
+    def mergeable(self, other):
+        """
+        Returns whether ``other`` rule can be merged with this one
+        (see ``merge``).
+        """
+        return (self.__class__ is List and other.__class__ is List
+            and self.default is None and other.default is None
+            and not self.invalid and not other.invalid
+            and not self.element_exception and not other.element_exception
+            and self.allow_empty == other.allow_empty and self.strip == other.strip
+            and self.case_sensitive == other.case_sensitive
+            and self.return_defined == other.return_defined)
+
+    def merge(self, other):
+        """
+        Returns List rule that is equal to ``Or`` of this rule and ``other``.
+        """
+        return List(
+            values=list(self.source_values) + list(other.source_values),
+            return_defined=self.return_defined, case_sensitive=self.case_sensitive,
+            strip=self.strip, allow_empty=self.allow_empty)
 
     def core(self, value, path):
         """Do it."""
         value = super(List, self).core(value, path)
+        result = self.result(value, path)
+        if result is FAILURE:
+            raise IncorrectException(self, value)
+        return result
+
+    def result(self, value, path):
+        """Do it."""
         source = value
         value = self.lower_string(value)
-        if value not in self.values:
-            raise IncorrectException(self, value)
+        defined = self._lookup.get(value, FAILURE)
+        if defined is FAILURE:
+            return FAILURE
         if not self.case_sensitive:
             if self.return_defined:
-                value = self.source_values[self.values.index(value)]
+                value = defined
             else:
                 value = source
         return value
@@ -287,6 +696,8 @@ class RegExp(String):
     Validation will return expanded match object.
     """
 
+    _compiled = None
+
     def __init__(self, regexp, flags=0, expand=r'\1', **kwargs):
         """
         ``regexp`` specified string with regular expression to validate ``value``.
@@ -311,16 +722,188 @@ class RegExp(String):
         self.expand = expand
         if not self.case_sensitive:
             self.flags = self.flags | re.IGNORECASE
-        self.compiled = re.compile(unicode(self.regexp), self.flags)
+
+    @property
+    def compiled(self):
+        """
+        Compiled ``regexp``. It is compiled on first use,
+        so that unused rules of presets cost nothing at start up.
+        """
+        if self._compiled is None:
+            compiled = re.compile(unicode(self.regexp), self.flags)
+            # ``match.expand`` parses template on each call.
+            self._template = sre_parse.parse_template(self.expand, compiled)
+            self._compiled = compiled
+        return self._compiled
+
+    @compiled.setter
+    def compiled(self, value):
+        """Assigned expression replaces ``regexp`` and ``flags``."""
+        self.regexp = value.pattern
+        self.flags = value.flags
+        self._template = sre_parse.parse_template(self.expand, value)
+        self._compiled = value
 
     def core(self, value, path):
         """Do it."""
         value = super(RegExp, self).core(value, path)
+        result = self.result(value, path)
+        if result is FAILURE:
+            raise IncorrectException(self, value)
+        return result
+
+    def result(self, value, path):
+        """Do it."""
         match = self.compiled.match(value)
         if match is None:
+            return FAILURE
+        return sre_parse.expand_template(self._template, match)
+
+    def fusible(self):
+        """
+        Returns whether this rule can be fused with other RegExp rules
+        into one regular expression (see ``Fused``).
+        """
+        if (self.__class__ is not RegExp or self.default is not None
+                or self.invalid or self.element_exception):
+            return False
+        for match in Fused.TOKEN_RE.finditer(self.regexp):
+            escaped, flags, conditional = match.group(1, 3, 5)
+            if ((escaped is not None and escaped.isdigit()) or flags is not None
+                    or conditional is not None):
+                # Back references, inline flags and conditional references
+                # to groups can`t be fused
+                return False
+        return self.compiled.groups < Fused.MAX_GROUPS
+
+    def mergeable(self, other):
+        """
+        Returns whether ``other`` rule can be fused with this one.
+        """
+        return (self.fusible() and isinstance(other, RegExp) and other.fusible()
+            and self.flags == other.flags and self.strip == other.strip
+            and self.allow_empty == other.allow_empty
+            and self.compiled.groups + other.compiled.groups + 2 <= Fused.MAX_GROUPS)
+
+    def merge(self, other):
+        """
+        Returns rule that is equal to ``Or`` of this rule and ``other``.
+        """
+        return Fused([self, other])
+
+
+class Fused(String):
+    """
+    Rule that is equal to ``Or`` of RegExp ``rules``.
+    Expressions of rules are joined into one alternation,
+    so value is matched once. Each rule returns its own expansion.
+    It is created by ``Or`` for adjacent RegExp rules.
+    """
+
+    # Escaped char, start of named group, named back reference, inline flags
+    # or conditional reference to group.
+    TOKEN_RE = re.compile(
+        r'\\(.)|\(\?P<(\w+)>|\(\?([iLmsux]+)\)|\(\?P=(\w+)\)|(\(\?\()', re.S)
+    TEMPLATE_RE = re.compile(r'\\(g<([^>]*)>|([1-9][0-9]?)|.)', re.S)
+    # Python supports only 100 groups in expression
+    MAX_GROUPS = 99
+
+    _compiled = None
+
+    def __init__(self, rules):
+        """
+        ``rules`` is list of RegExp rules with the same flags.
+        """
+        first = rules[0]
+        super(Fused, self).__init__(
+            case_sensitive=first.case_sensitive, strip=first.strip,
+            allow_empty=first.allow_empty)
+        self.rules = rules
+        self.flags = first.flags
+        patterns = []
+        templates = []
+        # Number of group with whole expression of rule -> index of rule.
+        self._indexes = {}
+        groups = 0
+        for index, rule in enumerate(rules):
+            prefix = '_%d_' % index
+            offset = groups + 1
+            patterns.append('(%s)' % self.TOKEN_RE.sub(
+                lambda match: self.rename(match, prefix), rule.regexp))
+            templates.append(self.TEMPLATE_RE.sub(
+                lambda match: self.translate(match, prefix, offset), rule.expand))
+            self._indexes[offset] = index
+            groups += rule.compiled.groups + 1
+        self.groups = groups
+        self._pattern = u'|'.join(patterns)
+        self._sources = templates
+
+    @property
+    def compiled(self):
+        """
+        Compiled expression. It is compiled on first use,
+        so intermediate rules created by ``merge`` are never compiled.
+        """
+        if self._compiled is None:
+            compiled = re.compile(self._pattern, self.flags)
+            self._templates = [sre_parse.parse_template(template, compiled)
+                for template in self._sources]
+            self._compiled = compiled
+        return self._compiled
+
+    @staticmethod
+    def rename(match, prefix):
+        """Adds ``prefix`` to names of groups in expression."""
+        if match.group(2) is not None:
+            return '(?P<%s%s>' % (prefix, match.group(2))
+        if match.group(4) is not None:
+            return '(?P=%s%s)' % (prefix, match.group(4))
+        return match.group(0)
+
+    @staticmethod
+    def translate(match, prefix, offset):
+        """Changes references to groups in expansion template."""
+        name, number = match.group(2, 3)
+        if name is not None:
+            if name.isdigit():
+                return '\\g<%d>' % (int(name) + offset)
+            return '\\g<%s%s>' % (prefix, name)
+        if number is not None:
+            return '\\g<%d>' % (int(number) + offset)
+        return match.group(0)
+
+    def mergeable(self, other):
+        """Do it."""
+        return (self.rules[-1].mergeable(other)
+            and self.groups + other.compiled.groups + 1 <= self.MAX_GROUPS)
+
+    def merge(self, other):
+        """Do it."""
+        return Fused(self.rules + [other])
+
+    def core(self, value, path):
+        """Do it."""
+        value = super(Fused, self).core(value, path)
+        result = self.result(value, path)
+        if result is FAILURE:
             raise IncorrectException(self, value)
-        value = match.expand(self.expand)
-        return value
+        return result
+
+    def result(self, value, path):
+        """Do it."""
+        match = self.compiled.match(value)
+        if match is None:
+            return FAILURE
+        index = self._indexes[match.lastindex]
+        result = sre_parse.expand_template(self._templates[index], match)
+        if not result and not self.allow_empty:
+            # Empty expansion is incorrect, so ``Or`` would try next rules
+            for rule in self.rules[index + 1:]:
+                result = rule.attempt(value, path)
+                if result is not FAILURE:
+                    return result
+            return FAILURE
+        return result
 
 
 class Uri(String):
@@ -367,6 +950,7 @@ class Uri(String):
         
         ``verify_sites`` is list of sites to be verified.
         Validation will try to fetch specified url for such sites. 
+        Results are cached (see ``trustedhtml.verification``).
         
         ``verify_schemes`` is list of allowed schemes for verification.
         
@@ -427,6 +1011,14 @@ class Uri(String):
         self.local_schemes = self.lower_list(local_schemes)
         self.verify_local = verify_local
 
+    def pure(self):
+        """
+        Rule is not pure if it can verify links:
+        result depends on remote sites and links can be collected
+        for deferred verification.
+        """
+        return not self.verify_local and not self.verify_sites
+
     @staticmethod
     def inlist(value, lst):
         """
@@ -482,12 +1074,12 @@ class Uri(String):
                     raise IncorrectException(self, value)
             elif self.verify_local is not False:
                 check = urljoin(check_scheme, self.verify_local, path, query, fragment)
-                if not remote_check(check):
+                if not remote_check(check, urljoin(scheme, authority, path, query, fragment)):
                     raise IncorrectException(self, value)
         elif self.inlist(scheme, self.verify_schemes) and self.inlist(authority, self.verify_sites):
             if authority is not None:
                 check = urljoin(check_scheme, authority, path, query, fragment)
-                if not remote_check(check):
+                if not remote_check(check, urljoin(scheme, authority, path, query, fragment)):
                     raise IncorrectException(self, value)
         value = urljoin(scheme, authority, path, query, fragment)
         return value
@@ -503,6 +1095,10 @@ class No(Rule):
         """Do it."""
         raise IncorrectException(self, value)
 
+    def result(self, value, path):
+        """Do it."""
+        return FAILURE
+
 
 class And(Rule):
     """
@@ -522,11 +1118,27 @@ class And(Rule):
     def core(self, value, path):
         """Do it."""
         value = super(And, self).core(value, path)
-        path = path[:] + [self]
+        path = Path(path, self)
         for rule in self.rules:
             value = rule.validate(value, path)
         return value
 
+    def result(self, value, path):
+        """Do it."""
+        path = Path(path, self)
+        for rule in self.rules:
+            value = rule.attempt(value, path)
+            if value is FAILURE:
+                return FAILURE
+        return value
+
+    def validates_absent(self):
+        """Do it."""
+        if self.default is not None or self.invalid or self.element_exception:
+            return True
+        return self.allow_empty and (
+            not self.rules or self.rules[0].validates_absent())
+
 
 class Or(Rule):
     """
@@ -542,20 +1154,84 @@ class Or(Rule):
         """
         super(Or, self).__init__(**kwargs)
         self.rules = rules
+        # Optimized rules will be built on first use.
+        self._merged = NOT_COMPILED
+
+    def compile(self):
+        """
+        Optimizes ``rules``: includes rules of nested Or rules,
+        merges adjacent List rules into one List with single lookup
+        and fuses adjacent RegExp rules into one expression.
+        It is called on first validation,
+        call it if ``rules`` was changed after that.
+        """
+        rules = []
+        for rule in self.alternatives():
+            if rules and hasattr(rules[-1], 'mergeable') and rules[-1].mergeable(rule):
+                rules[-1] = rules[-1].merge(rule)
+            else:
+                rules.append(rule)
+        if rules == self.rules:
+            rules = None
+        self._merged = rules
+
+    def alternatives(self):
+        """
+        Returns ``rules`` where nested Or rules are replaced by their rules.
+        """
+        rules = []
+        for rule in self.rules:
+            if (rule.__class__ is Or and rule.allow_empty and rule.default is None
+                    and not rule.invalid and not rule.element_exception):
+                rules.extend(rule.alternatives())
+            else:
+                rules.append(rule)
+        return rules
+
+    def get_rules(self):
+        """
+        Returns optimized rules.
+        Source rules are returned if somebody listens signals
+        of optimized rules.
+        """
+        if self._merged is NOT_COMPILED:
+            self.compile()
+        if self._merged is None:
+            return self.rules
+        for cls in (Or, List, RegExp):
+            if rule_done.has_listeners(cls) or rule_exception.has_listeners(cls):
+                return self.rules
+        return self._merged
 
     def core(self, value, path):
         """Do it."""
         value = super(Or, self).core(value, path)
-        path = path[:] + [self]
-        last = IncorrectException
-        for rule in self.rules:
-            try:
-                return rule.validate(value, path)
-            except ElementException, exception:
-                raise exception
-            except TrustedException, exception:
-                last = exception
-        raise last
+        rules = self.get_rules()
+        if not rules:
+            raise IncorrectException
+        path = Path(path, self)
+        for rule in rules[:-1]:
+            result = rule.attempt(value, path)
+            if result is not FAILURE:
+                return result
+        # Exception of the last rule is raised
+        return rules[-1].validate(value, path)
+
+    def result(self, value, path):
+        """Do it."""
+        path = Path(path, self)
+        for rule in self.get_rules():
+            result = rule.attempt(value, path)
+            if result is not FAILURE:
+                return result
+        return FAILURE
+
+    def validates_absent(self):
+        """Do it."""
+        if self.default is not None or self.invalid or self.element_exception:
+            return True
+        return self.allow_empty and any([
+            rule.validates_absent() for rule in self.rules])
 
 
 class Sequence(String):
@@ -565,6 +1241,8 @@ class Sequence(String):
     Validation will return joined parts of value.
     """
 
+    _compiled = None
+
     def __init__(
             self, rule, regexp=r'\s+', flags=0, min_split=0, max_split=0,
             join_string=' ', prepend_string='', append_string='', **kwargs):
@@ -595,13 +1273,26 @@ class Sequence(String):
         self.flags = flags
         if not self.case_sensitive:
             self.flags = self.flags | re.IGNORECASE
-        self.compiled = re.compile(unicode(self.regexp), self.flags)
         self.min_split = min_split
         self.max_split = max_split
         self.join_string = join_string
         self.prepend_string = prepend_string
         self.append_string = append_string
 
+    @property
+    def compiled(self):
+        """Compiled ``regexp``. It is compiled on first use."""
+        if self._compiled is None:
+            self._compiled = re.compile(unicode(self.regexp), self.flags)
+        return self._compiled
+
+    @compiled.setter
+    def compiled(self, value):
+        """Assigned expression replaces ``regexp`` and ``flags``."""
+        self.regexp = value.pattern
+        self.flags = value.flags
+        self._compiled = value
+
     def sequence(self, values, path):
         """
         This function is called from ``core`` function.
@@ -619,19 +1310,45 @@ class Sequence(String):
             result.append(self.rule.validate(value, path))
         return result
 
+    def sequence_result(self, values, path):
+        """
+        Non-raising variant of ``sequence``.
+        Returns correct list of parts of value or FAILURE.
+        """
+        result = []
+        for value in values:
+            value = self.rule.attempt(value, path)
+            if value is FAILURE:
+                return FAILURE
+            result.append(value)
+        return result
+
     def core(self, value, path):
         """Do it."""
         value = super(Sequence, self).core(value, path)
         values = self.compiled.split(value)
         if (len(values) < self.min_split) or (self.max_split and len(values) > self.max_split):
             raise IncorrectException(self, value)
-        path = path[:] + [self]
+        path = Path(path, self)
         values = self.sequence(values, path)
+        return self.join(values)
+
+    def result(self, value, path):
+        """Do it."""
+        values = self.compiled.split(value)
+        if (len(values) < self.min_split) or (self.max_split and len(values) > self.max_split):
+            return FAILURE
+        path = Path(path, self)
+        values = self.sequence_result(values, path)
+        if values is FAILURE:
+            return FAILURE
+        return self.join(values)
+
+    def join(self, values):
+        """Returns value joined from correct ``values``."""
         if values:
-            value = self.prepend_string + self.join_string.join(values) + self.append_string
-        else:
-            value = u''
-        return value
+            return self.prepend_string + self.join_string.join(values) + self.append_string
+        return u''
 
 
 class Complex(Sequence):
@@ -642,17 +1359,28 @@ class Complex(Sequence):
     Validation will return joined parts of value.
     """
 
-    def __init__(self, rules, **kwargs):
+    def __init__(self, rules, max_work=None, **kwargs):
         """
         ``rules`` is list of rules for validation.
+
+        ``max_work`` is maximum number of validations of parts by rules
+        for one value. Value is incorrect if it requires more validations.
+        If it is None TRUSTEDHTML_COMPLEX_MAX_WORK will be used.
         """
         super(Complex, self).__init__(rule=None, **kwargs)
         self.rules = rules
+        if max_work is None:
+            max_work = settings.TRUSTEDHTML_COMPLEX_MAX_WORK
+        self.max_work = max_work
 
     def sequence(self, values, path):
         """Do it."""
         return self.complex(values, path, 0, 0)
 
+    def sequence_result(self, values, path):
+        """Do it."""
+        return self.complex_result(values, path, 0, 0)
+
     def complex(self, values, path, value_index, rule_index):
         """
         This function is called by ``sequence`` function.
@@ -667,19 +1395,49 @@ class Complex(Sequence):
         
         Return correct list of parts of value or raise IncorrectException or ElementException.
         """
-        if value_index >= len(values):
-            return values
-        if rule_index >= len(self.rules):
+        result = self.complex_result(values, path, value_index, rule_index)
+        if result is FAILURE:
             raise IncorrectException(self, values)
-        try:
-            value = self.rules[rule_index].validate(values[value_index], path)
-            result = self.complex(values, path, value_index + 1, rule_index + 1)
-            result[value_index] = value
-            return result
-        except ElementException, exception:
-            raise exception
-        except TrustedException:
-            return self.complex(values, path, value_index, rule_index + 1)
+        return result
+
+    def complex_result(self, values, path, value_index, rule_index):
+        """
+        Non-raising variant of ``complex``.
+        Returns correct list of parts of value or FAILURE.
+
+        Each part is matched with the first suitable rule such that
+        the rest of parts can be matched with the rest of rules.
+        Positions (``value_index``, ``rule_index``) from which matching
+        failed are remembered, so each part is validated by each rule
+        at most once and time is proportional to number of parts.
+        """
+        failed = set()
+        work = [self.max_work]
+        rules = self.rules
+
+        def match(value_index, rule_index):
+            if value_index >= len(values):
+                return True
+            # Each rule can be used for one part only.
+            if len(values) - value_index > len(rules) - rule_index:
+                return False
+            if (value_index, rule_index) in failed:
+                return False
+            if work[0] <= 0:
+                return False
+            work[0] -= 1
+            value = rules[rule_index].attempt(values[value_index], path)
+            if value is not FAILURE and match(value_index + 1, rule_index + 1):
+                values[value_index] = value
+                return True
+            if match(value_index, rule_index + 1):
+                return True
+            failed.add((value_index, rule_index))
+            return False
+
+        if not match(value_index, rule_index):
+            return FAILURE
+        return values
 
 
 class Validator(object):
@@ -694,6 +1452,26 @@ class Validator(object):
         (or tag attribute) and value is corresponding rule.
         """
         self.rules = rules
+        self.compile()
+
+    def compile(self):
+        """
+        Prepares ``rules`` for ``check``.
+        Call it if ``rules`` was changed after initialization.
+
+        ``named_rules`` is dictionary with lowered names of properties.
+
+        ``absent_rules`` is list of (property, rule) pairs, as 2-tuples,
+        for rules that must be called even if property is absent
+        (defaults or required properties), sorted by names.
+        """
+        self.named_rules = {}
+        self.absent_rules = []
+        for name, rule in sorted(self.rules.iteritems()):
+            name = name.lower()
+            self.named_rules[name] = rule
+            if rule.validates_absent():
+                self.absent_rules.append((name, rule))
 
     def check(self, values, path):
         """
@@ -707,30 +1485,37 @@ class Validator(object):
         
         Return list of correct values depending on rules.
         Or raise exceptions.
+
+        Only rules for specified properties and ``absent_rules`` are called.
+        Values are ordered as in source (first occurrence of the property),
+        new values are appended.
         """
         if not self.rules:
             return []
-        correct = {}
+        order = []
         source = {}
         for name, value in values:
             name = name.lower()
+            if name not in source:
+                order.append(name)
             source[name] = value
-        for name, rule in self.rules.iteritems():
-            try:
-                name = name.lower()
-                value = source.get(name, None)
-                correct[name] = rule.validate(value, path)
-            except ElementException, exception:
-                raise exception
-            except TrustedException:
-                pass
-        # Order values is source ordering. New values will be appended.
-        order = [name.lower() for name, value in values]
-        append = [name for name, value in correct.iteritems() if name not in order]
-        order.extend(append)
-        values = [(order.index(name), name, value) for name, value in correct.iteritems()]
-        values.sort()
-        return [(name, value) for index, name, value in values]
+        # Check absent values first: required properties fail fast.
+        append = []
+        for name, rule in self.absent_rules:
+            if name in source:
+                continue
+            value = rule.attempt(None, path)
+            if value is not FAILURE:
+                append.append((name, value))
+        correct = []
+        for name in order:
+            rule = self.named_rules.get(name, None)
+            if rule is None:
+                continue
+            value = rule.attempt(source[name], path)
+            if value is not FAILURE:
+                correct.append((name, value))
+        return correct + append
 
 
 class Style(Sequence, Validator):
@@ -861,10 +1646,12 @@ class Html(String):
     CODE_RE_SPECIAL = dict(
         [(0, '')] + [(ord(char), string) for char, string in SPECIAL_CHARS])
     SYSTEM_RE = re.compile('[\x01-\x1F\s]+')
+    CONTROL_RE = re.compile('[\x01-\x1F]')
+    SPACES_RE = re.compile('  +')
 
     NBSP_CHAR = u'\xa0'
     NBSP_TEXT = '&nbsp;'
-    NBSP_RE = re.compile('[' + NBSP_CHAR + ' ]{2,}')
+    NBSP_RE = re.compile('[' + NBSP_CHAR + ' ][' + NBSP_CHAR + ' ]+')
 
     DEFAULT_ROOT_TAG = 'p'
 
@@ -872,11 +1659,19 @@ class Html(String):
         (re.compile('<!-([^-])'), lambda match: '<!--' + match.group(1))
     ]
 
-    BEAUTIFUL_SOUP = BeautifulSoup()
+    ITERATIVE = 0
+    SINGLE_PASS = 1
+
+    # Edges of the root collected by ``transform`` for ``validate_blocks``.
+    _edges = None
+
+    SOUP_PARSER = SoupParser()
+    FAST_PARSER = FastParser()
 
     def __init__(
             self, rules, fix_number=2, prepare_number=2, root_tags=None,
-            allow_empty=True, **kwargs):
+            allow_empty=True, engine=ITERATIVE, cache=None,
+            parser=FAST_PARSER, parallel_size=None, processes=None, **kwargs):
         """
         ``rules`` is dictionary in witch key is name of property
         (or tag attribute) and value is corresponding rule.
@@ -886,6 +1681,39 @@ class Html(String):
         ``prepare_number`` specified number of maximum attempts to prepare value.
 
         ``root_tags`` list of tags that can be in the root of document.
+
+        ``engine`` specified how to reach the stable result:
+            ITERATIVE will parse and serialize value again and again
+            until it stops changing.
+
+            SINGLE_PASS will parse and serialize value once
+            if the fixed tree is already stable
+            (it will be parsed to the same tree again).
+            Otherwise it will continue just like ITERATIVE.
+            Both engines return the same results.
+
+        ``cache`` is cache for results of validation
+        (see ``trustedhtml.cache`` for available backends).
+            None to use cache specified by TRUSTEDHTML_CACHE setting.
+
+            False to disable cache.
+        Cached results are returned without signals to be sent.
+
+        ``parser`` is backend that builds tree for value
+        (see ``trustedhtml.parser``):
+            FAST_PARSER uses own tokenizer and lightweight tree.
+
+            SOUP_PARSER uses BeautifulSoup.
+            Both parsers return the same results.
+
+        ``parallel_size`` is minimal length of value to be validated
+        by blocks in worker processes (see ``validate_parallel``).
+            0 to validate all values in this process.
+            None to use TRUSTEDHTML_PARALLEL_SIZE setting.
+
+        ``processes`` is number of worker processes.
+            None to use TRUSTEDHTML_PARALLEL_PROCESSES setting
+            (number of CPUs if it is None too).
         """
         if root_tags is None:
             root_tags = []
@@ -894,30 +1722,416 @@ class Html(String):
         self.fix_number = fix_number
         self.prepare_number = prepare_number
         self.root_tags = root_tags
+        self.engine = engine
+        self.parser = parser
+        if parallel_size is None:
+            parallel_size = settings.TRUSTEDHTML_PARALLEL_SIZE
+        self.parallel_size = parallel_size
+        if processes is None:
+            processes = settings.TRUSTEDHTML_PARALLEL_PROCESSES
+        self.processes = processes
+        self._cache = cache
+        self._fingerprint = None
+        self._classes = None
+        self._listened = None
+        self._pure = None
+        self._pickled = None
+        self._calculated = None
         if self.DEFAULT_ROOT_TAG not in self.root_tags:
             self.root_tags.append(self.DEFAULT_ROOT_TAG)
 
+    def pure(self):
+        """
+        Results of Html are cached by ``validate`` (see ``get_cache``),
+        they are not remembered by memo.
+        """
+        return False
+
+    def get_cache(self):
+        """Returns cache for results of validation or None."""
+        if self._cache is None:
+            return get_default_cache()
+        if self._cache is False:
+            return None
+        return self._cache
+
+    def compile(self):
+        """
+        Forgets fingerprint, classes, purity and pickled copy
+        calculated for the tree. They are forgotten automatically
+        when attribute of any rule is changed, call it after you change
+        lists or dictionaries of rules in place.
+        """
+        self._fingerprint = None
+        self._classes = None
+        self._listened = None
+        self._pure = None
+        self._pickled = None
+
+    def check_changes(self):
+        """Calls ``compile`` if any rule was changed after values was calculated."""
+        changed = Rule._changed
+        if self._calculated != changed:
+            self.compile()
+            self._calculated = changed
+
+    def __getstate__(self):
+        """
+        Values calculated for the tree are pickled only if they are actual.
+        Answers about receivers of signals and pickled copy are not pickled.
+        """
+        state = self.__dict__.copy()
+        if self._calculated != Rule._changed:
+            state.update(_fingerprint=None, _classes=None, _pure=None)
+        state.update(_listened=None, _pickled=None, _calculated=None)
+        return state
+
+    def __setstate__(self, state):
+        """Values calculated for the tree are actual for the restored tree."""
+        self.__dict__.update(state)
+        self._calculated = Rule._changed
+
+    def fingerprint(self):
+        """
+        Returns digest of this rule tree and settings (see ``compile``).
+        """
+        self.check_changes()
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(self)
+        return self._fingerprint
+
+    def listened(self):
+        """
+        Returns whether somebody listens signals of rules in the tree
+        (see ``compile``). Answer is remembered until receivers are changed.
+        """
+        self.check_changes()
+        generations = (rule_done.generation, rule_exception.generation)
+        if self._listened is not None and self._listened[0] == generations:
+            return self._listened[1]
+        if self._classes is None:
+            classes = []
+            for rule in walk(self):
+                if rule.__class__ not in classes:
+                    classes.append(rule.__class__)
+            self._classes = classes
+        result = False
+        for cls in self._classes:
+            if rule_done.has_listeners(cls) or rule_exception.has_listeners(cls):
+                result = True
+                break
+        self._listened = (generations, result)
+        return result
+
+    def pickled(self):
+        """
+        Returns this rule pickled for worker processes
+        or None if it can`t be pickled (see ``compile``).
+        """
+        self.check_changes()
+        if self._pickled is None:
+            rule = copy(self)
+            rule._cache = False
+            try:
+                self._pickled = cPickle.dumps(rule, cPickle.HIGHEST_PROTOCOL)
+            except (cPickle.PicklingError, TypeError):
+                self._pickled = False
+        return self._pickled or None
+
+    def validate(self, value, path=None):
+        """
+        Returns cached result of validation if it is available.
+        Otherwise validates ``value`` and caches the result.
+        Results with links that was not verified yet
+        (see TRUSTEDHTML_VERIFY_DEFERRED) are not cached.
+        Cache is not used while somebody listens signals of rules in the tree.
+        """
+        cache = self.get_cache()
+        if cache is None or not isinstance(value, basestring) or self.listened():
+            return super(Html, self).validate(value, path)
+        key = make_key(self.fingerprint(), value)
+        result = cache.get(key)
+        if result is None:
+            count = deferred()
+            result = super(Html, self).validate(value, path)
+            if deferred() == count:
+                cache.set(key, result)
+        return result
+
+    def validate_incremental(self, new_value, previous_source, previous_result, path=None):
+        """
+        Returns result of validation of ``new_value``,
+        that is edited ``previous_source`` validated to ``previous_result``.
+
+        Blocks of both values (see ``split_blocks``) are compared.
+        Only changed blocks and their neighbours are validated,
+        results of other blocks are taken from ``previous_result``.
+        Result is the same as of ``validate``, but signals are sent
+        only for validated blocks. Value is validated as a whole
+        if blocks can`t be reused.
+        """
+        cache = self.get_cache()
+        if cache is not None and self.listened():
+            cache = None
+        if cache is not None and isinstance(new_value, basestring):
+            key = make_key(self.fingerprint(), new_value)
+            result = cache.get(key)
+            if result is not None:
+                return result
+        if (isinstance(new_value, basestring) and isinstance(previous_source, basestring)
+                and isinstance(previous_result, basestring)
+                and not rule_done.has_listeners(self.__class__)):
+            count = deferred()
+            result = self.reuse_blocks(new_value, previous_source, previous_result, path)
+            if result is not None:
+                if cache is not None and deferred() == count:
+                    cache.set(key, result)
+                return result
+        return self.validate(new_value, path)
+
+    def reuse_blocks(self, value, source, result, path):
+        """
+        Returns result for ``validate_incremental``
+        or None if value must be validated as a whole.
+        """
+        try:
+            value = self.prepare(self.preprocess(value, path))
+            source = self.prepare(self.preprocess(source, path))
+        except TrustedException:
+            return None
+        if value == source:
+            return result
+        offsets = self.split_blocks(value)
+        source_offsets = self.split_edited(source, value, offsets)
+        blocks = self.get_blocks(value, offsets)
+        source_blocks = self.get_blocks(source, source_offsets)
+        size = min(len(blocks), len(source_blocks))
+        prefix = 0
+        while prefix < size and blocks[prefix] == source_blocks[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < size - prefix and blocks[-1 - suffix] == source_blocks[-1 - suffix]:
+            suffix += 1
+        start = max(prefix - 1, 0)
+        stop = len(blocks) - max(suffix - 1, 0)
+        source_stop = len(source_blocks) - max(suffix - 1, 0)
+        if not start and stop == len(blocks):
+            return None
+        changed = self.validate_blocks(value, offsets, start, stop, path)
+        if changed is None:
+            return None
+        previous = self.validate_blocks(source, source_offsets, start, source_stop, path)
+        if previous is None:
+            return None
+        if not start:
+            position = 0
+        elif stop == len(blocks):
+            position = len(result) - len(previous)
+        else:
+            position = result.find(previous)
+            if result.find(previous, position + 1) != -1:
+                return None
+        if position < 0 or result[position:position + len(previous)] != previous:
+            return None
+        return result[:position] + changed + result[position + len(previous):]
+
+    def split_blocks(self, value):
+        """
+        Returns offsets of blocks in prepared ``value``, the first one is 0.
+        Blocks start with top-level root tags (text before the first one
+        is in the first block) and they are parsed to the same trees
+        as the whole ``value``.
+        """
+        offsets = Splitter(value, self.MARKUP_MASSAGE, self.root_tags).split()[0]
+        if not offsets or offsets[0]:
+            offsets.insert(0, 0)
+        return offsets
+
+    def split_edited(self, value, edited, offsets):
+        """
+        Returns offsets of blocks in prepared ``value`` (see ``split_blocks``),
+        that was changed to ``edited`` with blocks at ``offsets``.
+        Only changed part of ``value`` is tokenized:
+        from the last block before the first changed char (tokenizer
+        starts there from scratch for both values) to the first block
+        where tokenizer can stop in the same state after the last changed char.
+        """
+        head = common_prefix(value, edited)
+        tail = common_suffix(value, edited, min(len(value), len(edited)) - head)
+        shift = len(edited) - len(value)
+        index = bisect_left(offsets, head) - 1
+        if index < 0:
+            index = 0
+        start = offsets[index]
+        result = offsets[:index]
+        for stop in xrange(index + 1, len(offsets)):
+            end = offsets[stop] - shift
+            if end >= len(value) - tail and end > start:
+                break
+        else:
+            stop = len(offsets)
+        closed = False
+        if stop < len(offsets):
+            found, closed = Splitter(value[start:end], self.MARKUP_MASSAGE, self.root_tags).split()
+        if closed:
+            found.extend([offset - shift - start for offset in offsets[stop:]])
+        else:
+            found = Splitter(value[start:], self.MARKUP_MASSAGE, self.root_tags).split()[0]
+        result.extend([start + offset for offset in found])
+        if not result or result[0]:
+            result.insert(0, 0)
+        return result
+
+    def get_blocks(self, value, offsets):
+        """Returns list of blocks of ``value`` for ``offsets``."""
+        return [value[start:stop] for start, stop in zip(offsets, offsets[1:] + [len(value)])]
+
+    def get_region(self, value, offsets, start, stop):
+        """
+        Returns blocks of prepared ``value`` from ``start`` to ``stop``
+        (whitespace after them is not included).
+        """
+        if stop < len(offsets):
+            return value[offsets[start]:offsets[stop]].rstrip(ASCII_SPACES)
+        return value[offsets[start]:]
+
+    def validate_blocks(self, value, offsets, start, stop, path):
+        """
+        Returns result of validation of blocks of prepared ``value``
+        from ``start`` to ``stop`` (see ``validate_region``).
+        """
+        return self.validate_region(self.get_region(value, offsets, start, stop),
+            start > 0, stop < len(offsets), path)
+
+    def validate_region(self, region, has_previous, has_next, path):
+        """
+        Returns result of validation of ``region`` (see ``get_region``).
+        Returns None if validation fails or if the result
+        can be joined or wrapped with neighbour blocks:
+        previous ones if ``has_previous`` and next ones if ``has_next``.
+        """
+        rule = copy(self)
+        rule._cache = False
+        rule._edges = []
+        try:
+            result = rule.validate(region, path)
+        except TrustedException:
+            return None
+        for first, last in rule._edges:
+            if (has_previous and not first) or (has_next and not last):
+                return None
+        return result
+
+    def parallelizable(self, value):
+        """
+        Returns whether ``value`` can be validated by ``validate_parallel``:
+        it is not shorter than ``parallel_size``, all rules in the tree
+        are pure and nobody listens their signals
+        (workers can`t send signals to this process).
+        Regions (see ``validate_region``) are not split again.
+        Purity is calculated once (see ``compile``).
+        """
+        if not self.parallel_size or len(value) < self.parallel_size:
+            return False
+        if get_processes(self.processes) < 2 or self._edges is not None:
+            return False
+        self.check_changes()
+        if self._pure is None:
+            self._pure = super(Html, self).pure()
+        return self._pure and not self.listened()
+
+    def validate_parallel(self, value, path):
+        """
+        Returns result of validation of preprocessed ``value``
+        or None if it must be validated as a whole.
+
+        Blocks of value (see ``split_blocks``) are grouped to regions
+        of similar length, one per process. Regions are validated
+        in worker processes and their results are joined.
+        Result is the same as of ``validate``: value is validated as a whole
+        if any region fails or can be joined or wrapped with neighbours
+        or if the rule can`t be pickled.
+        """
+        if self.pickled() is None:
+            return None
+        value = self.prepare(value)
+        offsets = self.split_blocks(value)
+        number = min(get_processes(self.processes), len(offsets))
+        bounds = [0]
+        for index in xrange(1, number):
+            bound = bisect_left(offsets, len(value) * index / number)
+            if bounds[-1] < bound < len(offsets):
+                bounds.append(bound)
+        bounds.append(len(offsets))
+        if len(bounds) < 3:
+            return None
+        regions = [(self.get_region(value, offsets, start, stop), start > 0, stop < len(offsets))
+            for start, stop in zip(bounds, bounds[1:])]
+        results = validate_regions(self, regions, path)
+        if None in results:
+            return None
+        return u''.join(results)
+
     def remove_spaces(self, value):
         """Removes spaces from ``value``"""
         return self.NBSP_RE.sub(self.NBSP_CHAR, value)
 
+    def escape(self, value):
+        """Removes spaces from ``value`` and replaces SPECIAL_CHARS."""
+        value = self.remove_spaces(value)
+        for char, string in self.SPECIAL_CHARS:
+            if char in value:
+                value = value.replace(char, string)
+        return value
+
+    def unescape(self, value):
+        """Replaces escaped SPECIAL_CHARS in ``value`` back."""
+        if '&' not in value:
+            return value
+        for char, string in self.PLAIN_CHARS:
+            if string in value:
+                value = value.replace(string, char)
+        return value
+
+    def decode_code(self, match):
+        """Returns char for match of CODE_RE."""
+        try:
+            if match.group(2):
+                code = int(match.group(2))
+            elif match.group(3):
+                code = int(match.group(3), 16)
+            else:
+                code = 0
+            if code in self.CODE_RE_SPECIAL:
+                return self.CODE_RE_SPECIAL[code]
+            return unichr(code)
+        except (ValueError, OverflowError):
+            return ''
+
     def correct(self, value):
-        """Prepare chars in ``value``. Replace system values."""
-        def code_re_sub(match):
-            try:
-                if match.group(2):
-                    code = int(match.group(2))
-                elif match.group(3):
-                    code = int(match.group(3), 16)
-                else:
-                    code = 0
-                if code in self.CODE_RE_SPECIAL:
-                    return self.CODE_RE_SPECIAL[code]
-                return unichr(code)
-            except (ValueError, OverflowError):
-                return ''
+        """
+        Prepare chars in ``value``. Replace system values.
+        Result is the same as of ``correct_passes``:
+        each control char becomes space, then run of spaces becomes one space
+        and run of spaces with NBSP_CHAR becomes NBSP_CHAR.
+        Expressions start with chars, so they are searched quickly
+        and common single spaces are not replaced.
+        """
+        if '\0' in value:
+            value = value.replace('\0', '')
+        if '&#' in value:
+            value = self.CODE_RE.sub(self.decode_code, value)
+        value = self.CONTROL_RE.sub(' ', value)
+        value = self.SPACES_RE.sub(' ', value)
+        return self.remove_spaces(value)
+
+    def correct_passes(self, value):
+        """
+        Prepare chars in ``value`` by separate passes.
+        It is reference implementation of ``correct``.
+        """
         value = value.replace('\0', '')
-        value = self.CODE_RE.sub(code_re_sub, value)
+        value = self.CODE_RE.sub(self.decode_code, value)
         value = self.SYSTEM_RE.sub(' ', value)
         value = self.remove_spaces(value)
         return value
@@ -925,7 +2139,7 @@ class Html(String):
     def clear(self, soup, path):
         index = 0
         while index < len(soup.contents):
-            if isinstance(soup.contents[index], Tag):
+            if isinstance(soup.contents[index], self.parser.Tag):
                 rule = self.rules.get(soup.contents[index].name, None)
                 try:
                     tag = soup.contents[index]
@@ -935,23 +2149,18 @@ class Html(String):
                         raise IncorrectException(self, tag.attrs)
                     tag.attrs = rule.validate(tag.attrs, path)
                 except TrustedException:
-                    element = soup.contents[index].extract()
                     if rule is None or getattr(rule, 'save_content', True):
-                        insert = index
-                        while len(element.contents):
-                            soup.insert(insert, element.contents[0])
-                            insert += 1
+                        self.parser.unwrap(soup, index)
+                    else:
+                        self.parser.remove(soup, index)
                     continue
                 self.clear(soup.contents[index], path)
-            elif soup.contents[index].__class__ is NavigableString:
-                value = soup.contents[index].string
-                value = self.remove_spaces(value)
-                for char, string in self.SPECIAL_CHARS:
-                    value = value.replace(char, string)
+            elif soup.contents[index].__class__ is self.parser.Text:
+                value = self.escape(soup.contents[index].string)
                 if value != soup.contents[index].string:
-                    soup.contents[index].replaceWith(value)
+                    self.parser.replace(soup, index, value)
             else:
-                soup.contents[index].extract()
+                self.parser.remove(soup, index)
                 continue
             index += 1
         return soup
@@ -961,66 +2170,87 @@ class Html(String):
         index = 0
         while index < len(soup.contents) - 1:
             if (
-                    not isinstance(soup.contents[index + 1], Tag)
-                    and not isinstance(soup.contents[index], Tag)):
+                    not isinstance(soup.contents[index + 1], self.parser.Tag)
+                    and not isinstance(soup.contents[index], self.parser.Tag)):
                 text = soup.contents[index].string + soup.contents[index + 1].string
                 text = self.correct(text)
                 if text != soup.contents[index].string:
-                    soup.contents[index].replaceWith(text)
-                soup.contents[index + 1].extract()
+                    self.parser.replace(soup, index, text)
+                self.parser.remove(soup, index + 1)
                 changed = True
                 continue
             index += 1
         return changed
 
     def collapse(self, soup):
-        changed = True
-        while changed:
-            changed = False
-            index = 0
-            while index < len(soup.contents):
-                if isinstance(soup.contents[index], Tag):
-                    self.collapse(soup.contents[index])
-                    if not self.BEAUTIFUL_SOUP.isSelfClosingTag(soup.contents[index].name):
-                        text = soup.contents[index].renderContents(encoding=None)
-                        # encoding=None: Fix bug in BeautifulSoup (don`t work with unicode)
-                        text = self.correct(text)
-                        if not text or text == ' ' or text == self.NBSP_CHAR:
-                            rule = self.rules[soup.contents[index].name]
-                            if rule.default and text != rule.default:
-                                changed = True
-                                text = rule.default
-                                while soup.contents[index].contents:
-                                    soup.contents[index].contents[0].extract()
-                                soup.contents[index].append(text)
-                            else:
-                                if not rule.empty_element:
-                                    changed = True
-                                    if text:
-                                        soup.contents[index].replaceWith(text)
-                                    else:
-                                        soup.contents[index].extract()
-                                        continue
-                index += 1
-            if not changed:
-                if self.join(soup):
-                    changed = True
+        """
+        Removes empty elements, sets default content for empty elements
+        and joins adjacent strings. Each element is visited once.
+        """
+        self.collapse_contents(soup)
         return soup
 
+    def collapse_contents(self, soup):
+        """
+        Collapses contents of ``soup``.
+
+        Returns corrected text of ``soup`` if there is no tags inside it.
+        So element is empty if it returns '', ' ' or NBSP_CHAR.
+        Returns None if there are tags inside ``soup``.
+        """
+        tag = self.parser.Tag
+        index = 0
+        while index < len(soup.contents):
+            content = soup.contents[index]
+            if isinstance(content, tag):
+                text = self.collapse_contents(content)
+                if (text is None or self.parser.is_self_closing(content.name)
+                        or (text and text != ' ' and text != self.NBSP_CHAR)):
+                    index += 1
+                    continue
+                rule = self.rules[content.name]
+                if rule.default and text != rule.default:
+                    while content.contents:
+                        self.parser.remove(content, 0)
+                    content.append(rule.default)
+                    index += 1
+                    continue
+                if rule.empty_element:
+                    index += 1
+                    continue
+                if not text:
+                    self.parser.remove(soup, index)
+                    continue
+                self.parser.replace(soup, index, text)
+            if index and not isinstance(soup.contents[index - 1], tag):
+                previous = soup.contents[index - 1]
+                text = self.correct(previous.string + soup.contents[index].string)
+                if text != previous.string:
+                    self.parser.replace(soup, index - 1, text)
+                self.parser.remove(soup, index)
+                continue
+            index += 1
+        text = u''
+        for content in soup.contents:
+            if isinstance(content, tag):
+                return None
+            text += content.string
+        return self.correct(text)
+
     def collapse_root(self, soup):
         index = 0
         while index < len(soup.contents):
-            if not isinstance(soup.contents[index], Tag):
+            if not isinstance(soup.contents[index], self.parser.Tag):
                 text = soup.contents[index].string
                 text = self.correct(text)
                 if not text or (text == ' ') or (text == self.NBSP_CHAR):
-                    soup.contents[index].extract()
+                    self.parser.remove(soup, index)
                     continue
             index += 1
         return soup
 
     def need_wrap(self, content, for_next):
-        if isinstance(content, Tag):
+        if isinstance(content, self.parser.Tag):
             if content.name in self.root_tags:
                 return False
         else:
@@ -1037,51 +2267,315 @@ class Html(String):
                 index += 1
             if index >= len(soup.contents):
                 break
-            start = Tag(soup, self.DEFAULT_ROOT_TAG)
-            while index < len(soup.contents) and self.need_wrap(soup.contents[index], True):
-                content = soup.contents[index].extract()
-                start.append(content)
-            soup.insert(index, start)
+            stop = index
+            while stop < len(soup.contents) and self.need_wrap(soup.contents[stop], True):
+                stop += 1
+            self.parser.enclose(soup, index, stop, self.DEFAULT_ROOT_TAG)
+            index += 1
         return soup
 
     def get_plain_text(self, soup):
         result = u''
         for content in soup:
-            if isinstance(content, Tag):
+            if isinstance(content, self.parser.Tag):
                 result += self.get_plain_text(content)
             else:
-                value = content.string
-                for char, string in self.PLAIN_CHARS:
-                    value = value.replace(string, char)
-                result += value
+                result += self.unescape(content.string)
         return result
 
-    def fix(self, value, path):
-        soup = BeautifulSoup(
-            value, markupMassage=self.MARKUP_MASSAGE,
-            convertEntities=BeautifulSoup.ALL_ENTITIES)
+    def parse(self, value):
+        """Returns tree for ``value``."""
+        return self.parser.parse(value, self.MARKUP_MASSAGE)
+
+    def fused_contents(self, soup, path):
+        """
+        Clears and collapses contents of ``soup`` visiting each node once.
+        Result is the same as of ``clear`` and ``collapse_contents``,
+        but adjacent strings are joined and corrected once
+        (escaped strings have no codes, so ``correct`` of joined strings
+        is equal to ``correct`` of joined corrected strings).
+
+        Returns the same value as ``collapse_contents``.
+        """
+        parser = self.parser
+        tag = parser.Tag
+        contents = soup.contents
+        # Strings to be joined into string at ``first`` index.
+        first = None
+        pieces = []
+        tags = False
+        index = 0
+        while index < len(contents):
+            content = contents[index]
+            if isinstance(content, tag):
+                rule = self.rules.get(content.name, None)
+                try:
+                    if rule is None:
+                        raise IncorrectException(self, content.attrs)
+                    if rule.remove_element:
+                        raise IncorrectException(self, content.attrs)
+                    content.attrs = rule.validate(content.attrs, path)
+                except TrustedException:
+                    if rule is None or getattr(rule, 'save_content', True):
+                        parser.unwrap(soup, index)
+                    else:
+                        parser.remove(soup, index)
+                    continue
+                text = self.fused_contents(content, path)
+                keep = (text is None or parser.is_self_closing(content.name)
+                    or (text and text != ' ' and text != self.NBSP_CHAR))
+                if not keep and rule.default and text != rule.default:
+                    while content.contents:
+                        parser.remove(content, 0)
+                    content.append(rule.default)
+                    keep = True
+                if keep or rule.empty_element:
+                    self.join_pieces(soup, first, pieces)
+                    first = None
+                    tags = True
+                    index += 1
+                    continue
+                if not text:
+                    parser.remove(soup, index)
+                    continue
+                if first is None:
+                    parser.replace(soup, index, text)
+                value = text
+            elif content.__class__ is parser.Text:
+                value = self.escape(content.string)
+                if first is None and value != content.string:
+                    parser.replace(soup, index, value)
+            else:
+                parser.remove(soup, index)
+                continue
+            if first is None:
+                first = index
+                pieces = [value]
+                index += 1
+            else:
+                pieces.append(value)
+                parser.remove(soup, index)
+        self.join_pieces(soup, first, pieces)
+        if tags:
+            return None
+        text = u''
+        for content in contents:
+            text += content.string
+        return self.correct(text)
+
+    def join_pieces(self, soup, first, pieces):
+        """
+        Puts corrected joined ``pieces`` into string at ``first`` index.
+        """
+        if first is not None and len(pieces) > 1:
+            text = self.correct(u''.join(pieces))
+            if text != soup.contents[first].string:
+                self.parser.replace(soup, first, text)
+
+    def fused_root(self, soup):
+        """
+        Removes empty strings from the root and wraps its contents
+        (like ``collapse_root`` and ``wrap``) in one pass.
+        """
+        contents = soup.contents
+        index = 0
+        while index < len(contents):
+            if self.blank_root(contents[index]):
+                self.parser.remove(soup, index)
+                continue
+            if not self.need_wrap(contents[index], False):
+                index += 1
+                continue
+            stop = index + 1
+            while stop < len(contents):
+                if self.blank_root(contents[stop]):
+                    self.parser.remove(soup, stop)
+                elif self.need_wrap(contents[stop], True):
+                    stop += 1
+                else:
+                    break
+            self.parser.enclose(soup, index, stop, self.DEFAULT_ROOT_TAG)
+            index += 1
+        return soup
+
+    def root_edges(self, soup):
+        """
+        Returns whether the first and the last nodes in the root ``soup``
+        are root tags, so ``fused_root`` will not join or wrap them
+        with contents of neighbour blocks.
+        Blank strings at the edges are skipped: they are removed anyway.
+        """
+        contents = soup.contents
+        first = 0
+        while first < len(contents) and self.blank_root(contents[first]):
+            first += 1
+        if first == len(contents):
+            return False, False
+        last = len(contents) - 1
+        while self.blank_root(contents[last]):
+            last -= 1
+        return (not self.need_wrap(contents[first], True),
+            not self.need_wrap(contents[last], True))
+
+    def blank_root(self, content):
+        """Returns whether ``content`` of the root is removed by ``collapse_root``."""
+        if isinstance(content, self.parser.Tag):
+            return False
+        text = self.correct(content.string)
+        return not text or (text == ' ') or (text == self.NBSP_CHAR)
+
+    def transform(self, soup, path):
+        """
+        Fixes tree ``soup`` and returns it.
+        Each node is visited once, result is the same
+        as of ``transform_passes``.
+        """
+        self.fused_contents(soup, path)
+        if self._edges is not None:
+            self._edges.append(self.root_edges(soup))
+        return self.fused_root(soup)
+
+    def transform_passes(self, soup, path):
+        """
+        Fixes tree ``soup`` by separate passes and returns it.
+        It is reference implementation of ``transform``.
+        """
         soup = self.clear(soup, path)
         soup = self.collapse(soup)
         soup = self.collapse_root(soup)
         soup = self.wrap(soup)
+        return soup
+
+    def fix(self, value, path):
+        soup = self.parse(value)
+        soup = self.transform(soup, path)
         return unicode(soup)
 
+    def prepare(self, value):
+        """Calls ``correct`` until ``value`` stops changing."""
+        for preparing in xrange(self.prepare_number + 1):
+            source = value
+            value = self.correct(value)
+            if source == value:
+                return value
+        raise IncorrectException(self, 'Too much attempts to prepare value')
+
+    def nesting_reset(self, name, stack):
+        """
+        Returns whether parser will close some of opened tags
+        when it will meet start tag with ``name``.
+
+        ``stack`` is list with names of opened tags.
+
+        It mirrors ``BeautifulSoup._smartPop``.
+        """
+        triggers = BeautifulSoup.NESTABLE_TAGS.get(name)
+        reset = name in BeautifulSoup.RESET_NESTING_TAGS
+        for index in xrange(len(stack) - 1, -1, -1):
+            if triggers is None and stack[index] == name:
+                return True
+            if (triggers is not None and stack[index] in triggers) or (
+                    triggers is None and reset
+                    and stack[index] in BeautifulSoup.RESET_NESTING_TAGS):
+                return index != len(stack) - 1
+        return False
+
+    def settled_contents(self, soup, stack):
+        """
+        Returns whether contents of ``soup`` will be parsed
+        to the same tree after serialization.
+
+        ``stack`` is list with names of parent tags.
+        """
+        tag = self.parser.Tag
+        previous = None
+        for content in soup.contents:
+            if isinstance(content, tag):
+                for name, value in content.attrs:
+                    if '&' in value or ('"' in value and "'" in value):
+                        return False
+                if self.parser.is_self_closing(content.name):
+                    if content.contents:
+                        return False
+                else:
+                    if self.nesting_reset(content.name, stack):
+                        return False
+                    stack.append(content.name)
+                    settled = self.settled_contents(content, stack)
+                    stack.pop()
+                    if not settled:
+                        return False
+            elif content.__class__ is self.parser.Text:
+                if previous is not None and not isinstance(previous, tag):
+                    return False
+                if content.translate(BeautifulSoup.STRIP_ASCII_SPACES) == '' and content != ' ':
+                    return False
+            else:
+                return False
+            previous = content
+        return True
+
+    def settled(self, soup, value):
+        """
+        Returns whether ``fix`` will return ``value`` itself.
+
+        ``value`` is serialized ``soup``.
+        """
+        if self.correct(value) != value:
+            return False
+        return self.settled_contents(soup, [])
+
     def core(self, value, path):
-        """Do it."""
-        path = path[:] + [self]
+        """
+        Validates long values by blocks in worker processes
+        (see ``parallelizable``) and others in this process.
+        """
+        if self.parallelizable(value):
+            result = self.validate_parallel(value, path)
+            if result is not None:
+                return result
+        path = Path(path, self)
         value = String.core(self, value, path)
+        return collect(self.stabilize, value, path)
+
+    def stabilize(self, value, path):
+        """
+        Fixes ``value`` until it stops changing.
+        It is called twice if there are links to be verified:
+        first call collects links to check them concurrently.
+        """
         for iteration in xrange(self.fix_number + 1):
-            for preparing in xrange(self.prepare_number + 1):
-                source = value
-                value = self.correct(value)
+            value = self.prepare(value)
+            source = value
+            if self.engine == self.SINGLE_PASS:
+                soup = self.transform(self.parse(value), path)
+                value = unicode(soup)
                 if source == value:
                     break
+                if iteration < self.fix_number and self.settled(soup, value):
+                    # Next iteration will return the same value
+                    break
             else:
-                raise IncorrectException(self, 'Too much attempts to prepare value')
-            source = value
-            value = self.fix(value, path)
-            if source == value:
-                break
+                value = self.fix(value, path)
+                if source == value:
+                    break
         else:
             raise IncorrectException(self, 'Too much attempts to fix value')
         return value
+
+    def stream(self, source, output, chunk_size=65536, encoding='utf-8'):
+        """
+        Validates ``source`` chunk by chunk and writes result to ``output``
+        without building of the whole tree (see ``trustedhtml.streaming``).
+
+        ``source`` is file-like object or string.
+
+        ``output`` is file-like object, unicode will be written to it.
+
+        ``chunk_size`` is number of chars read from ``source``
+        and written to ``output`` at once.
+
+        ``encoding`` is used to decode strings read from ``source``.
+        """
+        from trustedhtml.streaming import Sanitizer
+        Sanitizer(self, output, chunk_size).run(source, chunk_size, encoding)
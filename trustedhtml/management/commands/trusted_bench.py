@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+from trustedhtml.benchmarks.corpus import documents
+from trustedhtml.benchmarks.suite import PRESETS, run_suite, header, line
+
+
+class Command(BaseCommand):
+    help = '''Usage: manage.py trusted_bench [options]
+
+Measure time of validation by presets (full, normal, pretty)
+for typical documents: total time, time of each stage,
+throughput and peak memory.
+'''
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='Save results to JSON file.'),
+        make_option('--preset', action='append', dest='presets', default=None,
+            help='Preset to be measured (can be used several times).'),
+        make_option('--document', action='append', dest='documents', default=None,
+            help='Document to be measured (can be used several times).'),
+        make_option('--scale', type='int', dest='scale', default=1,
+            help='Multiplier for size of documents.'),
+        make_option('--number', type='int', dest='number', default=10,
+            help='Number of calls per measurement.'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        presets = options['presets']
+        names = options['documents']
+        for preset in presets or []:
+            if preset not in PRESETS:
+                raise CommandError('Unknown preset: %s' % preset)
+        available = documents()
+        for name in names or []:
+            if name not in available:
+                raise CommandError('Unknown document: %s (available: %s)' % (
+                    name, ', '.join(sorted(available))))
+        if self.verbosity:
+            self.stdout.write(header() + '\n')
+        results = run_suite(presets, names, options['scale'], options['number'],
+            report=self.report)
+        if options['output']:
+            output = open(options['output'], 'w')
+            try:
+                simplejson.dump(results, output, indent=2, sort_keys=True)
+            finally:
+                output.close()
+            if self.verbosity:
+                self.stdout.write('Results saved to %s.\n' % options['output'])
+
+    def report(self, preset, name, result):
+        if self.verbosity:
+            self.stdout.write(line(preset, name, result) + '\n')
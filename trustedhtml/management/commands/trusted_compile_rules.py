@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trustedhtml import settings
+from trustedhtml.precompiled import PRESETS, dump, fingerprint
+
+
+class Command(BaseCommand):
+    help = '''Usage: manage.py trusted_compile_rules [options]
+
+Build presets (full, normal, pretty), compile their regular expressions
+and save them to TRUSTEDHTML_COMPILED_RULES file.
+Presets will be loaded from this file while sources of rules
+and settings are not changed. Run it after each deploy.
+'''
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='Path to file (TRUSTEDHTML_COMPILED_RULES by default).'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        path = options['output'] or settings.TRUSTEDHTML_COMPILED_RULES
+        if not path:
+            raise CommandError('Specify --output or TRUSTEDHTML_COMPILED_RULES setting.')
+        from trustedhtml.rules import html
+        dump(dict([(name, getattr(html, name)) for name in PRESETS]), path)
+        if self.verbosity:
+            self.stdout.write('Presets saved to %s (%d bytes, fingerprint %s).\n' % (
+                path, os.path.getsize(path), fingerprint()))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import difflib
+import os
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import get_model, get_models
+from django.utils import simplejson
+
+from trustedhtml.classes import TrustedException
+from trustedhtml.fields import TrustedTextField, TrustedCharField, TrustedHTMLField
+from trustedhtml.utils import get_lined
+
+TRUSTED_FIELDS = (TrustedTextField, TrustedCharField, TrustedHTMLField)
+
+
+def get_trusted_fields(labels=None):
+    """
+    Returns list of (model, [field names]) for models with trusted fields.
+    Fields added by TRUSTEDHTML_MODELS are included,
+    because ``trustedhtml.models`` replaces them while models are loaded.
+
+    ``labels`` is list of "app_label.ModelName" to be processed.
+    None is used to process all models.
+    """
+    result = []
+    for model in get_models():
+        if model._meta.proxy:
+            continue
+        label = '%s.%s' % (model._meta.app_label, model._meta.object_name)
+        if labels is not None and label not in labels:
+            continue
+        names = [field.name for field in model._meta.local_fields
+            if isinstance(field, TRUSTED_FIELDS)]
+        if names:
+            result.append((model, names))
+    return result
+
+
+def sanitize(task):
+    """
+    Validates values of trusted fields.
+
+    ``task`` is (app_label, model_name, field names, rows),
+    where rows is list of (pk, value, value, ...).
+
+    Returns (changed, failed),
+    where changed is list of (pk, [(name, source, result), ...])
+    for changed fields and failed is list of pks of rows
+    which values can`t be fixed.
+    """
+    app_label, model_name, names, rows = task
+    model = get_model(app_label, model_name)
+    validators = [model._meta.get_field(name).validator for name in names]
+    changed = []
+    failed = []
+    for row in rows:
+        pk = row[0]
+        fields = []
+        try:
+            for name, validator, source in zip(names, validators, row[1:]):
+                if not source:
+                    continue
+                result = validator.validate(source)
+                if result != source:
+                    fields.append((name, source, result))
+        except TrustedException:
+            failed.append(pk)
+            continue
+        if fields:
+            changed.append((pk, fields))
+    return changed, failed
+
+
+@transaction.commit_on_success
+def update(model, rows):
+    """
+    Updates only changed fields of changed rows.
+
+    ``rows`` is list of changed rows returned by ``sanitize``.
+    """
+    manager = model._default_manager
+    for pk, fields in rows:
+        manager.filter(pk=pk).update(
+            **dict([(name, result) for name, source, result in fields]))
+
+
+class Command(BaseCommand):
+    help = '''Usage: manage.py trusted_resanitize [options] [app_label.ModelName ...]
+
+Validate all values of trusted fields again and save changed values.
+Use it after rules of validation were changed.
+By default all models with trusted fields will be processed.
+'''
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk', type='int', dest='chunk', default=500,
+            help='Number of rows to be fetched and validated at once.'),
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='Number of worker processes. '
+                'By default number of CPUs is used. '
+                'Use 1 to validate in this process.'),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+            help='File to store last processed primary keys. '
+                'Processing will be continued from it.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Show differences without saving changes.'),
+    )
+
+    def handle(self, *args, **options):
+        self.chunk = options['chunk']
+        self.dry_run = options['dry_run']
+        self.checkpoint = options['checkpoint']
+        self.verbosity = int(options.get('verbosity', 1))
+        if self.chunk < 1:
+            raise CommandError('Chunk size must be positive.')
+        self.state = self.load_checkpoint()
+        if args:
+            labels = list(args)
+        else:
+            labels = None
+        models = get_trusted_fields(labels)
+        if labels is not None and len(models) != len(labels):
+            found = ['%s.%s' % (model._meta.app_label, model._meta.object_name)
+                for model, names in models]
+            raise CommandError('There are no trusted fields in: %s' % ', '.join(
+                [label for label in labels if label not in found]))
+        processes = options['processes'] or cpu_count()
+        if processes == 1:
+            pool = None
+        else:
+            # Child processes must not share connection with this one.
+            connection.close()
+            pool = Pool(processes)
+        try:
+            for model, names in models:
+                self.process(model, names, pool, processes)
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if self.verbosity:
+            self.stdout.write('Done.\n')
+
+    def load_checkpoint(self):
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return {}
+        return simplejson.load(open(self.checkpoint))
+
+    def save_checkpoint(self):
+        if self.checkpoint is None or self.dry_run:
+            return
+        temp = self.checkpoint + '.tmp'
+        simplejson.dump(self.state, open(temp, 'w'))
+        os.rename(temp, self.checkpoint)
+
+    def get_chunks(self, model, names, last):
+        """
+        Yields chunks of rows ordered by primary key
+        starting after the ``last`` primary key.
+        """
+        queryset = model._default_manager.order_by('pk').values_list('pk', *names)
+        while True:
+            if last is None:
+                rows = queryset
+            else:
+                rows = queryset.filter(pk__gt=last)
+            rows = list(rows[:self.chunk].iterator())
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield rows
+
+    def process(self, model, names, pool, processes):
+        label = '%s.%s' % (model._meta.app_label, model._meta.object_name)
+        if self.verbosity:
+            self.stdout.write('%s: %s\n' % (label, ', '.join(names)))
+        chunks = self.get_chunks(model, names, self.state.get(label))
+        total = changed = failed = 0
+        while True:
+            tasks = []
+            for rows in chunks:
+                tasks.append((model._meta.app_label, model._meta.object_name, names, rows))
+                if pool is None or len(tasks) >= processes:
+                    break
+            if not tasks:
+                break
+            if pool is None:
+                results = map(sanitize, tasks)
+            else:
+                results = pool.map(sanitize, tasks)
+            for task, (rows, errors) in zip(tasks, results):
+                total += len(task[3])
+                changed += len(rows)
+                failed += len(errors)
+                if self.dry_run:
+                    self.show(label, rows)
+                else:
+                    update(model, rows)
+                for pk in errors:
+                    self.stderr.write('%s %s: value can`t be fixed.\n' % (label, pk))
+                self.state[label] = task[3][-1][0]
+                self.save_checkpoint()
+        if self.verbosity:
+            self.stdout.write('%s: %d rows, %d changed, %d failed.\n' % (
+                label, total, changed, failed))
+
+    def show(self, label, rows):
+        for pk, fields in rows:
+            for name, source, result in fields:
+                diff = difflib.unified_diff(
+                    get_lined(source).splitlines(), get_lined(result).splitlines(),
+                    '%s %s %s' % (label, pk, name), '%s %s %s' % (label, pk, name),
+                    lineterm='')
+                self.stdout.write(('\n'.join(diff) + '\n').encode('utf-8'))
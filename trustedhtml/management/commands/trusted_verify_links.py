@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from trustedhtml.management.commands.trusted_resanitize import get_trusted_fields, sanitize, update
+from trustedhtml.models import Link
+from trustedhtml.verification import get_verifier
+
+
+class Command(BaseCommand):
+    help = '''Usage: manage.py trusted_verify_links [options]
+
+Check links that was accepted without verification
+(if TRUSTEDHTML_VERIFY_DEFERRED is True).
+Rows with links that are not available will be validated again.
+'''
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch', type='int', dest='batch', default=100,
+            help='Number of links to be checked at once.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Check links that was already checked too.'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        batch = options['batch']
+        queryset = Link.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(checked__isnull=True)
+        verifier = get_verifier()
+        last = None
+        total = dead = 0
+        while True:
+            if last is None:
+                links = list(queryset[:batch])
+            else:
+                links = list(queryset.filter(pk__gt=last)[:batch])
+            if not links:
+                break
+            last = links[-1].pk
+            results = verifier.check_many(list(set([link.url for link in links])))
+            now = datetime.datetime.now()
+            for link in links:
+                available = results[link.url]
+                Link.objects.filter(pk=link.pk).update(checked=now, available=available)
+                total += 1
+                if not available:
+                    dead += 1
+                    if link.available is not False:
+                        self.resanitize(link.url, link.text or link.url)
+        if self.verbosity:
+            self.stdout.write('%d links checked, %d not available.\n' % (total, dead))
+
+    def resanitize(self, url, text):
+        """
+        Validates again rows that contain ``text``
+        (link to ``url`` as it is written in html).
+        """
+        if self.verbosity:
+            self.stdout.write('Not available: %s\n' % url.encode('utf-8'))
+        variants = set([text, text.replace('&', '&amp;')])
+        for model, names in get_trusted_fields():
+            query = Q()
+            for name in names:
+                for variant in variants:
+                    query |= Q(**{'%s__contains' % name: variant})
+            rows = list(model._default_manager.filter(query).values_list('pk', *names))
+            if not rows:
+                continue
+            changed, failed = sanitize(
+                (model._meta.app_label, model._meta.object_name, names, rows))
+            update(model, changed)
+            if self.verbosity:
+                self.stdout.write('%s.%s: %d rows changed.\n' % (
+                    model._meta.app_label, model._meta.object_name, len(changed)))
@@ -1,6 +1,5 @@
 from django.db import models
 from trustedhtml import settings
-from trustedhtml.classes import Html, Uri
 from trustedhtml.signals import rule_done, rule_exception
 from trustedhtml.fields import TrustedTextField, TrustedCharField, TrustedHTMLField
 from trustedhtml.importpath import importpath
@@ -19,6 +18,21 @@ class Log(models.Model):
     sender = models.CharField(max_length=100)
     rule = models.TextField()
 
+class Link(models.Model):
+    """
+    Queue of links to be checked by ``trusted_verify_links`` command.
+    Used if TRUSTEDHTML_VERIFY_DEFERRED is True.
+
+    ``url`` is link to be checked, ``text`` is the link
+    as it is written in validated html.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    url = models.TextField()
+    text = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    checked = models.DateTimeField(null=True, blank=True, db_index=True)
+    available = models.NullBooleanField()
+
 def log(sender, rule, value, source, **kwargs):
     if source != value:
         Log.objects.create(valid='exception' not in kwargs, source=source,
@@ -26,6 +40,7 @@ def log(sender, rule, value, source, **kwargs):
     return value
 
 if settings.TRUSTEDHTML_ENABLE_LOG:
+    from trustedhtml.classes import Html
     rule_done.connect(log, sender=Html)
     rule_exception.connect(log, sender=Html)
 
@@ -35,6 +50,8 @@ if settings.TRUSTEDHTML_USE_MODELURL:
     except ImportError:
         pass
     else:
+        from trustedhtml.classes import Uri
+
         def url_done(sender, rule, value, source, **kwargs):
             return ReplaceByView().url(value)
         rule_done.connect(url_done, sender=Uri)
@@ -0,0 +1,81 @@
+"""
+Validation of long documents in worker processes
+(see ``Html.validate_parallel`` and TRUSTEDHTML_PARALLEL_SIZE setting).
+
+One pool of processes is created on first use and is used for all documents.
+Each task gets pickled rule with its fingerprint, worker processes unpickle
+rule only once and remember it by fingerprint. Worker processes are forked
+at creation of the pool, so they don`t see later changes of settings.
+"""
+
+import cPickle
+import multiprocessing
+import threading
+
+from trustedhtml import settings
+
+# Maximum number of rules remembered by the worker process.
+RULES_SIZE = 16
+
+# Pool of worker processes.
+_pool = None
+_lock = threading.Lock()
+
+# Rules unpickled in the worker process by fingerprint.
+_rules = {}
+
+
+def get_processes(number):
+    """
+    Returns number of processes to be used:
+    ``number`` or number of CPUs if it is None.
+    """
+    if number is not None:
+        return number
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_pool():
+    """
+    Returns pool of worker processes. It is created on first use
+    with TRUSTEDHTML_PARALLEL_PROCESSES processes.
+    """
+    global _pool
+    _lock.acquire()
+    try:
+        if _pool is None:
+            _pool = multiprocessing.Pool(get_processes(settings.TRUSTEDHTML_PARALLEL_PROCESSES))
+        return _pool
+    finally:
+        _lock.release()
+
+
+def get_rule(key, pickled):
+    """Returns rule unpickled from ``pickled`` and remembered by ``key``."""
+    try:
+        return _rules[key]
+    except KeyError:
+        if len(_rules) >= RULES_SIZE:
+            _rules.clear()
+        rule = _rules[key] = cPickle.loads(pickled)
+        return rule
+
+
+def validate_region(arguments):
+    """Calls ``validate_region`` of the rule in the worker process."""
+    key, pickled, path, region, has_previous, has_next = arguments
+    return get_rule(key, pickled).validate_region(region, has_previous, has_next, path)
+
+
+def validate_regions(rule, regions, path):
+    """
+    Returns list with results of ``rule.validate_region``
+    for ``regions`` (list of its arguments: region, has_previous, has_next).
+    Regions are validated in the pool of worker processes.
+    Exceptions raised in processes are raised again.
+    """
+    task = (rule.fingerprint(), rule.pickled(), path)
+    return get_pool().map(validate_region, [task + region for region in regions], 1)
@@ -0,0 +1,917 @@
+"""
+Parser backends for ``Html``.
+
+Backend converts value to the tree that ``Html`` fixes and serializes.
+Both backends build the same trees and return the same results:
+
+``SoupParser`` uses vendored BeautifulSoup 3 on top of ``sgmllib``.
+
+``FastParser`` is tokenizer that follows the same rules
+(massage of markup, entities, nesting of tags and so on),
+but emits start tags, end tags and text directly into lightweight tree.
+The only difference: BeautifulSoup raises UnicodeEncodeError
+for end tags with non-ASCII names, ``FastParser`` just ignores them.
+"""
+
+import re
+import markupbase
+from htmlentitydefs import name2codepoint
+
+from beautifulsoup import BeautifulSoup, NavigableString, Tag, UnicodeDammit, buildTagMap
+
+BeautifulSoup.QUOTE_TAGS = {}
+BeautifulSoup.SELF_CLOSING_TAGS = buildTagMap(None, [
+    'area', 'base', 'basefont', 'br', 'col', 'frame', 'hr',
+    'img', 'input', 'isindex', 'link', 'meta', 'param',
+    # I don`t what is: 'spacer',
+])
+
+
+class Parser(object):
+    """
+    Interface of parser backends.
+
+    ``Tag`` is class of elements.
+    Elements have ``name``, ``attrs`` (list of (name, value)), ``contents``
+    and methods ``extract``, ``insert``, ``append``, ``replaceWith``.
+
+    ``Text`` is class of text nodes (subclass of unicode).
+    Comments, declarations and other special nodes are instances
+    of other classes, so they can be distinguished by ``__class__``.
+    """
+
+    Tag = None
+    Text = None
+
+    def parse(self, value, massage):
+        """
+        Returns root of tree for ``value``.
+        ``massage`` is list of (regexp, replacement) applied before parsing.
+        """
+        raise NotImplementedError
+
+    def new_tag(self, name):
+        """Returns new element with ``name``."""
+        raise NotImplementedError
+
+    def is_self_closing(self, name):
+        """Returns whether element with ``name`` have no contents."""
+        return name in BeautifulSoup.SELF_CLOSING_TAGS
+
+    # Operations on contents of elements by index of child.
+    # Backends can override them to avoid search of child in contents.
+
+    def remove(self, parent, index):
+        """Removes child at ``index`` of ``parent`` and returns it."""
+        return parent.contents[index].extract()
+
+    def replace(self, parent, index, value):
+        """Puts string ``value`` on the place of child at ``index``."""
+        parent.contents[index].replaceWith(value)
+
+    def unwrap(self, parent, index):
+        """Puts contents of child element at ``index`` on its place."""
+        element = parent.contents[index].extract()
+        while element.contents:
+            parent.insert(index, element.contents[0])
+            index += 1
+
+    def enclose(self, parent, start, stop, name):
+        """
+        Moves children of ``parent`` from ``start`` to ``stop``
+        into new element with ``name`` that is put on their place.
+        """
+        tag = self.new_tag(name)
+        for index in xrange(start, stop):
+            tag.append(parent.contents[start].extract())
+        parent.insert(start, tag)
+
+
+class SoupParser(Parser):
+    """
+    Backend that uses BeautifulSoup.
+    """
+
+    Tag = Tag
+    Text = NavigableString
+
+    def __init__(self):
+        self._soup = BeautifulSoup()
+
+    def parse(self, value, massage):
+        return BeautifulSoup(
+            value, markupMassage=massage,
+            convertEntities=BeautifulSoup.ALL_ENTITIES)
+
+    def new_tag(self, name):
+        return Tag(self._soup, name)
+
+
+def _index(contents, child):
+    """Returns index of ``child`` in ``contents`` (equal strings are different nodes)."""
+    for index, content in enumerate(contents):
+        if content is child:
+            return index
+    raise ValueError('child is not in contents')
+
+
+class Node(object):
+    """
+    Element of ``FastParser`` tree.
+    """
+
+    __slots__ = ('name', 'attrs', 'contents', 'parent', 'self_closing', 'hidden', 'substitution')
+
+    def __init__(self, name, attrs=None, self_closing=False):
+        if attrs is None:
+            attrs = []
+        self.name = name
+        self.attrs = attrs
+        self.contents = []
+        self.parent = None
+        self.self_closing = self_closing
+        self.hidden = False
+        # Charset of meta tag was replaced by %SOUP-ENCODING%
+        self.substitution = False
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __nonzero__(self):
+        return True
+
+    def extract(self):
+        """Removes this node from the tree."""
+        return _extract(self)
+
+    def replaceWith(self, value):
+        """Puts ``value`` on the place of this node."""
+        _replace(self, value)
+
+    def insert(self, position, child):
+        """Inserts ``child`` before ``position``."""
+        if not isinstance(child, (Node, Text)):
+            child = Text(child)
+        position = min(position, len(self.contents))
+        if child.parent is not None:
+            child.extract()
+        child.parent = self
+        self.contents.insert(position, child)
+
+    def append(self, child):
+        """Appends ``child`` to the contents."""
+        self.insert(len(self.contents), child)
+
+    def render(self):
+        """Returns serialized node."""
+        result = []
+        self.write(result.append)
+        return u''.join(result)
+
+    def write(self, write):
+        """Passes serialized parts of this node to ``write``."""
+        if not self.hidden:
+            write(self.start())
+        for content in self.contents:
+            content.write(write)
+        if not self.hidden and not self.self_closing:
+            write(u'</%s>' % self.name)
+
+    def start(self):
+        """Returns serialized start tag."""
+        result = [u'<', self.name]
+        for key, value in self.attrs:
+            if self.substitution and '%SOUP-ENCODING%' in value:
+                value = value.replace('%SOUP-ENCODING%', 'utf-8')
+            if '"' in value:
+                if "'" in value:
+                    value = value.replace("'", '&squot;')
+                format = u" %s='%s'"
+            else:
+                format = u' %s="%s"'
+            if '<' in value or '>' in value or '&' in value:
+                value = BARE_AMPERSAND_OR_BRACKET.sub(_sub_entity, value)
+            result.append(format % (key, value))
+        if self.self_closing:
+            result.append(u' />')
+        else:
+            result.append(u'>')
+        return u''.join(result)
+
+    __unicode__ = render
+
+    def __str__(self):
+        return self.render().encode('utf-8')
+
+
+class Text(unicode):
+    """
+    Text node of ``FastParser`` tree.
+    """
+
+    __slots__ = ('parent',)
+
+    def __new__(cls, value):
+        self = unicode.__new__(cls, value)
+        self.parent = None
+        return self
+
+    @property
+    def string(self):
+        return self
+
+    def extract(self):
+        """Removes this node from the tree."""
+        return _extract(self)
+
+    def replaceWith(self, value):
+        """Puts ``value`` on the place of this node."""
+        _replace(self, value)
+
+    def write(self, write):
+        write(self)
+
+
+# BeautifulSoup wraps special strings twice while rendering to unicode
+# (``NavigableString.__unicode__`` calls ``__str__`` that wraps it again).
+# They are removed by ``Html.clear``, but parsers must return the same trees.
+
+class Comment(Text):
+    __slots__ = ()
+
+    def write(self, write):
+        write(u'<!--<!--%s-->-->' % self)
+
+
+class Declaration(Text):
+    __slots__ = ()
+
+    def write(self, write):
+        write(u'<!<!%s>>' % self)
+
+
+class CData(Text):
+    __slots__ = ()
+
+    def write(self, write):
+        write(u'<![CDATA[<![CDATA[%s]]>]]>' % self)
+
+
+class ProcessingInstruction(Text):
+    __slots__ = ()
+
+    def write(self, write):
+        if '%SOUP-ENCODING%' in self:
+            write(u'<?%s?>' % self.replace('%SOUP-ENCODING%', 'utf-8'))
+        else:
+            write(u'<?<?%s?>?>' % self)
+
+
+def _extract(node):
+    if node.parent is not None:
+        del node.parent.contents[_index(node.parent.contents, node)]
+        node.parent = None
+    return node
+
+
+def _replace(node, value):
+    parent = node.parent
+    index = _index(parent.contents, node)
+    if not isinstance(value, (Node, Text)):
+        # Fast path for strings: nothing to move.
+        value = Text(value)
+        value.parent = parent
+        parent.contents[index] = value
+        node.parent = None
+        return
+    node.extract()
+    parent.insert(index, value)
+
+
+BARE_AMPERSAND_OR_BRACKET = re.compile('([<>]|&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;))')
+SPECIAL_ENTITIES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+
+
+def _sub_entity(match):
+    return SPECIAL_ENTITIES[match.group(0)]
+
+
+# Regular expressions of ``sgmllib`` (with names of tags patched by BeautifulSoup).
+INTERESTING = re.compile('[&<]')
+INCOMPLETE = re.compile(
+    '&([a-zA-Z][a-zA-Z0-9]*|#[0-9]*)?|<([a-zA-Z][^<>]*|/([a-zA-Z][^<>]*)?|![^<>]*)?')
+ENTITYREF = re.compile('&([a-zA-Z][-.a-zA-Z0-9]*)[^a-zA-Z0-9]')
+CHARREF = re.compile('&#([0-9]+)[^0-9]')
+STARTTAGOPEN = re.compile('<[>a-zA-Z]')
+SHORTTAGOPEN = re.compile('<[a-zA-Z][-.a-zA-Z0-9]*/')
+SHORTTAG = re.compile('<([a-zA-Z][-.a-zA-Z0-9]*)/([^/]*)/')
+PICLOSE = re.compile('>')
+COMMENTCLOSE = re.compile(r'--\s*>')
+ENDBRACKET = re.compile('[<>]')
+TAGFIND = re.compile('[a-zA-Z][-_.:a-zA-Z0-9]*')
+ATTRFIND = re.compile(
+    r'\s*([a-zA-Z_][-:.a-zA-Z_0-9]*)(\s*=\s*'
+    r'(\'[^\']*\'|"[^"]*"|[][\-a-zA-Z0-9./,:;+*%?!&$\(\)_#=~\'"@]*))?')
+ENTITY_OR_CHARREF = re.compile('&(?:([a-zA-Z][-.a-zA-Z0-9]*)|#([0-9]+))(;?)')
+DECLNAME = re.compile(r'[a-zA-Z][-_.:a-zA-Z0-9]*\s*')
+# Entities in values of attributes (converted again by BeautifulSoup).
+ATTR_ENTITY = re.compile('&(#\d+|#x[0-9a-fA-F]+|\w+);')
+CHARSET_RE = BeautifulSoup.CHARSET_RE
+
+XML_ENTITIES = {'apos': u"'", 'quot': u'"', 'amp': u'&', 'lt': u'<', 'gt': u'>'}
+ASCII_SPACES = u''.join([unichr(code) for code in BeautifulSoup.STRIP_ASCII_SPACES])
+PRESERVE_WHITESPACE_TAGS = BeautifulSoup.PRESERVE_WHITESPACE_TAGS
+
+
+def _convert_ref(match):
+    """Converts reference in value of attribute like ``sgmllib``."""
+    name, code, semicolon = match.groups()
+    if code:
+        number = int(code)
+        if 0 <= number <= 127:
+            return chr(number)
+        return '&#%s%s' % (code, semicolon)
+    elif semicolon:
+        return XML_ENTITIES.get(name) or '&%s;' % name
+    return '&%s' % name
+
+
+def _convert_entity(match):
+    """Converts entity in value of attribute like ``BeautifulSoup``."""
+    name = match.group(1)
+    if name in name2codepoint:
+        return unichr(name2codepoint[name])
+    elif name in XML_ENTITIES:
+        return XML_ENTITIES[name]
+    elif name[0] == '#':
+        if len(name) > 1 and name[1] == 'x':
+            return unichr(int(name[2:], 16))
+        return unichr(int(name[1:]))
+    return u'&%s;' % name
+
+
+def convert_attrs(attrs):
+    """Converts entities in values of attributes like ``BeautifulSoup``."""
+    for index, (key, value) in enumerate(attrs):
+        if '&' in value:
+            attrs[index] = (key, ATTR_ENTITY.sub(_convert_entity, value))
+
+
+def _entity(name):
+    """Returns text for entity in data like ``BeautifulSoup``."""
+    if name in name2codepoint:
+        return unichr(name2codepoint[name])
+    elif name in XML_ENTITIES:
+        return XML_ENTITIES[name]
+    return '&amp;%s' % name
+
+
+class DeclarationError(Exception):
+    pass
+
+
+class Declarations(markupbase.ParserBase):
+    """
+    Parses declarations with ``markupbase`` just like ``sgmllib`` does.
+    """
+
+    _decl_otherchars = '='
+
+    def __init__(self, builder, rawdata):
+        self.builder = builder
+        self.rawdata = rawdata
+        self.reset()
+
+    def error(self, message):
+        raise DeclarationError(message)
+
+    def _scan_name(self, i, declstartpos):
+        rawdata = self.rawdata
+        n = len(rawdata)
+        if i == n:
+            return None, -1
+        match = DECLNAME.match(rawdata, i)
+        if match:
+            name = match.group()
+            if i + len(name) == n:
+                return None, -1
+            return name.strip().lower(), match.end()
+        self.error('expected name token')
+
+    def handle_decl(self, data):
+        self.builder.special(data, Declaration)
+
+    def handle_comment(self, data):
+        self.builder.special(data, Comment)
+
+
+class Restart(Exception):
+    """Document must be decoded with charset from meta tag."""
+    def __init__(self, charset):
+        self.charset = charset
+
+
+class Builder(object):
+    """
+    Tokenizes markup and builds tree.
+    """
+
+    def __init__(self, markup, massage, declared, original):
+        self.root = Node(BeautifulSoup.ROOT_TAG_NAME)
+        self.root.hidden = True
+        self.markup = markup
+        self.massage = massage
+        self.declared = declared
+        self.original = original
+        self.stack = [self.root]
+        self.current = self.root
+        self.data = []
+        self.preserve = 0
+        self.metas = 0
+        self.lasttag = '???'
+        self.declarations = None
+
+    def build(self):
+        markup = self.markup
+        if markup and self.massage:
+            for regexp, replacement in self.massage:
+                markup = regexp.sub(replacement, markup)
+        self.feed(markup)
+        self.end_data()
+        return self.root
+
+    def end_data(self, cls=Text):
+        data = self.data
+        if not data:
+            return
+        text = u''.join(data)
+        if not text.strip(ASCII_SPACES) and not self.preserve:
+            if '\n' in text:
+                text = '\n'
+            else:
+                text = ' '
+        del data[:]
+        text = cls(text)
+        text.parent = self.current
+        self.current.contents.append(text)
+
+    def special(self, text, cls):
+        self.end_data()
+        self.data.append(text)
+        self.end_data(cls)
+
+    def start(self, name, attrs):
+        if name == 'meta':
+            self.metas += 1
+            self.start_meta(attrs)
+        else:
+            self.start_tag(name, attrs)
+
+    def start_tag(self, name, attrs, substitution=False):
+        if self.data:
+            self.end_data()
+        self_closing = name in BeautifulSoup.SELF_CLOSING_TAGS
+        if not self_closing:
+            self.smart_pop(name)
+        convert_attrs(attrs)
+        node = Node(name, attrs, self_closing)
+        node.substitution = substitution
+        node.parent = self.current
+        self.current.contents.append(node)
+        if not self_closing:
+            self.stack.append(node)
+            self.current = node
+            if name in PRESERVE_WHITESPACE_TAGS:
+                self.preserve += 1
+        return node
+
+    def start_meta(self, attrs):
+        http_equiv = None
+        content = None
+        content_index = None
+        substitution = False
+        for index, (key, value) in enumerate(attrs):
+            if key == 'http-equiv':
+                http_equiv = value
+            elif key == 'content':
+                content = value
+                content_index = index
+        if http_equiv and content:
+            match = CHARSET_RE.search(content)
+            if match:
+                if self.declared is not None or self.original is None:
+                    attrs[content_index] = (attrs[content_index][0], CHARSET_RE.sub(
+                        lambda match: match.group(1) + '%SOUP-ENCODING%', content))
+                    substitution = True
+                else:
+                    charset = match.group(3)
+                    if charset and charset != self.original:
+                        raise Restart(charset)
+        self.start_tag('meta', attrs, substitution)
+
+    def pop(self):
+        node = self.stack.pop()
+        if node.name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve -= 1
+        self.current = self.stack[-1]
+
+    def pop_to(self, name, inclusive=True):
+        if name == BeautifulSoup.ROOT_TAG_NAME:
+            return
+        stack = self.stack
+        number = 0
+        for index in xrange(len(stack) - 1, 0, -1):
+            if stack[index].name == name:
+                number = len(stack) - index
+                break
+        if not inclusive:
+            number -= 1
+        for index in xrange(number):
+            self.pop()
+
+    def smart_pop(self, name):
+        """Closes opened tags just like ``BeautifulSoup._smartPop``."""
+        triggers = BeautifulSoup.NESTABLE_TAGS.get(name)
+        reset = name in BeautifulSoup.RESET_NESTING_TAGS
+        stack = self.stack
+        for index in xrange(len(stack) - 1, 0, -1):
+            tag = stack[index].name
+            if triggers is None and tag == name:
+                self.pop_to(name)
+                return
+            if (triggers is not None and tag in triggers) or (
+                    triggers is None and reset
+                    and tag in BeautifulSoup.RESET_NESTING_TAGS):
+                self.pop_to(tag, False)
+                return
+
+    def end(self, name):
+        if self.data:
+            self.end_data()
+        self.pop_to(name)
+
+    def end_sgml(self, name):
+        """Processes end tag just like ``sgmllib`` (it remembers opened meta tags)."""
+        if not name:
+            if self.metas:
+                self.metas -= 1
+                name = 'meta'
+        elif name == 'meta' and self.metas:
+            self.metas -= 1
+        self.end(name)
+
+    def feed(self, rawdata):
+        """
+        Tokenizes ``rawdata`` just like ``sgmllib.SGMLParser.goahead``.
+        Returns position of incomplete data at the end of ``rawdata``.
+        """
+        append = self.data.append
+        self.declarations = None
+        i = 0
+        n = len(rawdata)
+        interesting = INTERESTING.search
+        while i < n:
+            match = interesting(rawdata, i)
+            if match:
+                j = match.start()
+            else:
+                j = n
+            if i < j:
+                append(rawdata[i:j])
+            i = j
+            if i == n:
+                break
+            if rawdata[i] == '<':
+                if STARTTAGOPEN.match(rawdata, i):
+                    k = self.parse_starttag(rawdata, i)
+                    if k < 0:
+                        break
+                    i = k
+                    continue
+                if rawdata.startswith('</', i):
+                    match = ENDBRACKET.search(rawdata, i + 1)
+                    if not match:
+                        break
+                    j = match.start()
+                    name = rawdata[i + 2:j].strip().lower()
+                    if rawdata[j] == '>':
+                        j += 1
+                    self.end_sgml(name)
+                    i = j
+                    continue
+                if rawdata.startswith('<!--', i):
+                    match = COMMENTCLOSE.search(rawdata, i + 4)
+                    if not match:
+                        break
+                    self.special(rawdata[i + 4:match.start()], Comment)
+                    i = match.end()
+                    continue
+                if rawdata.startswith('<?', i):
+                    match = PICLOSE.search(rawdata, i + 2)
+                    if not match:
+                        break
+                    text = rawdata[i + 2:match.start()]
+                    if text[:3] == 'xml':
+                        text = u"xml version='1.0' encoding='%SOUP-ENCODING%'"
+                    self.special(text, ProcessingInstruction)
+                    i = match.end()
+                    continue
+                if rawdata.startswith('<!', i):
+                    k = self.parse_declaration(rawdata, i)
+                    if k < 0:
+                        break
+                    i = k
+                    continue
+            else:
+                match = CHARREF.match(rawdata, i)
+                if match:
+                    append(unichr(int(match.group(1))))
+                    i = match.end()
+                    if rawdata[i - 1] != ';':
+                        i -= 1
+                    continue
+                match = ENTITYREF.match(rawdata, i)
+                if match:
+                    append(_entity(match.group(1)))
+                    i = match.end()
+                    if rawdata[i - 1] != ';':
+                        i -= 1
+                    continue
+            match = INCOMPLETE.match(rawdata, i)
+            if not match:
+                append(rawdata[i])
+                i += 1
+                continue
+            j = match.end()
+            if j == n:
+                break
+            append(rawdata[i:j])
+            i = j
+        return i
+
+    def parse_starttag(self, rawdata, i):
+        if SHORTTAGOPEN.match(rawdata, i):
+            match = SHORTTAG.match(rawdata, i)
+            if not match:
+                return -1
+            name, text = match.group(1, 2)
+            name = name.lower()
+            self.start(name, [])
+            self.data.append(text)
+            self.end_sgml(name)
+            return match.end()
+        match = ENDBRACKET.search(rawdata, i + 1)
+        if not match:
+            return -1
+        j = match.start()
+        attrs = []
+        if rawdata[i + 1] == '>':
+            k = j
+            name = self.lasttag
+        else:
+            k = TAGFIND.match(rawdata, i + 1).end()
+            name = rawdata[i + 1:k].lower()
+            self.lasttag = name
+        while k < j:
+            match = ATTRFIND.match(rawdata, k)
+            if not match:
+                break
+            key, rest, value = match.group(1, 2, 3)
+            if not rest:
+                value = key
+            else:
+                if (value[:1] == "'" == value[-1:] or value[:1] == '"' == value[-1:]):
+                    value = value[1:-1]
+                if '&' in value:
+                    value = ENTITY_OR_CHARREF.sub(_convert_ref, value)
+            attrs.append((key.lower(), value))
+            k = match.end()
+        if rawdata[j] == '>':
+            j += 1
+        self.start(name, attrs)
+        return j
+
+    def parse_declaration(self, rawdata, i):
+        if rawdata[i:i + 9] == '<![CDATA[':
+            k = rawdata.find(']]>', i)
+            if k == -1:
+                k = len(rawdata)
+            self.special(rawdata[i + 9:k], CData)
+            return k + 3
+        if self.declarations is None:
+            self.declarations = Declarations(self, rawdata)
+        try:
+            return self.declarations.parse_declaration(i)
+        except DeclarationError:
+            return self.declaration_error(rawdata, i)
+
+    def declaration_error(self, rawdata, i):
+        """Treats the rest of ``rawdata`` as text just like ``BeautifulSoup``."""
+        self.data.append(rawdata[i:])
+        return len(rawdata)
+
+
+def massage_markup(markup, massage):
+    """
+    Applies ``massage`` to ``markup`` like ``Builder.build``.
+    Returns massaged markup and list of replaced parts for each expression:
+    [(start, stop, length of replacement)].
+    """
+    steps = []
+    for regexp, replacement in massage:
+        parts = []
+
+        def substitute(match):
+            if callable(replacement):
+                text = replacement(match)
+            else:
+                text = match.expand(replacement)
+            parts.append((match.start(), match.end(), len(text)))
+            return text
+        markup = regexp.sub(substitute, markup)
+        steps.append(parts)
+    return markup, steps
+
+
+def source_offsets(offsets, steps):
+    """
+    Returns offsets in source markup for sorted ``offsets`` in massaged one.
+    ``steps`` are returned by ``massage_markup``.
+    Offsets inside replacements are skipped.
+    """
+    for parts in reversed(steps):
+        result = []
+        shift = 0
+        index = 0
+        for offset in offsets:
+            while index < len(parts):
+                start, stop, length = parts[index]
+                if start + shift + length > offset:
+                    break
+                shift += length - (stop - start)
+                index += 1
+            if index < len(parts) and parts[index][0] + shift < offset:
+                continue
+            result.append(offset - shift)
+        offsets = result
+    return offsets
+
+
+class Splitter(Builder):
+    """
+    Tokenizes markup like ``Builder`` and finds offsets in it,
+    where markup can be split into parts that are parsed
+    to the same trees as the whole markup.
+    They are offsets of top-level start tags with ``names``
+    met when nothing is opened and only whitespace is collected
+    after the closing bracket of the previous tag.
+    Offsets are not searched inside values of attributes
+    (they can contain brackets) and after value with unmatched quote
+    (its end depends on the rest of markup).
+
+    Tree is not built, only names of opened tags are kept.
+    """
+
+    def __init__(self, markup, massage, names):
+        Builder.__init__(self, markup, massage, None, None)
+        self.names = names
+        self.offsets = []
+        self.nodes = {}
+        self.reach = 0
+
+    def split(self):
+        """
+        Returns offsets in source markup and whether markup
+        is tokenized completely and can be split at the end.
+        """
+        markup, steps = massage_markup(self.markup, self.massage or [])
+        end = self.feed(markup)
+        return source_offsets(self.offsets, steps), (
+            end == len(markup) and self.reach <= len(markup) and self.closed())
+
+    def closed(self):
+        """Returns whether nothing is opened and only whitespace is collected."""
+        return (len(self.stack) == 1 and not self.metas
+            and not u''.join(self.data).strip(ASCII_SPACES))
+
+    def end_data(self, cls=Text):
+        del self.data[:]
+
+    def start_tag(self, name, attrs, substitution=False):
+        if self.data:
+            self.end_data()
+        if name in BeautifulSoup.SELF_CLOSING_TAGS:
+            return
+        self.smart_pop(name)
+        node = self.nodes.get(name)
+        if node is None:
+            node = self.nodes[name] = Node(name)
+        self.stack.append(node)
+        self.current = node
+        if name in PRESERVE_WHITESPACE_TAGS:
+            self.preserve += 1
+
+    def separated(self, rawdata, i):
+        """
+        Returns whether markup can be split at ``i``:
+        it is not inside value of attribute and only whitespace
+        is between it and the closing bracket of the previous tag.
+        """
+        if i < self.reach:
+            return False
+        while i and rawdata[i - 1] in ASCII_SPACES:
+            i -= 1
+        return not i or rawdata[i - 1] == '>'
+
+    def parse_starttag(self, rawdata, i):
+        if SHORTTAGOPEN.match(rawdata, i):
+            return Builder.parse_starttag(self, rawdata, i)
+        match = ENDBRACKET.search(rawdata, i + 1)
+        if not match:
+            return -1
+        j = match.start()
+        if rawdata[i + 1] == '>':
+            k = j
+            name = self.lasttag
+        else:
+            k = TAGFIND.match(rawdata, i + 1).end()
+            name = rawdata[i + 1:k].lower()
+            self.lasttag = name
+            if name in self.names and self.closed() and self.separated(rawdata, i):
+                self.offsets.append(i)
+        # Attributes are matched like ``Builder.parse_starttag`` does
+        # to find their ends, their values are not converted.
+        while k < j:
+            match = ATTRFIND.match(rawdata, k)
+            if not match:
+                break
+            value = match.group(3)
+            if value and value[0] in '\'"' and (len(value) == 1 or value[-1] != value[0]):
+                self.reach = len(rawdata) + 1
+            k = match.end()
+            if k > self.reach:
+                self.reach = k
+        if rawdata[j] == '>':
+            j += 1
+        self.start(name, [])
+        return j
+
+
+class FastParser(Parser):
+    """
+    Backend with tokenizer that builds lightweight tree.
+    """
+
+    Tag = Node
+    Text = Text
+
+    def parse(self, value, massage):
+        if isinstance(value, unicode):
+            return Builder(value, massage, None, None).build()
+        return self.decode(value, massage, None)
+
+    def decode(self, value, massage, charset):
+        """Decodes ``value`` like BeautifulSoup and parses it."""
+        dammit = UnicodeDammit(value, [None, charset], smartQuotesTo=None, isHTML=True)
+        try:
+            return Builder(
+                dammit.unicode, massage, dammit.declaredHTMLEncoding,
+                dammit.originalEncoding).build()
+        except Restart, restart:
+            # BeautifulSoup does not massage markup the second time.
+            return self.decode(value, None, restart.charset)
+
+    def new_tag(self, name):
+        return Node(name, [], self.is_self_closing(name))
+
+    # Contents are plain lists, so children are moved by slices.
+
+    def remove(self, parent, index):
+        child = parent.contents.pop(index)
+        child.parent = None
+        return child
+
+    def replace(self, parent, index, value):
+        value = Text(value)
+        value.parent = parent
+        parent.contents[index].parent = None
+        parent.contents[index] = value
+
+    def unwrap(self, parent, index):
+        element = parent.contents[index]
+        for child in element.contents:
+            child.parent = parent
+        parent.contents[index:index + 1] = element.contents
+        element.contents = []
+        element.parent = None
+
+    def enclose(self, parent, start, stop, name):
+        tag = self.new_tag(name)
+        tag.contents = parent.contents[start:stop]
+        for child in tag.contents:
+            child.parent = tag
+        tag.parent = parent
+        parent.contents[start:stop] = [tag]
@@ -0,0 +1,178 @@
+"""
+Presets saved to file with compiled regular expressions
+(see ``trusted_compile_rules`` command and TRUSTEDHTML_COMPILED_RULES setting).
+
+Each process builds rule tables of presets and compiles their expressions.
+Saved presets are unpickled instead, expressions are restored from
+code of ``_sre`` without parsing and compilation.
+
+File starts with header: (FORMAT, fingerprint). Fingerprint is digest of
+sources of rules, settings and versions of this application and Python,
+so file saved for other sources or settings is ignored
+and presets are built as usual.
+"""
+
+import os
+import sys
+import cPickle
+import tempfile
+import _sre
+import sre_compile
+import sre_parse
+
+import trustedhtml
+from trustedhtml import settings
+from trustedhtml.cache import PATTERN_TYPE, describe, options, sha1
+from trustedhtml.classes import Html, precompile
+
+FORMAT = 1
+
+PRESETS = ['full', 'normal', 'pretty']
+
+# Sources of rules, relative to directory of this application.
+SOURCES = ['classes.py', 'utils.py', 'cache.py', 'parser.py', 'rules']
+
+_loaded = {}
+
+
+def sources():
+    """
+    Returns sorted list of paths to source files of rules.
+    """
+    root = os.path.dirname(os.path.abspath(trustedhtml.__file__))
+    result = []
+    for name in SOURCES:
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            for directory, names, files in os.walk(path):
+                result.extend([os.path.join(directory, item)
+                    for item in files if item.endswith('.py')])
+        elif os.path.exists(path):
+            result.append(path)
+    return sorted(result)
+
+
+def fingerprint():
+    """
+    Returns digest of sources of rules, settings
+    and versions of this application and Python.
+    """
+    root = os.path.dirname(os.path.abspath(trustedhtml.__file__))
+    digest = sha1()
+    for path in sources():
+        source = open(path, 'rb')
+        try:
+            digest.update(path[len(root):] + '\n' + source.read())
+        finally:
+            source.close()
+    digest.update('\n'.join([
+        str(FORMAT), trustedhtml.__version__, sys.version, str(_sre.MAGIC),
+        describe(options(), {}),
+    ]))
+    return digest.hexdigest()
+
+
+def pattern_id(value):
+    """
+    Returns persistent id for compiled regular expression:
+    (pattern, flags, code, groups, groupindex).
+    """
+    parsed = sre_parse.parse(value.pattern, value.flags)
+    code = sre_compile._code(parsed, value.flags)
+    return (value.pattern, value.flags, code, value.groups, value.groupindex)
+
+
+def load_pattern(pid):
+    """
+    Returns compiled regular expression for persistent id
+    (see ``sre_compile.compile``).
+    """
+    pattern, flags, code, groups, groupindex = pid
+    indexgroup = [None] * (groups + 1)
+    for name, index in groupindex.items():
+        indexgroup[index] = name
+    return _sre.compile(pattern, flags, code, groups, groupindex, indexgroup)
+
+
+def dump(presets, path):
+    """
+    Saves ``presets`` (dictionary with rules) to file ``path``.
+    Regular expressions are compiled before saving.
+    """
+    for rule in presets.itervalues():
+        precompile(rule)
+        if isinstance(rule, Html):
+            rule.fingerprint()
+    pids = {}
+
+    def persistent_id(value):
+        if not isinstance(value, PATTERN_TYPE):
+            return None
+        if id(value) not in pids:
+            pids[id(value)] = pattern_id(value)
+        return pids[id(value)]
+
+    # File is replaced at once, so other processes never read it partially.
+    descriptor, temporary = tempfile.mkstemp(
+        prefix='.trustedhtml', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        output = os.fdopen(descriptor, 'wb')
+        try:
+            pickler = cPickle.Pickler(output, cPickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump((FORMAT, fingerprint()))
+            pickler.dump(presets)
+        finally:
+            output.close()
+        os.chmod(temporary, 0644)
+        os.rename(temporary, path)
+    except:
+        os.remove(temporary)
+        raise
+
+
+def load(path):
+    """
+    Returns dictionary with presets saved to file ``path``.
+    Returns None if there is no such file, it was saved
+    for other sources or settings or it is damaged.
+    """
+    try:
+        source = open(path, 'rb')
+    except IOError:
+        return None
+    patterns = {}
+
+    def persistent_load(pid):
+        key = pid[:2]
+        if key not in patterns:
+            patterns[key] = load_pattern(pid)
+        return patterns[key]
+
+    try:
+        unpickler = cPickle.Unpickler(source)
+        unpickler.persistent_load = persistent_load
+        try:
+            header = unpickler.load()
+            if header != (FORMAT, fingerprint()):
+                return None
+            return unpickler.load()
+        except Exception:
+            # Truncated or damaged file, presets will be built from sources.
+            return None
+    finally:
+        source.close()
+
+
+def get_presets():
+    """
+    Returns dictionary with presets loaded from TRUSTEDHTML_COMPILED_RULES
+    or None if setting is not specified or file can`t be used.
+    File is loaded once.
+    """
+    path = settings.TRUSTEDHTML_COMPILED_RULES
+    if not path:
+        return None
+    if path not in _loaded:
+        _loaded[path] = load(path)
+    return _loaded[path]
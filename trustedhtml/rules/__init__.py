@@ -1 +1,70 @@
-from trustedhtml.rules.html import full, normal, pretty
+"""
+Presets are built on first use: rule tables of ``trustedhtml.rules.html``
+and ``trustedhtml.rules.css`` are large, so importing them at Django start up
+(from fields, widgets and models) slows down every management command.
+Import ``trustedhtml.rules.html`` to build presets immediately.
+Submodules ``html`` and ``css`` are available as attributes of this package,
+they are imported on first access to their attributes.
+
+If TRUSTEDHTML_COMPILED_RULES file was saved by ``trusted_compile_rules``
+command for current sources and settings, presets are loaded from it
+(see ``trustedhtml.precompiled``) while ``trustedhtml.rules.html``
+is not imported. Import of ``trustedhtml.rules.html`` makes presets
+of this package to be its presets, so that their changes are not ignored.
+"""
+
+import sys
+
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.importlib import import_module
+
+
+def submodule(name):
+    """
+    Returns object that imports submodule ``name`` on first access
+    to its attributes and acts like it.
+    Import of submodule replaces this object by the module itself.
+    """
+    return SimpleLazyObject(lambda: import_module('%s.%s' % (__name__, name)))
+
+html = submodule('html')
+css = submodule('css')
+
+
+def preset(name):
+    """
+    Returns object that loads preset ``name`` on first access
+    to its attributes and acts like it.
+    """
+    def load():
+        if '%s.html' % __name__ not in sys.modules:
+            from trustedhtml.precompiled import get_presets
+            presets = get_presets()
+            if presets is not None:
+                return presets[name]
+        from trustedhtml.rules import html
+        return getattr(html, name)
+    return SimpleLazyObject(load)
+
+full = preset('full')
+normal = preset('normal')
+pretty = preset('pretty')
+
+
+def load_presets():
+    """
+    Loads (or builds) all presets now.
+    Call it before worker processes are forked,
+    so that workers will not load presets again.
+    """
+    for rule in [full, normal, pretty]:
+        getattr(rule, 'rules')
+
+
+def reset_presets():
+    """
+    Makes presets to be loaded again on next access to their attributes.
+    Called on import of ``trustedhtml.rules.html``.
+    """
+    for rule in [full, normal, pretty]:
+        rule._wrapped = empty
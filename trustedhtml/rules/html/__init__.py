@@ -6,3 +6,8 @@ from trustedhtml.classes import Html
 full = Html(rules=elements.elements, root_tags=contents.contents['body'])
 pretty = Html(rules=custom.pretty, root_tags=contents.contents['body'])
 normal = Html(rules=custom.normal, root_tags=contents.contents['body'])
+
+# Presets of ``trustedhtml.rules`` could be loaded from TRUSTEDHTML_COMPILED_RULES,
+# since now they are presets of this module.
+from trustedhtml.rules import reset_presets
+reset_presets()
@@ -27,3 +27,26 @@ TRUSTEDHTML_LOCAL_SCHEMES = getattr(settings, 'TRUSTEDHTML_LOCAL_SCHEMES', [
 TRUSTEDHTML_MODELS = getattr(settings, 'TRUSTEDHTML_MODELS', [])
 
 TRUSTEDHTML_USE_MODELURL = getattr(settings, 'TRUSTEDHTML_USE_MODELURL', 'modelurl' in settings.INSTALLED_APPS)
+
+TRUSTEDHTML_CACHE = getattr(settings, 'TRUSTEDHTML_CACHE', None)
+TRUSTEDHTML_CACHE_SIZE = getattr(settings, 'TRUSTEDHTML_CACHE_SIZE', 1000)
+TRUSTEDHTML_CACHE_TIMEOUT = getattr(settings, 'TRUSTEDHTML_CACHE_TIMEOUT', None)
+
+TRUSTEDHTML_MEMO_SIZE = getattr(settings, 'TRUSTEDHTML_MEMO_SIZE', 0)
+
+TRUSTEDHTML_COMPLEX_MAX_WORK = getattr(settings, 'TRUSTEDHTML_COMPLEX_MAX_WORK', 1000)
+
+TRUSTEDHTML_COMPILED_RULES = getattr(settings, 'TRUSTEDHTML_COMPILED_RULES', None)
+# Change it after changes of presets in your project, so that
+# TRUSTEDHTML_COMPILED_RULES file and cached results will be ignored.
+TRUSTEDHTML_RULES_VERSION = getattr(settings, 'TRUSTEDHTML_RULES_VERSION', None)
+
+TRUSTEDHTML_VERIFY_THREADS = getattr(settings, 'TRUSTEDHTML_VERIFY_THREADS', 8)
+TRUSTEDHTML_VERIFY_TIMEOUT = getattr(settings, 'TRUSTEDHTML_VERIFY_TIMEOUT', 10)
+TRUSTEDHTML_VERIFY_CACHE = getattr(settings, 'TRUSTEDHTML_VERIFY_CACHE', 'default')
+TRUSTEDHTML_VERIFY_CACHE_TIMEOUT = getattr(settings, 'TRUSTEDHTML_VERIFY_CACHE_TIMEOUT', 24 * 60 * 60)
+TRUSTEDHTML_VERIFY_NEGATIVE_TIMEOUT = getattr(settings, 'TRUSTEDHTML_VERIFY_NEGATIVE_TIMEOUT', 60 * 60)
+TRUSTEDHTML_VERIFY_DEFERRED = getattr(settings, 'TRUSTEDHTML_VERIFY_DEFERRED', False)
+
+TRUSTEDHTML_PARALLEL_SIZE = getattr(settings, 'TRUSTEDHTML_PARALLEL_SIZE', 0)
+TRUSTEDHTML_PARALLEL_PROCESSES = getattr(settings, 'TRUSTEDHTML_PARALLEL_PROCESSES', None)
@@ -15,10 +15,76 @@ but only result of last signal will be used as result of validation.
     ``value`` - instance of the value
     ``source`` - instance of value`s source variant
     ``exception`` - raised exception
+
+Rules send signals only if there are receivers for their class
+(or for any sender), so validation has no overhead when nobody is listening.
 """
 
 from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
+
+
+class RuleSignal(Signal):
+    """
+    Signal that remembers whether there are receivers for each sender.
+
+    ``generation`` is increased each time receivers are changed.
+    """
+
+    def __init__(self, providing_args=None):
+        super(RuleSignal, self).__init__(providing_args)
+        self.listened = {}
+        self.generation = 0
+
+    def connect(self, *args, **kwargs):
+        super(RuleSignal, self).connect(*args, **kwargs)
+        self.changed()
+
+    def disconnect(self, *args, **kwargs):
+        super(RuleSignal, self).disconnect(*args, **kwargs)
+        self.changed()
+
+    def _remove_receiver(self, receiver):
+        super(RuleSignal, self)._remove_receiver(receiver)
+        self.changed()
+
+    def changed(self):
+        """Forgets remembered answers after receivers was changed."""
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            self.listened = {}
+        finally:
+            self.lock.release()
+
+    def has_listeners(self, sender):
+        """
+        Returns whether there are receivers for ``sender``.
+        Answer is remembered only if receivers was not changed
+        by other thread while it was calculated.
+        """
+        try:
+            return self.listened[sender]
+        except KeyError:
+            generation = self.generation
+            result = self.listens(sender, self.receivers[:])
+            self.lock.acquire()
+            try:
+                if self.generation == generation:
+                    self.listened[sender] = result
+            finally:
+                self.lock.release()
+            return result
+
+    def listens(self, sender, receivers):
+        """Returns whether any of ``receivers`` listens ``sender``."""
+        keys = (_make_id(sender), _make_id(None))
+        for (receiver_key, sender_key), receiver in receivers:
+            if sender_key in keys:
+                return True
+        return False
+
 
-rule_done = Signal(providing_args=['rule', 'parent', 'value', 'source', ])
+rule_done = RuleSignal(providing_args=['rule', 'parent', 'value', 'source', ])
 
-rule_exception = Signal(providing_args=['rule', 'parent', 'value', 'source', 'state', 'exception', ])
+rule_exception = RuleSignal(providing_args=['rule', 'parent', 'value', 'source', 'state', 'exception', ])
@@ -0,0 +1,319 @@
+"""
+Streaming validation of large documents.
+
+``Html.validate`` keeps the whole value in memory several times:
+source, massaged source, tree and result.
+``Sanitizer`` reads value chunk by chunk, tokenizes it with ``FastParser``
+rules, validates elements by rules of ``Html`` and writes result
+to file-like object as soon as possible.
+Only the stack of opened elements (and unterminated comment or tag
+at the end of the last chunk) is kept in memory.
+
+Elements are removed, collapsed and wrapped just like by ``Html.fix``.
+But value is processed once, so for broken markup result can differ
+from the result of ``Html.validate`` (it would be parsed and fixed again).
+"""
+
+import re
+
+from trustedhtml.classes import TrustedException, IncorrectException
+from trustedhtml.parser import BeautifulSoup, Builder, Node, Text, convert_attrs
+
+# Incomplete numeric reference that can be continued in the next chunk.
+INCOMPLETE_CODE_RE = re.compile('&(#(x[0-9A-Fa-f]*|[0-9]*))?$')
+TRAILING_SPACES_RE = re.compile(u'[ \xa0]*$')
+
+SKIP = 'skip'
+TRANSPARENT = 'transparent'
+
+
+class Opened(object):
+    """
+    Element that is opened in the result.
+    Its start tag is written when it gets some content.
+    """
+
+    __slots__ = ('node', 'rule', 'written', 'space', 'keep', 'wrapper')
+
+    def __init__(self, node, rule, wrapper=False):
+        self.node = node
+        self.rule = rule
+        # Whether start tag was written.
+        self.written = False
+        # Spaces that are not written yet: '', ' ' or NBSP_CHAR.
+        self.space = u''
+        # Whether spaces belong to the text (not separate text between elements).
+        self.keep = False
+        self.wrapper = wrapper
+
+
+class Sanitizer(Builder):
+    """
+    Validates value by ``Html`` rule and writes result to ``output``.
+    """
+
+    def __init__(self, rule, output, buffer_size=65536):
+        """
+        ``rule`` is ``Html`` rule.
+
+        ``output`` is file-like object, unicode will be written to it.
+
+        ``buffer_size`` is number of chars collected before writing.
+        """
+        Builder.__init__(self, u'', rule.MARKUP_MASSAGE, None, None)
+        self.rule = rule
+        self.path = [rule]
+        self.output = output
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        self.root_opened = Opened(self.root, None)
+        self.root_opened.written = True
+        self.opened = [self.root_opened]
+        self.states = [self.root_opened]
+        # Whether the last chunk is processed.
+        self.final = False
+        # Whether the rest of value is text (after incorrect declaration).
+        self.verbatim = False
+
+    def run(self, source, chunk_size=65536, encoding='utf-8'):
+        """
+        Validates ``source`` and writes result.
+
+        ``source`` is file-like object or string.
+
+        ``encoding`` is used to decode strings read from ``source``.
+        """
+        if isinstance(source, basestring):
+            chunks = (source[index:index + chunk_size]
+                for index in xrange(0, len(source), chunk_size))
+        else:
+            chunks = iter(lambda: source.read(chunk_size), '')
+        raw = u''
+        pending = u''
+        decoder = None
+        started = False
+        for chunk in chunks:
+            if not isinstance(chunk, unicode):
+                if decoder is None:
+                    import codecs
+                    decoder = codecs.getincrementaldecoder(encoding)('replace')
+                chunk = decoder.decode(chunk)
+            raw += chunk
+            if not started:
+                # Value is stripped just like by ``String``.
+                raw = raw.lstrip()
+                started = bool(raw)
+            cut = self.split(raw)
+            pending = self.feed_prepared(pending, raw[:cut])
+            raw = raw[cut:]
+        if decoder is not None:
+            raw += decoder.decode('', True)
+        # Incomplete data at the end is dropped just like by BeautifulSoup.
+        self.final = True
+        self.feed_prepared(pending, raw.strip())
+        self.end_data()
+        while len(self.stack) > 1:
+            self.pop()
+        self.close_wrapper()
+        self.flush_buffer()
+
+    def split(self, raw):
+        """
+        Returns position in ``raw`` before which it can be prepared and massaged
+        (there are no incomplete tags or numeric references).
+        Trailing spaces are kept too, they will be removed at the end of value.
+        """
+        cut = len(raw.rstrip())
+        index = raw.rfind('<', 0, cut)
+        if index >= 0 and raw.find('>', index) < 0:
+            cut = index
+        # Massage of BeautifulSoup looks at few chars after "<".
+        index = raw.rfind('<', max(cut - 3, 0), cut)
+        while index >= 0:
+            cut = index
+            index = raw.rfind('<', max(cut - 3, 0), cut)
+        index = raw.rfind('&', 0, cut)
+        if index >= 0 and INCOMPLETE_CODE_RE.match(raw, index, cut):
+            cut = index
+        return cut
+
+    def feed_prepared(self, pending, raw):
+        """
+        Prepares and massages ``raw`` and tokenizes it after ``pending``.
+        Returns incomplete data that must be tokenized with the next chunk.
+        """
+        if raw:
+            raw = self.rule.prepare(raw)
+            for regexp, replacement in self.massage:
+                raw = regexp.sub(replacement, raw)
+        rawdata = pending + raw
+        if self.verbatim:
+            self.data.append(rawdata)
+            index = len(rawdata)
+        else:
+            index = self.feed(rawdata)
+        # Long text must not be collected in memory.
+        self.end_data()
+        return rawdata[index:]
+
+    def parse_declaration(self, rawdata, i):
+        if not self.final and rawdata.startswith('<![CDATA[', i) and rawdata.find(']]>', i) < 0:
+            return -1
+        return Builder.parse_declaration(self, rawdata, i)
+
+    def declaration_error(self, rawdata, i):
+        self.verbatim = True
+        return Builder.declaration_error(self, rawdata, i)
+
+    def end_data(self, cls=Text):
+        data = self.data
+        if not data:
+            return
+        text = u''.join(data)
+        del data[:]
+        if cls is Text and self.states[-1] is not SKIP:
+            self.put(self.rule.escape(text))
+
+    def start_tag(self, name, attrs, substitution=False):
+        if self.data:
+            self.end_data()
+        self_closing = name in BeautifulSoup.SELF_CLOSING_TAGS
+        if not self_closing:
+            self.smart_pop(name)
+        convert_attrs(attrs)
+        node = Node(name, attrs, self_closing)
+        node.substitution = substitution
+        state = self.element(node)
+        if self_closing:
+            if isinstance(state, Opened):
+                self.write_element()
+                self.opened.pop()
+            return node
+        self.stack.append(node)
+        self.states.append(state)
+        return node
+
+    def element(self, node):
+        """
+        Validates attributes of ``node``.
+        Returns state for its contents.
+        """
+        if self.states[-1] is SKIP:
+            return SKIP
+        rule = self.rule.rules.get(node.name, None)
+        try:
+            if rule is None or rule.remove_element:
+                raise IncorrectException(self.rule, node.attrs)
+            node.attrs = rule.validate(node.attrs, self.path)
+        except TrustedException:
+            if rule is None or getattr(rule, 'save_content', True):
+                return TRANSPARENT
+            return SKIP
+        if self.opened[-1] is self.root_opened or self.opened[-1].wrapper:
+            if node.name in self.rule.root_tags:
+                self.close_wrapper()
+            else:
+                self.open_wrapper()
+        opened = Opened(node, rule)
+        self.opened.append(opened)
+        return opened
+
+    def pop(self):
+        self.stack.pop()
+        state = self.states.pop()
+        if isinstance(state, Opened):
+            self.close(state)
+
+    def put(self, text):
+        """Puts ``text`` to the last opened element."""
+        opened = self.opened[-1]
+        if opened is self.root_opened:
+            text = self.rule.correct(opened.space + text)
+            opened.space = u''
+            if not text.strip(u' ' + self.rule.NBSP_CHAR):
+                # Spaces between elements in the root will be removed.
+                opened.space = text
+                return
+            self.open_wrapper()
+            opened = self.opened[-1]
+        text = self.rule.correct(opened.space + text)
+        space = TRAILING_SPACES_RE.search(text).group()
+        text = text[:len(text) - len(space)]
+        if not text:
+            opened.space = space
+            return
+        if not opened.written:
+            self.write_element()
+        self.write(text)
+        opened.space = space
+        opened.keep = True
+
+    def write_element(self):
+        """Writes start tags of the last opened element and its parents."""
+        first = len(self.opened) - 1
+        while not self.opened[first - 1].written:
+            first -= 1
+        for index in xrange(first, len(self.opened)):
+            self.write_space(self.opened[index - 1])
+            self.opened[index].written = True
+            self.write(self.opened[index].node.start())
+
+    def write_space(self, opened):
+        """Writes spaces of ``opened`` element before element or end tag."""
+        if opened.space and (opened.keep or not opened.wrapper):
+            self.write(opened.space)
+        opened.space = u''
+        opened.keep = False
+
+    def close(self, opened):
+        """Writes end of element or replaces empty element like ``Html.collapse``."""
+        rule = opened.rule
+        text = opened.space
+        if not opened.written:
+            if rule.default and text != rule.default:
+                opened.space = u''
+                self.write_element()
+                self.write(rule.default)
+            elif rule.empty_element:
+                self.write_element()
+            else:
+                self.opened.pop()
+                if text:
+                    self.put(text)
+                return
+        self.write_space(opened)
+        self.write(u'</%s>' % opened.node.name)
+        self.opened.pop()
+
+    def open_wrapper(self):
+        """Opens DEFAULT_ROOT_TAG for elements that can`t be in the root."""
+        if self.opened[-1].wrapper:
+            return
+        opened = Opened(Node(self.rule.DEFAULT_ROOT_TAG), None, True)
+        # Spaces will be removed if they are followed by element.
+        opened.space = self.root_opened.space
+        self.root_opened.space = u''
+        self.opened.append(opened)
+
+    def close_wrapper(self):
+        opened = self.opened[-1]
+        if not opened.wrapper:
+            self.root_opened.space = u''
+            return
+        self.opened.pop()
+        if opened.written:
+            self.write_space(opened)
+            self.write(u'</%s>' % opened.node.name)
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if self.buffer:
+            self.output.write(u''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
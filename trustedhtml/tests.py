@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import BaseHTTPServer
+import os
+import re
+import SocketServer
+import tempfile
+import threading
 import unittest
+from copy import copy
+from StringIO import StringIO
+from random import Random
 from trustedhtml.classes import *
+from trustedhtml.cache import LruCache, DjangoCache, Memo
 from trustedhtml import rules
 from trustedhtml import signals
+from trustedhtml import parallel
+from trustedhtml import verification
+from trustedhtml import precompiled
 
 class TestClasses(unittest.TestCase):
     def setUp(self):
@@ -40,6 +53,81 @@ class TestClasses(unittest.TestCase):
         self.assertRaises(IncorrectException, rule.validate, '@@@-')
         self.assertEqual(rule.validate('  @@@-12@ '), '-12')
 
+    def test_list_merge(self):
+        first = List(values=['a', 'aB', 'A'])
+        self.assertEqual(first.validate('A'), 'a')
+        rule = Or(rules=[
+            first, List(values=['Ab', 'c']),
+            RegExp(regexp=r'(\d+)$'), List(values=['1', 'd']), List(values=['e']),
+        ])
+        self.assertEqual([item.__class__ for item in rule.get_rules()], [List, RegExp, List])
+        self.assertEqual(rule.validate(' AB '), 'aB')
+        self.assertEqual(rule.validate('C'), 'c')
+        self.assertEqual(rule.validate('1'), '1')
+        self.assertEqual(rule.validate('E'), 'e')
+        self.assertRaises(IncorrectException, rule.validate, 'f')
+        self.assertRaises(EmptyException, rule.validate, '')
+        rule = Or(rules=[List(values=['a']), List(values=['b'], default='b')])
+        self.assertTrue(rule.get_rules() is rule.rules)
+
+    def test_regexp_fusion(self):
+        rule = Or(rules=[
+            RegExp(regexp=r'(?P<n>rgb)\((\d+)\)$', expand=r'\g<n>:\2'),
+            Or(rules=[
+                RegExp(regexp=r'(\d+)(?P<n>px)$', expand=r'\g<n>\1\g<0>'),
+                RegExp(regexp=r'x(\d*)$', expand=r'\1'),
+                RegExp(regexp=r'(?P<n>[yz])(?P=n)$'),
+            ]),
+            RegExp(regexp=r'(x)(\d*)$', expand=r'\2\1'),
+            List(values=['auto']),
+            RegExp(regexp=r'(\w)\1$'),
+        ])
+        self.assertEqual([item.__class__ for item in rule.get_rules()], [Fused, List, RegExp])
+        self.assertEqual(rule.validate('RGB(12)'), 'RGB:12')
+        self.assertEqual(rule.validate('12px'), 'px1212px')
+        self.assertEqual(rule.validate('x3'), '3')
+        # Empty expansion is incorrect, so the next alternative is used.
+        self.assertEqual(rule.validate('x'), 'x')
+        self.assertEqual(rule.validate('zz'), 'z')
+        self.assertRaises(IncorrectException, rule.validate, 'yz')
+        self.assertEqual(rule.validate('Auto'), 'auto')
+        self.assertEqual(rule.validate('aa'), 'a')
+        self.assertRaises(IncorrectException, rule.validate, 'ab')
+        self.assertEqual(rule.get_rules(), rule._merged)
+        def receiver(sender, rule, value, source, **kwargs):
+            return value
+        signals.rule_done.connect(receiver, sender=RegExp)
+        try:
+            self.assertEqual(rule.get_rules(), rule.rules)
+            self.assertEqual(rule.validate('12px'), 'px1212px')
+        finally:
+            signals.rule_done.disconnect(receiver, sender=RegExp)
+        rule = Or(rules=[
+            RegExp(regexp=r'a$'), RegExp(regexp=r'b$', default='b'),
+        ])
+        self.assertTrue(rule.get_rules() is rule.rules)
+        # Conditional references to groups are not renumbered
+        rule = Or(rules=[
+            RegExp(regexp=r'(\d)x$'),
+            RegExp(regexp=r'(<)?(\w+)(?(1)>)$', expand=r'\2'),
+            RegExp(regexp=r'(?P<q>")?(\w+)(?(q)")$', expand=r'\2'),
+        ])
+        self.assertTrue(rule.get_rules() is rule.rules)
+        self.assertEqual(rule.validate('<b>'), 'b')
+        self.assertEqual(rule.validate('"c"'), 'c')
+        self.assertRaises(IncorrectException, rule.validate, '<d')
+
+    def test_regexp_compiled(self):
+        rule = RegExp(regexp=r'(\d+)$')
+        self.assertEqual(rule.validate('12'), '12')
+        rule.compiled = re.compile(r'([a-z]+)$')
+        self.assertEqual(rule.regexp, r'([a-z]+)$')
+        self.assertEqual(rule.validate('abc'), 'abc')
+        self.assertRaises(IncorrectException, rule.validate, '12')
+        rule = Sequence(rule=String(), regexp=r'\s+')
+        rule.compiled = re.compile(',')
+        self.assertEqual(rule.validate('a,b'), 'a b')
+
     def test_regexp_expand(self):
         rule = RegExp(regexp=r'([-+]?\d*),(?P<a>\d*)$', expand=r'\g<a>;\1')
         self.assertEqual(rule.validate('-12,34'), '34;-12')
@@ -77,6 +165,85 @@ class TestClasses(unittest.TestCase):
         self.assertRaises(IncorrectException, rule.validate, 'ef')
         self.assertEqual(rule.validate('  !!cD '), 'Cd')
 
+    def test_attempt(self):
+        created = []
+        class Counter(List):
+            def core(self, value, path):
+                value = super(Counter, self).core(value, path)
+                return value + '!'
+        rule = Or(rules=[
+            List(values=['a', 'b']),
+            Complex(rules=[RegExp(regexp=r'(\d+)$'), List(values=['px', 'em'])]),
+            And(rules=[RegExp(regexp=r'(\w+)$'), Counter(values=['c'])]),
+        ])
+        init = TrustedException.__init__
+        def counter(self, *args):
+            created.append(args)
+            init(self, *args)
+        TrustedException.__init__ = counter
+        try:
+            self.assertEqual(rule.attempt('B', []), 'b')
+            self.assertEqual(rule.attempt('1 PX', []), '1 px')
+            self.assertEqual(rule.attempt('c', []), 'c!')
+            self.assertEqual(rule.attempt('1 px 2', []), FAILURE)
+            self.assertEqual(created, [])
+            # Counter overwrites only ``core``, so it raises exception
+            self.assertEqual(rule.attempt('d', []), FAILURE)
+            self.assertEqual(len(created), 1)
+            self.assertEqual(rule.validate('1 em'), '1 em')
+            self.assertRaises(IncorrectException, rule.validate, 'd')
+        finally:
+            TrustedException.__init__ = init
+        self.assertEqual(Counter(values=['a']).attempt('d', []), FAILURE)
+        self.assertEqual(List(values=['a'], default='x').attempt('d', []), 'x')
+        self.assertRaises(ElementException,
+            Or(rules=[String(element_exception=True, allow_empty=False)]).attempt, '', [])
+
+    def test_complex(self):
+        calls = []
+        class Counter(List):
+            def result(self, value, path):
+                calls.append(value)
+                return super(Counter, self).result(value, path)
+        def backtrack(rules, values, value_index=0, rule_index=0):
+            # Previous implementation without memoization
+            if value_index >= len(values):
+                return values[:]
+            if rule_index >= len(rules):
+                return None
+            value = rules[rule_index].attempt(values[value_index], [])
+            if value is not FAILURE:
+                result = backtrack(rules, values, value_index + 1, rule_index + 1)
+                if result is not None:
+                    result[value_index] = value
+                    return result
+            return backtrack(rules, values, value_index, rule_index + 1)
+        random = Random(16)
+        for index in xrange(300):
+            rules = [Counter(values=random.sample('abcd', random.randint(1, 3)))
+                for rule_index in xrange(random.randint(1, 6))]
+            values = [random.choice('abcdAB') for value_index in xrange(random.randint(1, 7))]
+            expected = backtrack(rules, values)
+            del calls[:]
+            rule = Complex(rules=rules)
+            if expected is None:
+                self.assertRaises(IncorrectException, rule.validate, ' '.join(values))
+            else:
+                self.assertEqual(rule.validate(' '.join(values)), ' '.join(expected))
+            self.assertTrue(len(calls) <= len(values) * len(rules))
+        # Time is linear in number of parts
+        rules = [Counter(values=['a', 'b']) for index in xrange(12)]
+        for count in [5, 10, 12, 50, 1000]:
+            del calls[:]
+            value = ' '.join(['a'] * (count - 1) + ['c'])
+            self.assertRaises(IncorrectException, Complex(rules=rules).validate, value)
+            self.assertTrue(len(calls) <= count * len(rules))
+        del calls[:]
+        self.assertRaises(IncorrectException, Complex(rules=rules, max_work=20).validate,
+            ' '.join(['a'] * 5 + ['c']))
+        self.assertEqual(len(calls), 20)
+        self.assertEqual(Complex(rules=rules, max_work=20).validate('a b'), 'a b')
+
     def test_style(self):
         text_decoration = List(values=['underline', 'line-through'],)
         simple_margin_top = RegExp(regexp=r'(\w+)$')
@@ -93,6 +260,30 @@ class TestClasses(unittest.TestCase):
             'text-decoration: underline; margin-top: 3;'
         )
 
+    def test_validator(self):
+        calls = []
+        class Counter(String):
+            def core(self, value, path):
+                calls.append(value)
+                return super(Counter, self).core(value, path)
+        rule = Element(rules={
+            'a': Counter(), 'b': Counter(), 'c': String(default='x'),
+        })
+        self.assertEqual([name for name, value in rule.absent_rules], ['c'])
+        self.assertEqual(
+            rule.validate([('B', '1'), ('a', '2'), ('b', '3'), ('e', '4')]),
+            [('b', '3'), ('a', '2'), ('c', 'x')])
+        self.assertEqual(calls, ['3', '2'])
+        rule = Element(rules={
+            'a': Counter(), 'd': String(element_exception=True),
+        })
+        self.assertRaises(IncorrectException, rule.validate, [('a', '1')])
+        self.assertEqual(
+            rule.validate([('a', '1'), ('d', '2')]), [('a', '1'), ('d', '2')])
+        self.assertTrue(Or(rules=[String(), String(default='')]).validates_absent())
+        self.assertFalse(Or(rules=[String(), List(values=['a'])]).validates_absent())
+        self.assertFalse(And(rules=[String(), String(default='')]).validates_absent())
+
     def tearDown(self):
         pass
 
@@ -340,6 +531,12 @@ class TestHtml(unittest.TestCase):
     def setUp(self):
         pass
 
+    def test_separate_elements(self):
+        custom = rules.html.custom
+        self.assertFalse(custom.pretty['p'] is custom.normal['p'])
+        self.assertFalse(custom.pretty['p'].rules is custom.pretty['div'].rules)
+        self.assertFalse(custom.pretty['script'] is custom.normal['script'])
+
     def test_values(self):
         self.assertEqual(rules.html.values.values['type'].validate('text/html'), 'text/html')
         self.assertEqual(rules.html.values.values['type'].validate('application/x-shockwave-Flash'), 'application/x-shockwave-Flash')
@@ -454,6 +651,20 @@ class TestHtml(unittest.TestCase):
             '<p><iframe width="425" height="349" src="http://www.youtube.com/embed/oFYhDogAzdM" frameborder="0"></iframe></p>')
 
 
+    def test_collapse(self):
+        self.assertEqual(rules.html.full.validate(
+            '<p>a' + '<span>' * 300 + '&nbsp;' + '</span>' * 300 + 'b</p>'),
+            u'<p>a\xa0b</p>')
+        self.assertEqual(rules.html.full.validate(
+            '<p>a ' + '<span> <em></em>' * 300 + '</span>' * 300 + ' b</p>'),
+            '<p>a b</p>')
+        self.assertEqual(rules.html.pretty.validate(
+            '<table><tr><td>' + '<span>' * 300 + ' ' + '</span>' * 300 + '</td></tr></table>'),
+            '<table><tr><td>&nbsp;</td></tr></table>')
+        self.assertEqual(rules.html.full.validate(
+            '<p>' + '<span>' * 300 + 'a' + '</span>' * 300 + '</p>'),
+            '<p>' + '<span>' * 300 + 'a' + '</span>' * 300 + '</p>')
+
     def test_pretty(self):
         self.assertEqual(rules.html.pretty.validate('a<dl><dd>b</dd></dl>c'), '<p>abc</p>')
         self.assertEqual(rules.html.pretty.validate(
@@ -551,23 +762,747 @@ class TestHtml(unittest.TestCase):
         pass
 
 
-class TestSignals(unittest.TestCase):
+# Pieces of random inputs for comparison of equivalent implementations.
+PIECES = [
+    '<p>', '</p>', '<span>', '</span>', '<div>', '</div>', '<font>', '</font>',
+    '<b>', '</b>', '<em>', '</em>', '<strong>', '</strong>', '<q>', '</q>',
+    '<h1>', '</h1>', '<pre>', '</pre>', '<address>', '</address>',
+    '<table>', '</table>', '<tr>', '</tr>', '<td>', '</td>', '<caption>', '</caption>',
+    '<ul>', '</ul>', '<li>', '</li>', '<dl>', '<dd>', '</dl>',
+    '<form>', '</form>', '<center>', '</center>', '<noindex>', '</noindex>',
+    '<html>', '<body>', '<script>', '</script>', '<!-- c -->', '<!',
+    '<a href="/x">', '</a>', '<img src="x.png">', '<br>', '<br />',
+    '<object>', '<param name="a" value="b">', '</object>',
+    '<p style="text-align: center">',
+    ' ', '  ', '\n', '\t', u'\xa0', 'a', 'b c', '<', '>', '"', "'", '&', '#106;',
+    '&nbsp;', '&amp;', '&lt;', '&#38;', '&#60;', '&#0;', 'x&#x26;y',
+]
+
+# Pieces of incorrect markup.
+MARKUP_PIECES = PIECES + [
+    '<br/>', '<a/b/', '<a/', '/', '<>', '</>', '</b x>', '<b\n>', '=', '"x"', "'y'",
+    '<i title=\'a>b\'>', '<i class=\'x"y\'>', '<b a=1 b c="&quot;&#65;&#300;&foo;&lt" d>',
+    '<a href="/x?a=1&b=2&amp;c=&lt;">', '&foo;', '&foo', '&#65', '&#x41;', '&copy;', '&apos;',
+    '<?', '<?xml', '?>', '<!-', '<!--', '-->', '--', '<!x', '<! x>', '<![CDATA[', ']]>',
+    '<![ x ]>', '<!DOCTYPE html>', '<!ELEMENT a>', '<!DOCTYPE a [<!ENTITY b "c">]>',
+    '<meta http-equiv="Content-Type" content="text/html; charset=koi8-r">', '</meta>',
+    '<textarea>', '</textarea>', '<ns:tag>', '</ns:tag>', '<dt>',
+]
+
+# Top-level blocks.
+BLOCKS = [
+    '<p>a</p>', '<p>b c</p>', '<p></p>', '<p>&nbsp;</p>', '<p> </p>',
+    '<ul><li>x</li></ul>', '<table><tr><td>t</td></tr></table>', '<h1>h</h1>',
+    '<p style="text-align: center">s</p>', '<pre> p </pre>', '<blockquote>q</blockquote>',
+    '<p><table><tr><td>n</td></tr></table></p>', '<p>x<p>y', '<p><br/></p>',
+    '<center>c</center>', '<div>d</div>', '<b>i</b>', 'text', '<meta>', '</>',
+    '<p/x/', '<!- x', '<! x>', '<ol><li>', '<li>z</li>', '\n', '\n', ' ',
+]
+
+
+def random_inputs(number, pieces=PIECES):
+    """
+    Returns list with ``tinymce_in`` and ``number`` random strings
+    joined from ``pieces``.
+    """
+    random = Random(0)
+    inputs = [tinymce_in]
+    for index in xrange(number):
+        inputs.append(u''.join([
+            random.choice(pieces)
+            for piece in xrange(random.randint(1, 25))]))
+    return inputs
+
+
+def get_result(function, value):
+    """
+    Returns result of ``function`` for ``value``
+    or class of raised TrustedException.
+    """
+    try:
+        return function(value)
+    except TrustedException, exception:
+        return exception.__class__
+
+
+class TestEngine(unittest.TestCase):
+    """
+    SINGLE_PASS engine must return the same results as ITERATIVE engine.
+    """
+
+    def test_engines(self):
+        inputs = random_inputs(200)
+        for name in ['full', 'normal', 'pretty']:
+            iterative = getattr(rules.html, name)
+            single = copy(iterative)
+            single.engine = Html.SINGLE_PASS
+            for value in inputs:
+                self.assertEqual(
+                    get_result(iterative.validate, value),
+                    get_result(single.validate, value), repr(value))
+
+    def test_transform(self):
+        inputs = random_inputs(300) + random_inputs(300, MARKUP_PIECES)
+        for name in ['full', 'normal', 'pretty']:
+            for parser in [Html.FAST_PARSER, Html.SOUP_PARSER]:
+                rule = copy(getattr(rules.html, name))
+                rule.parser = parser
+                for value in inputs:
+                    try:
+                        value = rule.prepare(value)
+                    except TrustedException:
+                        continue
+                    fused = unicode(rule.transform(rule.parse(value), [rule]))
+                    passes = unicode(rule.transform_passes(rule.parse(value), [rule]))
+                    self.assertEqual(fused, passes, repr(value))
+                    self.assertEqual(
+                        unicode(rule.transform(rule.parse(fused), [rule])),
+                        unicode(rule.transform_passes(rule.parse(fused), [rule])), repr(value))
+
+    def test_correct(self):
+        rule = rules.html.pretty
+        pieces = PIECES + ['\0', '\r\n', '\x01', '\x1f', '\x0b', u'\x85', '&#', '&#x']
+        random = Random(0)
+        for index in xrange(2000):
+            value = u''.join([
+                random.choice(pieces)
+                for piece in xrange(random.randint(1, 10))])
+            self.assertEqual(rule.correct(value), rule.correct_passes(value), repr(value))
+            self.assertEqual(rule.unescape(rule.escape(value)), rule.remove_spaces(value), repr(value))
+
+    def test_single_pass(self):
+        calls = []
+        class Counter(Html):
+            def parse(self, value):
+                calls.append(value)
+                return super(Counter, self).parse(value)
+        rule = Counter(rules=rules.html.custom.pretty, engine=Html.SINGLE_PASS,
+            root_tags=rules.html.contents.contents['body'])
+        self.assertEqual(rule.validate(tinymce_in), tinymce_pretty)
+        self.assertEqual(len(calls), 1)
+
+
+class TestSoupParser(TestHtml):
+    """
+    Runs TestHtml with SOUP_PARSER (FAST_PARSER is used by default).
+    """
+
     def setUp(self):
-        def done(sender, **kwargs):
-            pass
+        self.parsers = []
+        for name in ['full', 'normal', 'pretty']:
+            rule = getattr(rules.html, name)
+            self.parsers.append((rule, rule.parser))
+            rule.parser = Html.SOUP_PARSER
+            rule.compile()
 
-        def exception(sender, **kwargs):
+    def tearDown(self):
+        for rule, parser in self.parsers:
+            rule.parser = parser
+            rule.compile()
+
+
+class TestParser(unittest.TestCase):
+    """
+    FAST_PARSER must build the same trees as SOUP_PARSER.
+    """
+
+    def test_parse(self):
+        for value in random_inputs(500, MARKUP_PIECES) + [tinymce_in.encode('utf-8')]:
+            self.assertEqual(
+                unicode(Html.SOUP_PARSER.parse(value, Html.MARKUP_MASSAGE)),
+                unicode(Html.FAST_PARSER.parse(value, Html.MARKUP_MASSAGE)), repr(value))
+
+    def test_validate(self):
+        inputs = random_inputs(100, MARKUP_PIECES)
+        for name in ['full', 'normal', 'pretty']:
+            fast = copy(getattr(rules.html, name))
+            fast.parser = Html.FAST_PARSER
+            soup = copy(fast)
+            soup.parser = Html.SOUP_PARSER
+            for value in inputs:
+                self.assertEqual(
+                    get_result(soup.validate, value), get_result(fast.validate, value), repr(value))
+
+    def test_tree(self):
+        soup = Html.FAST_PARSER.parse(u'<p>a<b>b</b>c</p>', Html.MARKUP_MASSAGE)
+        p = soup.contents[0]
+        self.assertEqual([content.__class__ for content in p.contents],
+            [Html.FAST_PARSER.Text, Html.FAST_PARSER.Tag, Html.FAST_PARSER.Text])
+        p.contents[1].extract()
+        p.contents[1].replaceWith(u'd&')
+        p.insert(0, Html.FAST_PARSER.new_tag('br'))
+        self.assertEqual(unicode(soup), u'<p><br />ad&</p>')
+        self.assertTrue(p.contents[2].parent is p)
+
+    def test_operations(self):
+        for parser in [Html.SOUP_PARSER, Html.FAST_PARSER]:
+            soup = parser.parse(u'<div>a<b>b<i>c</i></b>d<br />e</div>', Html.MARKUP_MASSAGE)
+            div = soup.contents[0]
+            b = div.contents[1]
+            parser.unwrap(div, 1)
+            self.assertEqual(unicode(soup), u'<div>ab<i>c</i>d<br />e</div>')
+            self.assertTrue(div.contents[2].parent is div)
+            self.assertEqual(b.contents, [])
+            parser.replace(div, 0, u'x')
+            self.assertEqual(parser.remove(div, 4).name, 'br')
+            parser.enclose(div, 1, 4, 'p')
+            self.assertEqual(unicode(soup), u'<div>x<p>b<i>c</i>d</p>e</div>')
+            self.assertTrue(div.contents[1].parent is div)
+            self.assertTrue(div.contents[1].contents[1].parent is div.contents[1])
+            self.assertEqual(len(div.contents), 3)
+
+
+class TestStream(unittest.TestCase):
+    """
+    Html.stream must return the same results as Html.validate
+    for correct values and must not depend on size of chunks.
+    """
+
+    def stream(self, rule, value, chunk_size=65536):
+        output = StringIO()
+        rule.stream(value, output, chunk_size)
+        return output.getvalue()
+
+    def test_tinymce(self):
+        self.assertEqual(self.stream(rules.html.full, tinymce_in), tinymce_full)
+        for chunk_size in [1, 7, 100]:
+            self.assertEqual(
+                self.stream(rules.html.pretty, StringIO(tinymce_in.encode('utf-8')), chunk_size),
+                tinymce_pretty)
+
+    def test_collapse(self):
+        rule = rules.html.full
+        for value, result in [
+                (u' x <p>a <b> </b> c</p> ', u'<p>x </p><p>a c</p>'),
+                (u'<b>a</b> <i>b</i><p>c</p> d', u'<p><b>a</b><i>b</i></p><p>c</p><p> d</p>'),
+                (u'<p><b></b><i><u> </u></i>a <br /> </p>', u'<p> a <br /> </p>'),
+                (u'<script>a</script><span>b</span>', u'<p><span>b</span></p>'),
+                (u'<p>a<!-- b -->c&#x26;</p>', u'<p>ac&amp;</p>'),
+        ]:
+            self.assertEqual(rule.validate(value), result)
+            self.assertEqual(self.stream(rule, value), result)
+            self.assertEqual(self.stream(rule, value, 1), result)
+
+    def test_fixed(self):
+        inputs = random_inputs(100, MARKUP_PIECES)
+        for name in ['full', 'normal', 'pretty']:
+            rule = getattr(rules.html, name)
+            for value in inputs:
+                try:
+                    value = rule.validate(value)
+                except TrustedException:
+                    continue
+                self.assertEqual(self.stream(rule, value, 3), value, repr(value))
+
+    def test_chunks(self):
+        rule = rules.html.normal
+        for value in random_inputs(100, MARKUP_PIECES):
+            if "'a>b'" in value:
+                # Chunk can be split inside incorrect tag
+                continue
+            result = self.stream(rule, value)
+            for chunk_size in [1, 2, 5]:
+                self.assertEqual(self.stream(rule, value, chunk_size), result, repr(value))
+
+
+class TestIncremental(unittest.TestCase):
+    """
+    Html.validate_incremental must return the same results as Html.validate.
+    """
+
+    def test_random(self):
+        random = Random(0)
+        pieces = BLOCKS * 2 + PIECES
+        for index in xrange(600):
+            rule = copy(getattr(rules.html, random.choice(['full', 'normal', 'pretty'])))
+            rule._cache = False
+            rule.engine = random.choice([Html.ITERATIVE, Html.SINGLE_PASS])
+            rule.parser = random.choice([Html.FAST_PARSER, Html.SOUP_PARSER])
+            source = [random.choice(pieces) for piece in xrange(random.randint(0, 20))]
+            value = list(source)
+            for edit in xrange(random.randint(1, 3)):
+                position = random.randint(0, len(value))
+                if random.randint(0, 1) or not value:
+                    value.insert(position, random.choice(pieces))
+                elif random.randint(0, 1):
+                    del value[position - 1]
+                else:
+                    value[position - 1] = random.choice(pieces)
+            source = u''.join(source)
+            value = u''.join(value)
+            result = get_result(rule.validate, source)
+            if not isinstance(result, basestring):
+                continue
+            self.assertEqual(
+                get_result(lambda value: rule.validate_incremental(value, source, result), value),
+                get_result(rule.validate, value), repr((source, value)))
+
+    def test_blocks(self):
+        calls = []
+        class Counter(Html):
+            def core(self, value, path):
+                calls.append(value)
+                return super(Counter, self).core(value, path)
+        rule = Counter(rules=rules.html.custom.pretty, cache=False,
+            root_tags=rules.html.contents.contents['body'])
+        source = u''.join([u'<p>Paragraph %d</p>\n<p>&nbsp;</p>\n<ul><li>x</li></ul>\n' % index
+            for index in xrange(20)])
+        result = rule.validate(source)
+        value = source.replace('Paragraph 10', 'Paragraph <b>10</b>')
+        del calls[:]
+        self.assertEqual(rule.validate_incremental(value, source, result), rule.validate(value))
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(len(calls[0]) < len(value) / 4 and len(calls[1]) < len(value) / 4)
+        self.assertTrue(len(calls[0]) < len(source) / 5)
+        self.assertEqual(rule.validate_incremental(source, source, result), result)
+
+    def test_attributes(self):
+        rule = copy(rules.html.normal)
+        rule._cache = False
+        self.assertEqual(rule.split_blocks(u'<p>a</p><p><img src="<p>b</p><p>c</p>"</p>'), [0, 8])
+        source = u'<img src="i33.png"></p>\n<p>7</p<script</script<h1>"'
+        value = u'<img src="<\n<<p>7</p<script</script<h1>"'
+        self.assertEqual(rule.validate_incremental(value, source, rule.validate(source)),
+            rule.validate(value))
+
+
+class TestParallel(unittest.TestCase):
+    """
+    Html.validate_parallel must return the same results as validation in one process.
+    """
+
+    def test_random(self):
+        random = Random(0)
+        pieces = BLOCKS * 2 + PIECES
+        for index in xrange(50):
+            rule = copy(getattr(rules.html, random.choice(['full', 'normal', 'pretty'])))
+            rule._cache = False
+            rule.engine = random.choice([Html.ITERATIVE, Html.SINGLE_PASS])
+            rule.parser = random.choice([Html.FAST_PARSER, Html.SOUP_PARSER])
+            value = u''.join([random.choice(pieces) for piece in xrange(random.randint(0, 40))])
+            blocks = copy(rule)
+            blocks.parallel_size = 1
+            blocks.processes = random.randint(2, 4)
+            blocks.compile()
+            self.assertEqual(get_result(blocks.validate, value),
+                get_result(rule.validate, value), repr(value))
+
+    def test_regions(self):
+        rule = Html(rules=rules.html.custom.pretty, cache=False,
+            root_tags=rules.html.contents.contents['body'], processes=3)
+        value = tinymce_in * 5
+        expected = rule.validate(value)
+        self.assertFalse(rule.parallelizable(value))
+        rule.parallel_size = len(value) / 2
+        rule.compile()
+        self.assertTrue(rule.parallelizable(value))
+        self.assertEqual(rule.validate_parallel(value, None), expected)
+        self.assertEqual(rule.validate(value), expected)
+        rule.processes = 1
+        self.assertFalse(rule.parallelizable(value))
+
+    def test_attributes(self):
+        rule = copy(rules.html.full)
+        rule._cache = False
+        value = u'<p>a</p><p><img src="<p>b</p><p>c</p><p>d</p>"</p>'
+        blocks = copy(rule)
+        blocks.parallel_size = 1
+        blocks.processes = 2
+        blocks.compile()
+        self.assertEqual(blocks.validate(value), rule.validate(value))
+        self.assertTrue('<img src=' in blocks.validate(value))
+
+    def test_pool(self):
+        self.assertTrue(parallel.get_pool() is parallel.get_pool())
+
+    def test_pickled(self):
+        class Local(Html):
             pass
+        rule = Local(rules=rules.html.custom.pretty, cache=False,
+            root_tags=rules.html.contents.contents['body'], parallel_size=1, processes=2)
+        self.assertEqual(rule.pickled(), None)
+        self.assertEqual(rule.validate_parallel(tinymce_in, None), None)
+        serial = copy(rule)
+        serial.parallel_size = 0
+        self.assertEqual(rule.validate(tinymce_in), serial.validate(tinymce_in))
 
-        signals.rule_done.connect(done)
-        signals.rule_exception.connect(exception)
+    def test_signals(self):
+        rule = copy(rules.html.pretty)
+        rule.parallel_size = 1
+        rule.processes = 2
+        self.assertTrue(rule.parallelizable(tinymce_in))
+        def receiver(sender, **kwargs):
+            return kwargs['value']
+        signals.rule_done.connect(receiver, sender=RegExp)
+        try:
+            self.assertFalse(rule.parallelizable(tinymce_in))
+        finally:
+            signals.rule_done.disconnect(receiver, sender=RegExp)
+        self.assertTrue(rule.parallelizable(tinymce_in))
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        calls = self.calls = []
+        class Counter(Html):
+            def core(self, value, path):
+                calls.append(value)
+                return super(Counter, self).core(value, path)
+        self.cache = LruCache(size=2)
+        self.rule = Counter(rules=rules.html.custom.pretty, cache=self.cache,
+            root_tags=rules.html.contents.contents['body'])
+
+    def test_lru(self):
+        cache = LruCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_django(self):
+        cache = DjangoCache()
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', u'b')
+        self.assertEqual(cache.get('a'), u'b')
+        cache.clear()
+
+    def test_validate(self):
+        self.assertEqual(self.rule.validate(tinymce_in), tinymce_pretty)
+        self.assertEqual(self.rule.validate(tinymce_in), tinymce_pretty)
+        self.assertEqual(len(self.calls), 1)
+        self.rule.validate('<p>a</p>')
+        self.rule.validate('<p>b</p>')
+        self.assertEqual(self.rule.validate(tinymce_in), tinymce_pretty)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_fingerprint(self):
+        rule = Html(rules={'p': Element(rules={})}, cache=self.cache)
+        attribute = String(default='x')
+        fingerprint = rule.fingerprint()
+        self.assertEqual(rule.validate('<p>a</p>'), '<p>a</p>')
+        rule.rules['p'].rules['class'] = attribute
+        self.assertEqual(rule.fingerprint(), fingerprint)
+        rule.rules['p'].compile()
+        self.assertNotEqual(rule.fingerprint(), fingerprint)
+        self.assertEqual(rule.validate('<p>a</p>'), '<p class="x">a</p>')
+        fingerprint = rule.fingerprint()
+        rule.root_tags.append('div')
+        self.assertEqual(rule.fingerprint(), fingerprint)
+        rule.compile()
+        self.assertNotEqual(rule.fingerprint(), fingerprint)
+
+    def test_changes(self):
+        rule = Html(rules={'p': Element(rules={}), 'b': Element(rules={})}, cache=self.cache)
+        self.assertEqual(rule.validate('<p><b>a</b></p>'), '<p><b>a</b></p>')
+        rule.rules['b'].remove_element = True
+        self.assertEqual(rule.validate('<p><b>a</b></p>'), '<p>a</p>')
+        rule.rules['p'].rules['class'] = String(default='x')
+        rule.rules['p'].compile()
+        self.assertEqual(rule.validate('<p><b>a</b></p>'), '<p class="x">a</p>')
 
     def test_signals(self):
-        # Fix: add test        
-        pass
+        sources = []
+        def done(sender, rule, value, source, **kwargs):
+            sources.append(source)
+            return value
+        self.rule.validate('<p>a</p>')
+        signals.rule_done.connect(done, sender=Element)
+        try:
+            self.rule.validate('<p>a</p>')
+            self.rule.validate('<p>a</p>')
+        finally:
+            signals.rule_done.disconnect(done, sender=Element)
+        self.assertEqual(len(sources), 2)
+        self.assertEqual(len(self.calls), 3)
+        self.rule.validate('<p>a</p>')
+        self.assertEqual(len(self.calls), 3)
+
+    def test_disabled(self):
+        self.rule._cache = False
+        self.rule.validate('<p>a</p>')
+        self.rule.validate('<p>a</p>')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_memo_lru(self):
+        memo = Memo(size=2)
+        memo.set('a', 1)
+        memo.set('b', 2)
+        self.assertEqual(memo.get('a'), 1)
+        memo.set('c', 3)
+        memo.set('c', 4)
+        self.assertEqual(memo.get('b'), None)
+        self.assertEqual(memo.get('a'), 1)
+        self.assertEqual(memo.get('c'), 4)
+        self.assertEqual(memo.info(), {'hits': 3, 'misses': 1, 'count': 2, 'size': 2})
+        memo.clear()
+        self.assertEqual(memo.get('a'), None)
+
+    def test_memo(self):
+        calls = self.calls
+        class Counter(List):
+            def result(self, value, path):
+                calls.append(value)
+                return super(Counter, self).result(value, path)
+        rule = Counter(values=['a', 'b'], memo=10)
+        for index in xrange(2):
+            self.assertEqual(rule.validate(' A '), 'a')
+            self.assertRaises(IncorrectException, rule.validate, 'c')
+            self.assertEqual(rule.attempt('b', []), 'b')
+            self.assertEqual(rule.attempt('c', []), FAILURE)
+        self.assertEqual(calls, [u'A', u'c', u'b'])
+        self.assertEqual(rule._memo.info()['hits'], 5)
+        # Nobody must miss signals
+        def done(sender, rule, value, source, **kwargs):
+            return value.upper()
+        signals.rule_done.connect(done, sender=Counter)
+        try:
+            self.assertEqual(rule.validate(' A '), 'A')
+        finally:
+            signals.rule_done.disconnect(done, sender=Counter)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(rule.validate(' A '), 'a')
+        self.assertEqual(len(calls), 4)
+        # Rules that verify links are not pure
+        style = Style(rules={'background': Uri(verify_sites=True)}, memo=10)
+        self.assertFalse(style.memoizable('x'))
+        style = Style(rules={'color': Or(rules=[List(values=['b'], memo=10)])}, memo=10)
+        self.assertTrue(style.memoizable('x'))
+        self.assertEqual(style.validate('color: B'), 'color: b;')
+        self.assertEqual(style.validate('color: B'), 'color: b;')
+        self.assertEqual(memo_info(style), {'hits': 1, 'misses': 2, 'count': 2, 'rules': 2})
+        memoize(style, 0)
+        self.assertEqual(memo_info(style)['rules'], 0)
+
+
+class TestVerification(unittest.TestCase):
+    def setUp(self):
+        requests = self.requests = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                requests.append((self.command, self.path))
+                if self.path.startswith('/ok'):
+                    self.send_response(200)
+                else:
+                    self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_GET = do_HEAD
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        calls = self.calls = []
+        class Counter(verification.Verifier):
+            def check_many(self, urls):
+                calls.append(sorted(urls))
+                return super(Counter, self).check_many(urls)
+        self.verifier = Counter(cache=False, threads=2)
+        self.saved = verification._verifier[:]
+        verification._verifier[:] = [self.verifier]
+
+    def test_check_many(self):
+        urls = [self.url + 'ok1', self.url + 'ok2', self.url + 'dead']
+        self.assertEqual(self.verifier.check_many(urls), {
+            urls[0]: True, urls[1]: True, urls[2]: False})
+        self.assertEqual(sorted(self.requests), [
+            ('GET', '/dead'), ('HEAD', '/dead'), ('HEAD', '/ok1'), ('HEAD', '/ok2')])
+
+    def test_invalid_authority(self):
+        urls = ['http://user:pw@127.0.0.1/ok', 'http://127.0.0.1:abc/ok']
+        self.assertEqual(self.verifier.check_many(urls), {urls[0]: False, urls[1]: False})
+        rule = Uri(verify_sites=True, allow_sites=True)
+        for url in urls:
+            self.assertRaises(IncorrectException, rule.validate, url)
+
+    def test_cache(self):
+        verifier = verification.Verifier(cache='default')
+        verifier.cache.clear()
+        url = self.url + 'ok'
+        self.assertTrue(verifier.check(url))
+        self.assertTrue(verifier.check(url))
+        self.assertFalse(verifier.check(self.url + 'dead'))
+        self.assertFalse(verifier.check(self.url + 'dead'))
+        self.assertEqual(len(self.requests), 3)
+        verifier.cache.clear()
+
+    def test_html(self):
+        rule = Html(rules={
+            'p': Element(rules={}),
+            'a': Element(rules={'href': Uri(verify_sites=True, allow_sites=True)}),
+        })
+        self.assertEqual(rule.validate(
+            '<p><a href="%sok">a</a><a href="%sdead">b</a>'
+            '<a href="%sok">c</a></p>' % (self.url, self.url, self.url)),
+            '<p><a href="%sok">a</a><a>b</a><a href="%sok">c</a></p>' % (self.url, self.url))
+        self.assertEqual(self.calls, [[self.url + 'dead', self.url + 'ok']])
+        self.assertEqual(rule.validate('<p>a</p>'), '<p>a</p>')
+        self.assertEqual(len(self.calls), 1)
 
     def tearDown(self):
-        pass
+        verification._verifier[:] = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestSignals(unittest.TestCase):
+    def setUp(self):
+        self.calls = calls = []
+        def done(sender, rule, value, source, **kwargs):
+            calls.append(('done', sender, value))
+            return value.upper()
+
+        def exception(sender, rule, value, source, exception, **kwargs):
+            calls.append(('exception', sender, value))
+
+        self.done = done
+        self.exception = exception
+
+    def test_signals(self):
+        signals.rule_done.connect(self.done, sender=List)
+        signals.rule_exception.connect(self.exception, sender=List)
+        rule = List(values=['a', 'b'])
+        self.assertEqual(rule.validate('a'), 'A')
+        self.assertRaises(IncorrectException, rule.validate, 'c')
+        self.assertEqual(String().validate('a'), 'a')
+        self.assertEqual(self.calls, [('done', List, 'a'), ('exception', List, 'c')])
+
+    def test_path(self):
+        paths = []
+        def done(sender, rule, value, source, path, **kwargs):
+            paths.append(path)
+            return value
+        self.done = done
+        signals.rule_done.connect(self.done, sender=List)
+        inner = Or(rules=[List(values=['a']), RegExp(regexp=r'(\d+)$')])
+        outer = And(rules=[inner])
+        self.assertEqual(outer.validate('a', ['root']), 'a')
+        self.assertEqual(paths, [['root', outer, inner]])
+        self.assertTrue(isinstance(paths[0], list))
+        path = Path(Path([1], 2), 3)
+        self.assertEqual(path, [1, 2, 3])
+        self.assertEqual((len(path), path[-1], path[:2], path + [4]), (3, 3, [1, 2], [1, 2, 3, 4]))
+
+    def test_listeners(self):
+        self.assertFalse(signals.rule_done.has_listeners(RegExp))
+        signals.rule_done.connect(self.done, sender=RegExp)
+        self.assertTrue(signals.rule_done.has_listeners(RegExp))
+        self.assertFalse(signals.rule_done.has_listeners(List))
+        signals.rule_done.disconnect(self.done, sender=RegExp)
+        self.assertFalse(signals.rule_done.has_listeners(RegExp))
+        signals.rule_done.connect(self.done)
+        self.assertTrue(signals.rule_done.has_listeners(List))
+        del self.done
+        self.assertFalse(signals.rule_done.has_listeners(List))
+
+    def test_listeners_race(self):
+        # Receiver is connected by other thread while answer is calculated.
+        def receiver(sender, **kwargs):
+            return kwargs['value']
+        class Signal(signals.RuleSignal):
+            def listens(self, sender, receivers):
+                result = super(Signal, self).listens(sender, receivers)
+                if not self.receivers:
+                    self.connect(receiver, sender=sender)
+                return result
+        signal = Signal()
+        self.assertFalse(signal.has_listeners(RegExp))
+        self.assertTrue(signal.has_listeners(RegExp))
+
+    def tearDown(self):
+        for signal, receiver in [
+                (signals.rule_done, getattr(self, 'done', None)),
+                (signals.rule_exception, self.exception)]:
+            for sender in [None, List, RegExp]:
+                signal.disconnect(receiver, sender=sender)
+
+
+class TestPrecompiled(unittest.TestCase):
+    def setUp(self):
+        descriptor, self.path = tempfile.mkstemp()
+        os.close(descriptor)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_load(self):
+        presets = dict([(name, getattr(rules.html, name))
+            for name in precompiled.PRESETS])
+        precompiled.dump(presets, self.path)
+        loaded = precompiled.load(self.path)
+        self.assertEqual(sorted(loaded), ['full', 'normal', 'pretty'])
+        for name, rule in presets.iteritems():
+            loaded[name]._cache = False
+            for value in [tinymce_in] + random_inputs(20, MARKUP_PIECES):
+                try:
+                    result = rule.validate(value)
+                except TrustedException, error:
+                    result = error.__class__
+                try:
+                    self.assertEqual(loaded[name].validate(value), result, repr(value))
+                except TrustedException, error:
+                    self.assertEqual(error.__class__, result, repr(value))
+
+    def test_patterns(self):
+        rule = Or(rules=[
+            RegExp(regexp=r'(?P<n>rgb)\((\d+)\)$', expand=r'\g<n>:\2'),
+            RegExp(regexp=r'(\d+)px$'),
+            Sequence(rule=List(values=['a', 'b']), regexp=r'\s*,\s*', join_string=','),
+        ])
+        memoize(rule, 10)
+        self.assertEqual(rule.validate('12px'), '12')
+        precompiled.dump({'rule': rule}, self.path)
+        loaded = precompiled.load(self.path)['rule']
+        # Stored results are not saved
+        self.assertEqual(memo_info(loaded)['count'], 0)
+        self.assertEqual(loaded.validate('RGB(12)'), 'RGB:12')
+        self.assertEqual(loaded.validate('12px'), '12')
+        self.assertEqual(loaded.validate('A , b'), 'a,b')
+        self.assertRaises(IncorrectException, loaded.validate, 'c')
+        self.assertEqual(loaded.rules[0].compiled.groupindex, {'n': 1})
+
+    def test_fingerprint(self):
+        self.assertEqual(precompiled.load(self.path), None)
+        self.assertEqual(precompiled.load(self.path + '.absent'), None)
+        precompiled.dump({'rule': List(values=['a'])}, self.path)
+        self.assertNotEqual(precompiled.load(self.path), None)
+        memo_size = settings.TRUSTEDHTML_MEMO_SIZE
+        settings.TRUSTEDHTML_MEMO_SIZE = memo_size + 1
+        try:
+            self.assertEqual(precompiled.load(self.path), None)
+        finally:
+            settings.TRUSTEDHTML_MEMO_SIZE = memo_size
+        rules_version = settings.TRUSTEDHTML_RULES_VERSION
+        settings.TRUSTEDHTML_RULES_VERSION = 2
+        try:
+            self.assertEqual(precompiled.load(self.path), None)
+        finally:
+            settings.TRUSTEDHTML_RULES_VERSION = rules_version
+
+    def test_damaged(self):
+        precompiled.dump({'rule': List(values=['a'])}, self.path)
+        data = open(self.path, 'rb').read()
+        for damaged in [data[:len(data) / 2], data[:-1], data[:-20] + '\xff' * 20]:
+            output = open(self.path, 'wb')
+            try:
+                output.write(damaged)
+            finally:
+                output.close()
+            self.assertEqual(precompiled.load(self.path), None)
 
 
 def get_html(html, type='Transitional'):
@@ -332,3 +332,30 @@ def get_dict(source, leave=None, remove=None, append={}):
         result[name] = value
     result.update(append)
     return result
+
+def common_prefix(first, second):
+    """
+    Returns length of common prefix of strings.
+    Strings are compared by parts, each part is half of the rest.
+    """
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def common_suffix(first, second, limit):
+    """
+    Returns length of common suffix of strings, but not more than ``limit``.
+    """
+    low, high = 0, min(len(first), len(second), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[len(first) - middle:len(first) - low] == second[len(second) - middle:len(second) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
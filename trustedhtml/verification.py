@@ -0,0 +1,321 @@
+"""
+Verification of remote links for ``Uri`` rules.
+
+``Html`` validates value in two passes if it contains links to be verified:
+first pass collects such links, then all of them are checked concurrently
+(links to the same host reuse connection) and second pass uses results.
+Results are stored in Django`s cache, so links will not be checked
+on each validation.
+"""
+
+import httplib
+import threading
+import urllib2
+import urlparse
+from Queue import Queue, Empty
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from trustedhtml import settings
+
+HEADERS = {
+    'Accept': 'text/xml,application/xml,application/xhtml+xml,text/html;q=0.9,text/plain;q=0.8,image/png,*/*;q=0.5',
+    'Accept-Language': 'en-us,en;q=0.5',
+    'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
+    'User-Agent': 'Urlmethos',
+}
+
+CONNECTIONS = {
+    'http': httplib.HTTPConnection,
+    'https': httplib.HTTPSConnection,
+}
+
+
+def get_digest(url):
+    """Returns hex digest of ``url``."""
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return sha1(url).hexdigest()
+
+
+class Verifier(object):
+    """
+    Checks whether remote links are available.
+    """
+
+    def __init__(
+            self, threads=None, timeout=None, cache=None,
+            cache_timeout=None, negative_timeout=None):
+        """
+        ``threads`` is maximum number of simultaneous connections.
+
+        ``timeout`` is timeout for connections in seconds.
+
+        ``cache`` is name of cache in CACHES setting
+        or False to disable cache.
+
+        ``cache_timeout`` is lifetime of positive results in seconds.
+
+        ``negative_timeout`` is lifetime of negative results in seconds.
+
+        None is used to get default value from settings.py.
+        """
+        if threads is None:
+            threads = settings.TRUSTEDHTML_VERIFY_THREADS
+        if timeout is None:
+            timeout = settings.TRUSTEDHTML_VERIFY_TIMEOUT
+        if cache is None:
+            cache = settings.TRUSTEDHTML_VERIFY_CACHE
+        if cache_timeout is None:
+            cache_timeout = settings.TRUSTEDHTML_VERIFY_CACHE_TIMEOUT
+        if negative_timeout is None:
+            negative_timeout = settings.TRUSTEDHTML_VERIFY_NEGATIVE_TIMEOUT
+        self.threads = threads
+        self.timeout = timeout
+        if cache is False:
+            self.cache = None
+        else:
+            from django.core.cache import get_cache
+            self.cache = get_cache(cache)
+        self.cache_timeout = cache_timeout
+        self.negative_timeout = negative_timeout
+
+    def make_key(self, url):
+        return 'trustedhtml:verify:%s' % get_digest(url)
+
+    def get_cached(self, urls):
+        """
+        Returns dictionary with cached results for ``urls``.
+        """
+        if self.cache is None or not urls:
+            return {}
+        keys = dict([(self.make_key(url), url) for url in urls])
+        cached = self.cache.get_many(keys.keys())
+        return dict([(keys[key], bool(value)) for key, value in cached.iteritems()])
+
+    def set_cached(self, results):
+        if self.cache is None:
+            return
+        for url, result in results.iteritems():
+            if result:
+                timeout = self.cache_timeout
+            else:
+                timeout = self.negative_timeout
+            self.cache.set(self.make_key(url), int(result), timeout)
+
+    def check(self, url):
+        """
+        Returns whether ``url`` is available.
+        """
+        return self.check_many([url])[url]
+
+    def check_many(self, urls):
+        """
+        Returns dictionary with results for each of ``urls``.
+        Links that are not cached will be checked concurrently.
+        """
+        results = self.get_cached(urls)
+        groups = {}
+        for url in urls:
+            if url not in results:
+                groups.setdefault(self.get_host(url), []).append(url)
+        if not groups:
+            return results
+        checked = {}
+        queue = Queue()
+        for group in groups.itervalues():
+            queue.put(group)
+
+        def worker():
+            while True:
+                try:
+                    group = queue.get_nowait()
+                except Empty:
+                    return
+                checked.update(self.fetch_group(group))
+
+        threads = []
+        for index in xrange(min(self.threads, len(groups)) - 1):
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        worker()
+        for thread in threads:
+            thread.join()
+        self.set_cached(checked)
+        results.update(checked)
+        return results
+
+    @staticmethod
+    def get_host(url):
+        """Returns (scheme, authority) for ``url``."""
+        parts = urlparse.urlsplit(url)
+        return parts[0].lower(), parts[1].lower()
+
+    def fetch_group(self, urls):
+        """
+        Checks ``urls`` with the same scheme and host
+        through one persistent connection.
+        Returns dictionary with results.
+        """
+        results = {}
+        scheme, authority = self.get_host(urls[0])
+        if scheme not in CONNECTIONS:
+            for url in urls:
+                results[url] = self.fetch(url)
+            return results
+        connection = None
+        for url in urls:
+            parts = urlparse.urlsplit(url)
+            target = urlparse.urlunsplit(('', '', parts[2] or '/', parts[3], ''))
+            status = None
+            for attempt in xrange(2):
+                try:
+                    if connection is None:
+                        # InvalidURL is raised for wrong port or user info.
+                        connection = CONNECTIONS[scheme](authority, timeout=self.timeout)
+                    connection.request('HEAD', target, headers=HEADERS)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                    if response.getheader('connection', '').lower() == 'close':
+                        connection.close()
+                        connection = None
+                    break
+                except (httplib.HTTPException, EnvironmentError, ValueError):
+                    # Kept alive connection can be closed by server.
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+            if status is not None and 200 <= status < 300:
+                results[url] = True
+            else:
+                # Redirects, errors and servers that don`t support HEAD.
+                results[url] = self.fetch(url)
+        if connection is not None:
+            connection.close()
+        return results
+
+    def fetch(self, url):
+        """
+        Tries to fetch ``url``.
+        Returns True if success.
+        """
+        headers = dict(HEADERS)
+        headers['Connection'] = 'close'
+        try:
+            request = urllib2.Request(url, None, headers)
+            urllib2.urlopen(request, timeout=self.timeout).close()
+        except Exception:  # ValueError, urllib2.URLError, httplib.InvalidURL, etc.
+            return False
+        return True
+
+
+_verifier = []
+
+
+def get_verifier():
+    """
+    Returns verifier with default settings.
+    """
+    if not _verifier:
+        _verifier.append(Verifier())
+    return _verifier[0]
+
+
+_local = threading.local()
+
+
+def remote_check(url, text=None):
+    """
+    Returns whether ``url`` is available.
+    ``text`` is the link as it is written in validated html
+    (without scheme or with other host than ``url``), it is stored
+    with deferred link, so that rows with it can be found.
+    While the first pass of ``collect`` link will be collected
+    and considered as available.
+    If TRUSTEDHTML_VERIFY_DEFERRED is True link will be checked by ``defer``.
+    """
+    verifier = get_verifier()
+    results = getattr(_local, 'results', None)
+    if settings.TRUSTEDHTML_VERIFY_DEFERRED:
+        if results is None:
+            return defer(url, text)
+        if url not in results:
+            results[url] = defer(url, text)
+        return results[url]
+    if results is not None:
+        if url in results:
+            return results[url]
+        if _local.collected is not None:
+            results.update(verifier.get_cached([url]))
+            if url in results:
+                return results[url]
+            _local.collected.add(url)
+            return True
+    result = verifier.check(url)
+    if results is not None:
+        results[url] = result
+    return result
+
+
+def defer(url, text=None):
+    """
+    Returns known result for ``url``.
+    Otherwise adds ``url`` and ``text`` (see ``remote_check``)
+    to the queue of links to be checked by ``trusted_verify_links`` command
+    and considers it as available.
+    """
+    from trustedhtml.models import Link
+    cached = get_verifier().get_cached([url])
+    if url in cached:
+        return cached[url]
+    if text is None:
+        text = url
+    link, created = Link.objects.get_or_create(
+        digest=get_digest(url + '\n' + text), defaults={'url': url, 'text': text})
+    if link.available is None:
+        _local.deferred = deferred() + 1
+    return link.available is not False
+
+
+def deferred():
+    """
+    Returns number of links that was considered as available
+    without check in this thread.
+    Results of validation with such links must not be cached.
+    """
+    return getattr(_local, 'deferred', 0)
+
+
+def collect(function, *args, **kwargs):
+    """
+    Calls ``function`` and returns its result.
+    If ``remote_check`` was called while calling
+    than links will be checked concurrently
+    and ``function`` will be called again.
+    """
+    if getattr(_local, 'results', None) is not None:
+        # Links are collected by outer call.
+        return function(*args, **kwargs)
+    _local.results = {}
+    _local.collected = set()
+    try:
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            if not _local.collected:
+                raise
+        else:
+            if not _local.collected:
+                return result
+        _local.results.update(get_verifier().check_many(list(_local.collected)))
+        _local.collected = None
+        return function(*args, **kwargs)
+    finally:
+        _local.results = None
+        _local.collected = None